@@ -0,0 +1,26 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Offline benchmarks of the REST interface and the Infrastructure Manager.
+
+The benchmarks run in a single process, without a message queue, database or
+cloud: the UDS, the info broker, the resource handler and the config manager
+are replaced by in-memory stand-ins (see :mod:`benchmarks.fakes`). Run all of
+them with::
+
+    python -m benchmarks.run -o results.json
+
+See ``python -m benchmarks.run --help`` for the parameters.
+"""
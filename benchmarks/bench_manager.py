@@ -0,0 +1,65 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Time of attaching the Infrastructure Manager to, and detaching it from, a
+number of infrastructures.
+
+The Enactor is replaced by a stub making empty passes, so the measurements
+cover the bookkeeping of the manager and the cost of starting and stopping
+the maintenance processes (or scheduler entries), not the passes themselves.
+"""
+
+import time
+
+def time_operation(operation, infra_ids):
+    latencies = list()
+    started = time.time()
+    for infra_id in infra_ids:
+        t = time.time()
+        operation(infra_id)
+        latencies.append(time.time() - t)
+    elapsed = time.time() - started
+    latencies.sort()
+    ms = lambda v: round(v * 1000.0, 3)
+    return dict(total_s=round(elapsed, 3),
+                per_op_ms=ms(elapsed / len(infra_ids)),
+                p99_ms=ms(latencies[min(len(latencies) - 1,
+                                        int(len(latencies) * 0.99))]),
+                max_ms=ms(latencies[-1]))
+
+def run(sizes=(10, 100, 1000), modes=('scheduler', 'process'),
+        pass_duration=0):
+    """
+    Attach a new manager to ``size`` infrastructures, then detach it from all
+    of them, for each size and maintenance mode.
+
+    :return: The list of the measurements.
+    """
+    from occo.api.manager import InfrastructureManager
+    from benchmarks import fakes
+    results = list()
+    for mode in modes:
+        for size in sizes:
+            store = fakes.Store(size, nodes=1, instances=1)
+            fakes.install(store, pass_duration=pass_duration)
+            manager = InfrastructureManager(mode=mode, enactor_interval=3600,
+                                            stagger=False)
+            infra_ids = store.infra_ids
+            attach = time_operation(manager.attach, infra_ids)
+            detach = time_operation(manager.detach, infra_ids)
+            manager.shutdown()
+            results.append(dict(mode=mode, infrastructures=size,
+                                attach=attach, detach=detach))
+    return results
@@ -0,0 +1,132 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Throughput and latency of the REST routes.
+
+The requests are sent through the Flask test client, so the measurements
+include the routing and the handlers, but not the HTTP server.
+
+Routes creating or deleting infrastructures, and the event stream, are not
+measured: they depend on the compiler and on long-lived connections,
+respectively.
+"""
+
+import argparse
+import threading
+import time
+
+ROUTES = [
+    ('list', 'GET', '/infrastructures/'),
+    ('list_detail', 'GET', '/infrastructures/?detail=true'),
+    ('report', 'GET', '/infrastructures/{infra_id}'),
+    ('cost', 'GET', '/infrastructures/{infra_id}/cost'),
+    ('scaleup', 'POST', '/infrastructures/{infra_id}/scaleup/{node}'),
+    ('scaledown', 'POST', '/infrastructures/{infra_id}/scaledown/{node}'),
+    ('scaleto', 'POST', '/infrastructures/{infra_id}/scaleto/{node}/2'),
+    ('notify', 'POST', '/infrastructures/{infra_id}/notify'),
+    ('info', 'GET', '/info/echo?value=1'),
+    ('metrics', 'GET', '/metrics'),
+]
+"""``(name, method, url)`` of the measured routes."""
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000.0, 3)
+    return dict(requests=len(latencies),
+                errors=errors,
+                rps=round(len(latencies) / elapsed, 1) if elapsed else None,
+                p50_ms=ms(percentile(latencies, 50)),
+                p95_ms=ms(percentile(latencies, 95)),
+                p99_ms=ms(percentile(latencies, 99)),
+                max_ms=ms(latencies[-1]))
+
+def failed(response):
+    """
+    Check whether a request failed: handled errors of the REST interface are
+    returned with ``200 OK``, and the error (``status_code`` and ``reason``)
+    in the body.
+    """
+    if response.status_code >= 400:
+        return True
+    body = response.get_json(silent=True)
+    return isinstance(body, dict) and 'status_code' in body \
+        and 'reason' in body
+
+def measure(app, method, urls, requests, concurrency):
+    """
+    Send ``requests`` requests from ``concurrency`` threads, each using its
+    own test client. ``urls`` are used in a round-robin fashion.
+    """
+    latencies, errors = list(), [0]
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def worker(offset):
+        client = app.test_client()
+        local, failures = list(), 0
+        for i in range(per_thread):
+            url = urls[(offset + i) % len(urls)]
+            started = time.time()
+            response = client.open(url, method=method, json=dict())
+            local.append(time.time() - started)
+            if failed(response):
+                failures += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failures
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(concurrency)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, time.time() - started, errors[0])
+
+def setup(store, rest_config=None, cost_latency=0):
+    """
+    Initialize the REST interface on top of the stand-ins.
+    """
+    import occo.api.occoapp as occoapp
+    import occo.api.rest as rest
+    from benchmarks import fakes
+    occoapp.configuration = dict(components=dict(rest=rest_config or dict()))
+    occoapp.args = argparse.Namespace(strategy='sequential')
+    fakes.install(store, cost_latency=cost_latency)
+    rest.init('sequential')
+    return rest.app
+
+def run(infrastructures=10, requests=1000, concurrency=1, cost_latency=0,
+        rest_config=None):
+    """
+    Measure each route in :data:`ROUTES`.
+
+    :return: A dictionary mapping the route names to their measurements.
+    """
+    from benchmarks import fakes
+    store = fakes.Store(infrastructures)
+    app = setup(store, rest_config, cost_latency)
+    app.test_client().get('/infrastructures/')  # warm up
+    results = dict()
+    for name, method, url in ROUTES:
+        urls = [url.format(infra_id=infra_id, node='node-0')
+                for infra_id in store.infra_ids]
+        results[name] = measure(app, method, urls, requests, concurrency)
+        results[name].update(method=method, route=url)
+    return results
@@ -0,0 +1,222 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+In-memory stand-ins of the Occopus services used by the API layer.
+
+:func:`install` plugs them in the places where :func:`occo.api.occoapp.setup`
+would put the real services, so the REST interface and the Infrastructure
+Manager can be exercised without any backing infrastructure.
+"""
+
+import threading
+import time
+
+class FakeStaticDescription(object):
+    def __init__(self, infra_id, node_names):
+        self.infra_id = infra_id
+        self.name = infra_id
+        self.nodes = [dict(name=name) for name in node_names]
+
+class Store(object):
+    """
+    The state of the fake infrastructures, shared by the stand-ins.
+
+    :param int infrastructures: The number of infrastructures to create.
+    :param int nodes: The number of nodes per infrastructure.
+    :param int instances: The number of instances per node.
+    """
+    def __init__(self, infrastructures=10, nodes=3, instances=2):
+        self.lock = threading.Lock()
+        self.descriptions = dict()
+        self.state = dict()
+        self.targets = dict()
+        self.notifications = dict()
+        for i in range(infrastructures):
+            self.create('infra-{0}'.format(i), nodes, instances)
+
+    def create(self, infra_id, nodes, instances):
+        names = ['node-{0}'.format(n) for n in range(nodes)]
+        self.descriptions[infra_id] = FakeStaticDescription(infra_id, names)
+        self.state[infra_id] = dict(
+            (name, dict(('{0}-{1}-{2}'.format(infra_id, name, i),
+                         dict(node_id='{0}-{1}-{2}'.format(infra_id, name, i),
+                              state='ready',
+                              resource_address='10.0.{0}.{1}'.format(n, i)))
+                        for i in range(instances)))
+            for n, name in enumerate(names))
+        for name in names:
+            self.targets[(infra_id, name)] = instances
+
+    @property
+    def infra_ids(self):
+        return list(self.descriptions)
+
+class FakeUDS(object):
+    def __init__(self, store):
+        self.store = store
+
+    def add_infrastructure(self, static_description):
+        with self.store.lock:
+            self.store.descriptions[static_description.infra_id] = \
+                static_description
+            self.store.state.setdefault(static_description.infra_id, dict())
+
+    update_infrastructure = add_infrastructure
+
+    def remove_infrastructure(self, infra_id):
+        with self.store.lock:
+            self.store.descriptions.pop(infra_id, None)
+            self.store.state.pop(infra_id, None)
+
+    def get_static_description(self, infra_id):
+        return self.store.descriptions[infra_id]
+
+    def set_infrastructure_notification(self, infra_id, notify_info):
+        self.store.notifications[infra_id] = notify_info
+
+class FakeInfoBroker(object):
+    """
+    Serves the info keys used by the API layer from the :class:`Store`.
+    Unknown keys evaluate to their parameters, like the echo provider of the
+    tests.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key, *args, **kwargs):
+        infra_id = kwargs.get('infra_id', args[0] if args else None)
+        if key == 'infrastructure.state':
+            return self.store.state[infra_id]
+        elif key == 'infrastructure.node_instances':
+            return self.store.state[infra_id]
+        elif key == 'infrastructure.static_description':
+            return self.store.descriptions[infra_id]
+        return dict(key=key, args=list(args), kwargs=kwargs)
+
+class FakeResourceHandler(object):
+    """
+    :param float latency: The number of seconds a cost query takes.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    def get_cost(self, instance_data):
+        if self.latency:
+            time.sleep(self.latency)
+        return 0.1
+
+class FakeConfigManager(object):
+    pass
+
+class FakeInfralist(object):
+    def __init__(self, store):
+        self.store = store
+
+    def __call__(self):
+        return self
+
+    def get(self):
+        return self.store.infra_ids
+
+    def add(self, infra_id):
+        pass
+
+    def remove(self, infra_id):
+        pass
+
+class FakeScaling(object):
+    """Stand-in of :mod:`occo.enactor.scaling`, storing the requests in the
+    :class:`Store`."""
+    def __init__(self, store):
+        self.store = store
+
+    def report(self, instances):
+        node_ids = list(instances)
+        if not node_ids:
+            return dict(actual=0, target=0)
+        infra_id, name = self.node_of(node_ids[0])
+        return dict(actual=len(node_ids),
+                    target=self.store.targets.get((infra_id, name)))
+
+    def node_of(self, node_id):
+        infra_id, rest = node_id.split('-node-', 1)
+        return infra_id, 'node-' + rest.rsplit('-', 1)[0]
+
+    def add_createnode_request(self, infra_id, node_name, count=1):
+        with self.store.lock:
+            self.store.targets[(infra_id, node_name)] += count
+
+    def add_dropnode_request(self, infra_id, node_name, node_id=None):
+        with self.store.lock:
+            self.store.targets[(infra_id, node_name)] -= 1
+
+    def set_scalenode_request(self, infra_id, node_name, count):
+        with self.store.lock:
+            self.store.targets[(infra_id, node_name)] = count
+
+class StubInfraProcessor(object):
+    """Accepts and discards all instructions."""
+    @classmethod
+    def instantiate(cls, *args, **kwargs):
+        return cls()
+
+    def push_instructions(self, infra_id, instructions):
+        pass
+
+    def cancel_pending(self):
+        pass
+
+    def cri_drop_node(self, node):
+        return ('drop_node', node)
+
+    def cri_drop_infrastructure(self, infra_id):
+        return ('drop_infrastructure', infra_id)
+
+class StubEnactor(object):
+    """
+    Makes passes that produce no instructions.
+
+    :param float pass_duration: The number of seconds a pass takes.
+    """
+    pass_duration = 0
+
+    def __init__(self, infra_id, infraprocessor, *args, **kwargs):
+        self.infra_id = infra_id
+        self.infraprocessor = infraprocessor
+
+    def make_a_pass(self):
+        if self.pass_duration:
+            time.sleep(self.pass_duration)
+
+def install(store, cost_latency=0, pass_duration=0):
+    """
+    Replace the services used by the API layer with stand-ins backed by
+    ``store``.
+    """
+    import occo.infobroker as ib
+    import occo.util
+    import occo.enactor
+    import occo.infraprocessor
+    import occo.api.rest as rest
+
+    ib.real_main_info_broker = FakeInfoBroker(store)
+    ib.real_main_uds = FakeUDS(store)
+    ib.real_main_resourcehandler = FakeResourceHandler(cost_latency)
+    ib.real_main_configmanager = FakeConfigManager()
+    occo.util.Infralist = FakeInfralist(store)
+    rest.scaling = FakeScaling(store)
+    StubEnactor.pass_duration = pass_duration
+    occo.enactor.Enactor = StubEnactor
+    occo.infraprocessor.InfraProcessor = StubInfraProcessor
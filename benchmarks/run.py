@@ -0,0 +1,79 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Run the benchmarks, and write the results as JSON.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-o', '--output', default=None,
+                        help='Write the results to this file '
+                             '(default: standard output)')
+    parser.add_argument('--only', choices=['rest', 'manager'], default=None,
+                        help='Run only one of the benchmarks')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Number of requests per REST route')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of concurrent REST clients')
+    parser.add_argument('--infrastructures', type=int, default=10,
+                        help='Number of infrastructures served by the REST '
+                             'interface')
+    parser.add_argument('--cost-latency', type=float, default=0,
+                        help='Simulated latency of cost queries (seconds)')
+    parser.add_argument('--sizes', type=int_list, default=[10, 100, 1000],
+                        help='Numbers of infrastructures to attach the '
+                             'manager to (comma separated)')
+    parser.add_argument('--modes', default='scheduler,process',
+                        help='Maintenance modes of the manager '
+                             '(comma separated)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.WARNING)
+    results = dict(meta=dict(timestamp=time.time(),
+                             python=platform.python_version(),
+                             platform=platform.platform(),
+                             parameters=vars(args)))
+    if args.only in (None, 'rest'):
+        from benchmarks import bench_rest
+        results['rest'] = bench_rest.run(
+            infrastructures=args.infrastructures,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            cost_latency=args.cost_latency)
+    if args.only in (None, 'manager'):
+        from benchmarks import bench_manager
+        results['manager'] = bench_manager.run(
+            sizes=args.sizes, modes=args.modes.split(','))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+In-process caches used by the API layer.
+
+The caches here only hold data that is also kept in, or can be derived
+from, the backing store (the UDS or the infrastructure list); they are used
+to avoid storage round trips and recomputation on hot paths. The backing
+store is always accessed through a callable passed to the cache, so the caches
+do not depend on any particular storage.
+"""
+
+__all__ = ['InfrastructureIndex', 'NodeNameCache', 'TTLCache',
+           'CompilationCache']
+
+import threading
+import time
+import copy
+import hashlib
+import json
+import os
+import pickle
+import uuid
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger('occo.api.cache')
+
+class InfrastructureIndex(object):
+    """
+    In-memory set of the identifiers of existing infrastructures.
+
+    Lookups are served from memory. The index is revalidated against the
+    backing store when it is older than ``refresh_interval``; unknown
+    identifiers also trigger a revalidation, but at most once per
+    ``miss_refresh_interval``, so infrastructures created by other processes
+    (e.g. ``occopus-build``) are found quickly without letting lookups of
+    unknown identifiers hit the storage on every request.
+
+    :param callable load: Returns the list of infrastructure identifiers from
+        the backing store (e.g. ``util.Infralist().get``).
+    :param float refresh_interval: Maximum age of the index in seconds.
+    :param float miss_refresh_interval: Minimum number of seconds between
+        revalidations triggered by unknown identifiers.
+    """
+    def __init__(self, load, refresh_interval=30, miss_refresh_interval=1):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self.lock = threading.Lock()
+        self.ids = None
+        self.last_refresh = 0
+
+    def refresh(self):
+        """
+        Reload the index from the backing store.
+        """
+        ids = set(self.load())
+        with self.lock:
+            self.ids = ids
+            self.last_refresh = time.time()
+
+    def __contains__(self, infra_id):
+        age = time.time() - self.last_refresh
+        if self.ids is None or age > self.refresh_interval:
+            self.refresh()
+        elif infra_id not in self.ids and age > self.miss_refresh_interval:
+            self.refresh()
+        return infra_id in self.ids
+
+    def add(self, infra_id):
+        """
+        Register a new infrastructure. Must be called *after* the
+        infrastructure has been added to the backing store.
+        """
+        with self.lock:
+            if self.ids is not None:
+                self.ids.add(infra_id)
+
+    def remove(self, infra_id):
+        """
+        Unregister an infrastructure. Must be called *after* the
+        infrastructure has been removed from the backing store.
+        """
+        with self.lock:
+            if self.ids is not None:
+                self.ids.discard(infra_id)
+
+class NodeNameCache(object):
+    """
+    Per-infrastructure cache of the names of the nodes in the infrastructure.
+
+    The sets of names are built from the compiled static description of the
+    infrastructures. An entry is rebuilt when it is older than ``max_age``, so
+    updates made by other processes (e.g. ``occopus-build -i``) are picked up.
+    Unknown node names also trigger a rebuild, but at most once per
+    ``miss_refresh_interval``. Entries must be invalidated explicitly with
+    :meth:`invalidate` when the infrastructure is updated or removed by this
+    process.
+
+    :param callable load: Returns the node names of the infrastructure given
+        as its only argument.
+    :param float max_age: Maximum age of an entry in seconds.
+    :param float miss_refresh_interval: Minimum number of seconds between
+        rebuilds of an entry triggered by unknown node names.
+    """
+    def __init__(self, load, max_age=60, miss_refresh_interval=1):
+        self.load = load
+        self.max_age = max_age
+        self.miss_refresh_interval = miss_refresh_interval
+        self.lock = threading.Lock()
+        self.entries = dict()
+
+    def get(self, infra_id):
+        """
+        Get the set of node names in the given infrastructure, loading them if
+        necessary.
+        """
+        entry = self.entries.get(infra_id)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            entry = self._reload(infra_id)
+        return entry[0]
+
+    def contains(self, infra_id, node_name):
+        """
+        Check whether the given infrastructure has a node called
+        ``node_name``.
+        """
+        entry = self.entries.get(infra_id)
+        age = time.time() - entry[1] if entry else None
+        if entry is None or age > self.max_age:
+            entry = self._reload(infra_id)
+        elif node_name not in entry[0] and age > self.miss_refresh_interval:
+            entry = self._reload(infra_id)
+        return node_name in entry[0]
+
+    def invalidate(self, infra_id):
+        """
+        Drop the cached node names of the given infrastructure.
+        """
+        with self.lock:
+            self.entries.pop(infra_id, None)
+
+    def _reload(self, infra_id):
+        entry = (frozenset(self.load(infra_id)), time.time())
+        with self.lock:
+            self.entries[infra_id] = entry
+        return entry
+
+class TTLCache(object):
+    """
+    Mapping whose items expire after ``max_age`` seconds.
+
+    Expired items are kept until they are overwritten or evicted, so callers
+    can fall back to them (see :meth:`lookup`). When the cache holds more than
+    ``max_size`` items, the least recently stored ones are evicted.
+
+    :param float max_age: The number of seconds an item is fresh for.
+    :param int max_size: Maximum number of items; unbounded if :data:`None`.
+    """
+    def __init__(self, max_age, max_size=None):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+
+    def lookup(self, key):
+        """
+        Get a cached item.
+
+        :return: ``(value, fresh)``, or :data:`None` if ``key`` is not cached.
+        """
+        item = self.items.get(key)
+        if item is None:
+            return None
+        value, stored = item
+        return value, time.time() - stored <= self.max_age
+
+    def store(self, key, value):
+        """
+        Store an item.
+        """
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, time.time())
+            if self.max_size is not None:
+                while len(self.items) > self.max_size:
+                    self.items.popitem(last=False)
+
+    def get(self, key, compute):
+        """
+        Get a fresh item, calling ``compute(key)`` to create it if it is not
+        cached or has expired.
+        """
+        item = self.lookup(key)
+        if item is not None and item[1]:
+            return item[0]
+        value = compute(key)
+        self.store(key, value)
+        return value
+
+    def discard(self, key):
+        """
+        Remove an item, if it exists.
+        """
+        with self.lock:
+            self.items.pop(key, None)
+
+class CompilationCache(object):
+    """
+    Content-addressed cache of compiled infrastructure descriptions.
+
+    Compiled descriptions are keyed by a hash of the normalized description,
+    the definitions of the node types it references, and ``version`` (e.g.
+    the version of the compiler), so a change in any of them results in a new
+    compilation. A hit returns a copy of the cached compiled description,
+    rebound to the requested (or a new) infrastructure identifier, without
+    parsing, schema checking and compiling the description again.
+
+    The cache holds at most ``max_size`` items in memory, evicting the least
+    recently used ones. If ``directory`` is given, the items are also stored
+    there, so they survive the process (e.g. for command line tools); the
+    least recently used files beyond ``max_size`` are removed. The files are
+    pickles, so whoever can write the directory can execute code in the
+    process loading them: the directory is created accessible by the owner
+    only, and an existing directory not owned by the current user, or
+    writable by others, is not used.
+
+    If the key of a description cannot be computed (e.g. a node definition
+    cannot be loaded), the description is compiled without caching.
+
+    :param callable compile: Compiles a description; called as
+        ``compile(infra_desc, infra_id)`` (e.g.
+        :class:`occo.compiler.StaticDescription`).
+    :param callable node_definitions: Returns the definitions of the node type
+        given as its only argument.
+    :param int max_size: Maximum number of cached compiled descriptions.
+    :param str directory: Directory to persist the cache in; in-memory only if
+        :data:`None`.
+    :param str version: Included in the keys.
+    """
+    def __init__(self, compile, node_definitions, max_size=64,
+                 directory=None, version=''):
+        self.compile = compile
+        self.node_definitions = node_definitions
+        self.max_size = max_size
+        self.directory = directory
+        self.version = version
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            if not private_directory(directory):
+                log.warning('Not persisting the compilation cache in %s: it '
+                            'must be owned by the current user and writable '
+                            'only by them', directory)
+                self.directory = None
+
+    def get(self, infra_desc, infra_id=None):
+        """
+        Get the compiled description of ``infra_desc``, compiling it if it is
+        not cached.
+
+        :param infra_desc: The infrastructure description; a dictionary, or
+            its YAML text.
+        :param str infra_id: The identifier of the infrastructure; a new one
+            is generated if :data:`None`.
+        """
+        try:
+            key = self.key(infra_desc)
+        except Exception:
+            log.debug('Cannot compute the key of the description; compiling '
+                      'it without caching', exc_info=True)
+            return self.compile(infra_desc, infra_id)
+        compiled = self.lookup(key)
+        if compiled is None:
+            log.debug('Compilation cache miss: %s', key)
+            compiled = self.compile(infra_desc, infra_id)
+            self.store(key, copy.deepcopy(compiled))
+            return compiled
+        log.debug('Compilation cache hit: %s', key)
+        return rebind(compiled, infra_id or str(uuid.uuid4()))
+
+    def key(self, infra_desc):
+        desc = normalize(infra_desc)
+        types = sorted(set(node.get('type') for node in desc.get('nodes', [])
+                           if isinstance(node, dict))
+                       if isinstance(desc, dict) else [])
+        data = json.dumps(dict(description=desc,
+                               node_definitions=dict(
+                                   (t, self.node_definitions(t))
+                                   for t in types),
+                               version=self.version),
+                          sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        with self.lock:
+            compiled = self.items.get(key)
+            if compiled is not None:
+                self.items.move_to_end(key)
+                return compiled
+        if self.directory:
+            compiled = self.load(key)
+            if compiled is not None:
+                self.remember(key, compiled)
+        return compiled
+
+    def store(self, key, compiled):
+        self.remember(key, compiled)
+        if self.directory:
+            self.save(key, compiled)
+
+    def remember(self, key, compiled):
+        with self.lock:
+            self.items[key] = compiled
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                compiled = pickle.load(f)
+            os.utime(path, None)
+            return compiled
+        except IOError:
+            return None
+        except Exception:
+            log.warning('Dropping corrupt compilation cache entry %s', path,
+                        exc_info=True)
+            discard_file(path)
+            return None
+
+    def save(self, key, compiled):
+        path = self.path(key)
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except Exception:
+            log.warning('Cannot store compilation cache entry %s', path,
+                        exc_info=True)
+            discard_file(tmp)
+            return
+        files = [os.path.join(self.directory, f)
+                 for f in os.listdir(self.directory) if f.endswith('.pickle')]
+        if len(files) > self.max_size:
+            files.sort(key=lambda f: os.stat(f).st_mtime)
+            for f in files[:len(files) - self.max_size]:
+                discard_file(f)
+
+def private_directory(path):
+    """
+    Check that ``path`` is owned by the current user, and not writable by
+    others.
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    st = os.stat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+def discard_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def normalize(infra_desc):
+    """
+    Bring a description to a canonical form for hashing: YAML text is parsed,
+    so formatting and key order do not matter. Text that cannot be parsed as
+    plain YAML (e.g. because of custom tags) is used as is.
+    """
+    if isinstance(infra_desc, bytes):
+        infra_desc = infra_desc.decode('utf-8')
+    if isinstance(infra_desc, str):
+        import yaml
+        try:
+            return yaml.safe_load(infra_desc)
+        except yaml.YAMLError:
+            return infra_desc
+    return infra_desc
+
+def rebind(compiled, infra_id):
+    """
+    Create a copy of a compiled description, bound to ``infra_id``: the
+    ``infra_id`` of the description, and those of its nodes, are replaced.
+    """
+    compiled = copy.deepcopy(compiled)
+    compiled.infra_id = infra_id
+    for node in getattr(compiled, 'nodes', None) or []:
+        if isinstance(node, dict) and 'infra_id' in node:
+            node['infra_id'] = infra_id
+    return compiled
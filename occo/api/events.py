@@ -0,0 +1,264 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Change feeds of infrastructure states.
+
+A :class:`ChangeFeed` periodically takes a snapshot of an infrastructure (its
+:func:`report <occo.api.rest.create_infra_report>`), and publishes the
+differences between consecutive snapshots as events to its subscribers. There
+is a single feed per infrastructure, shared by all of its subscribers; it is
+started by the first subscription and stopped when the last subscriber leaves.
+
+Events are ``(event_type, data)`` pairs:
+
+``snapshot``
+    The full report; sent first to each new subscriber.
+
+``state``
+    A node instance has been created, removed, or its state has changed::
+
+        {"node": <nodename>, "node_id": <nodeid>, "old": <state>, "new": <state>}
+
+``resource_address``
+    The address of a node instance has been assigned or changed::
+
+        {"node": <nodename>, "node_id": <nodeid>, "old": <addr>, "new": <addr>}
+
+``scaling``
+    The target number of instances of a node has changed::
+
+        {"node": <nodename>, "old": <target>, "new": <target>}
+
+``error``
+    The snapshot could not be taken::
+
+        {"message": <error_message>}
+"""
+
+__all__ = ['ChangeFeed', 'ChangeFeeds', 'Subscription', 'diff_reports']
+
+import threading
+import queue
+import logging
+
+log = logging.getLogger('occo.manager-service')
+
+def diff_reports(old, new):
+    """
+    Compute the events between two infrastructure reports.
+
+    :param dict old: The previous report.
+    :param dict new: The current report.
+    :return: The list of ``(event_type, data)`` pairs.
+    """
+    events = list()
+    for nodename in sorted(set(old) | set(new)):
+        old_node, new_node = old.get(nodename, {}), new.get(nodename, {})
+        old_instances = old_node.get('instances', {})
+        new_instances = new_node.get('instances', {})
+        for node_id in sorted(set(old_instances) | set(new_instances)):
+            old_i = old_instances.get(node_id, {})
+            new_i = new_instances.get(node_id, {})
+            for key in ('state', 'resource_address'):
+                if old_i.get(key) != new_i.get(key):
+                    events.append((key, dict(node=nodename, node_id=node_id,
+                                             old=old_i.get(key),
+                                             new=new_i.get(key))))
+        old_target = old_node.get('scaling', {}).get('target')
+        new_target = new_node.get('scaling', {}).get('target')
+        if old_target != new_target:
+            events.append(('scaling', dict(node=nodename,
+                                           old=old_target, new=new_target)))
+    return events
+
+class Subscription(object):
+    """
+    A subscriber of a :class:`ChangeFeed`.
+
+    Events are buffered in a bounded queue. A subscriber that does not keep up
+    with the feed (its queue is full) is disconnected.
+    """
+    CLOSED = object()
+
+    def __init__(self, feed, queue_size):
+        self.feed = feed
+        self.queue = queue.Queue(queue_size)
+        self.closed = False
+        self.lagging = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.lagging = True
+
+    def events(self, heartbeat=15):
+        """
+        Iterate over the events of the feed until the subscription is closed.
+
+        :param float heartbeat: If no event arrives for this many seconds,
+            ``(None, None)`` is generated, so the caller can check whether the
+            client is still connected.
+        """
+        while not self.closed:
+            try:
+                event = self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield None, None
+                continue
+            if event is self.CLOSED:
+                break
+            yield event
+
+    def close(self):
+        """
+        Unsubscribe from the feed.
+        """
+        if not self.closed:
+            self.closed = True
+            self.feed.unsubscribe(self)
+            try:
+                self.queue.put_nowait(self.CLOSED)
+            except queue.Full:
+                pass
+
+class ChangeFeed(object):
+    """
+    The shared change feed of an infrastructure.
+
+    :param str infra_id: The identifier of the infrastructure.
+    :param callable snapshot: Returns the report of the infrastructure given as
+        its only argument.
+    :param float interval: The number of seconds between snapshots.
+    :param callable on_idle: Called with the feed when its last subscriber has
+        left.
+    :param int queue_size: The number of events buffered per subscriber.
+    """
+    def __init__(self, infra_id, snapshot, interval=2, on_idle=None,
+                 queue_size=100):
+        self.infra_id = infra_id
+        self.snapshot = snapshot
+        self.interval = interval
+        self.on_idle = on_idle
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = list()
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def subscribe(self):
+        """
+        Add a new subscriber; the feed is started if necessary.
+
+        :return: The new :class:`Subscription`, or :data:`None` if the feed
+            has already been stopped.
+        """
+        sub = Subscription(self, self.queue_size)
+        with self.lock:
+            if self.stopped.is_set():
+                return None
+            if self.last is None:
+                self.last = self.take_snapshot()
+            if self.last is not None:
+                sub.put(('snapshot', self.last))
+            self.subscribers.append(sub)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run,
+                    name='ChangeFeed-{0}'.format(self.infra_id))
+                self.thread.daemon = True
+                self.thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+            idle = not self.subscribers
+            if idle:
+                self.stopped.set()
+        if idle and self.on_idle:
+            self.on_idle(self)
+
+    def take_snapshot(self):
+        try:
+            return self.snapshot(self.infra_id)
+        except Exception as ex:
+            log.exception('Cannot take snapshot of %s:', self.infra_id)
+            self.publish([('error', dict(message=str(ex)))])
+            return None
+
+    def publish(self, events):
+        for sub in list(self.subscribers):
+            for event in events:
+                sub.put(event)
+
+    def drop_lagging(self):
+        for sub in list(self.subscribers):
+            if sub.lagging:
+                log.warning('Event subscriber of %s is lagging behind; '
+                            'disconnecting', self.infra_id)
+                sub.close()
+
+    def run(self):
+        log.debug('Starting change feed of %s', self.infra_id)
+        while not self.stopped.wait(self.interval):
+            current = self.take_snapshot()
+            if current is not None:
+                with self.lock:
+                    events = diff_reports(self.last or {}, current)
+                    self.last = current
+                    self.publish(events)
+            self.drop_lagging()
+        log.debug('Stopped change feed of %s', self.infra_id)
+
+class ChangeFeeds(object):
+    """
+    The set of change feeds; creates a feed for an infrastructure on its first
+    subscription, and drops it when it has no subscribers left.
+
+    :param callable snapshot: See :class:`ChangeFeed`.
+    :param float interval: See :class:`ChangeFeed`.
+    :param int queue_size: See :class:`ChangeFeed`.
+    """
+    def __init__(self, snapshot, interval=2, queue_size=100):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.feeds = dict()
+
+    def subscribe(self, infra_id):
+        """
+        Subscribe to the changes of an infrastructure.
+
+        :rtype: :class:`Subscription`
+        """
+        while True:
+            with self.lock:
+                feed = self.feeds.get(infra_id)
+                if feed is None or feed.stopped.is_set():
+                    feed = ChangeFeed(infra_id, self.snapshot, self.interval,
+                                      self.drop, self.queue_size)
+                    self.feeds[infra_id] = feed
+            sub = feed.subscribe()
+            if sub is not None:
+                return sub
+
+    def drop(self, feed):
+        with self.lock:
+            if self.feeds.get(feed.infra_id) is feed:
+                del self.feeds[feed.infra_id]
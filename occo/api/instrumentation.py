@@ -0,0 +1,169 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Instrumentation of info broker queries.
+
+:data:`main_info_broker` wraps :data:`occo.infobroker.main_info_broker`, and
+records the number of calls, the errors and the latency of the queries per
+info key, while it is :attr:`~InstrumentedInfoBroker.enabled`. When disabled,
+queries are passed through with a single attribute check.
+
+The statistics are available as a dictionary (:meth:`InstrumentedInfoBroker.stats`),
+and are also exported as :mod:`metrics <occo.api.metrics>`.
+
+As info keys can be supplied by clients (e.g. ``/info/<key>``), a key is only
+tracked separately after it has been queried successfully, and only up to
+``max_keys`` keys; the rest is recorded under :data:`OTHER`.
+"""
+
+__all__ = ['InstrumentedInfoBroker', 'KeyStats', 'main_info_broker', 'OTHER']
+
+import threading
+import time
+from collections import deque
+
+import occo.api.metrics as metrics
+
+OTHER = 'other'
+"""The label of the queries of keys that are not tracked separately."""
+
+class KeyStats(object):
+    """
+    Statistics of the queries of a single info key. Percentiles are computed
+    from the latencies of the last ``sample_size`` queries.
+    """
+    def __init__(self, sample_size=1000):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=sample_size)
+
+    def record(self, duration, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+
+    def percentile(self, samples, p):
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+    def to_dict(self):
+        samples = sorted(self.samples)
+        return dict(calls=self.calls,
+                    errors=self.errors,
+                    error_rate=float(self.errors) / self.calls
+                               if self.calls else 0.0,
+                    total_seconds=self.total,
+                    mean_seconds=self.total / self.calls if self.calls else None,
+                    max_seconds=self.max,
+                    p50_seconds=self.percentile(samples, 50),
+                    p95_seconds=self.percentile(samples, 95),
+                    p99_seconds=self.percentile(samples, 99))
+
+class InstrumentedInfoBroker(object):
+    """
+    Wraps an info broker, recording statistics of its :meth:`get` queries per
+    info key. All other attributes are delegated to the wrapped object.
+
+    :param broker: The info broker to wrap; :data:`None` stands for
+        :data:`occo.infobroker.main_info_broker`, imported on first use.
+    :param bool enabled: Whether to record statistics initially.
+    :param registry: The :class:`~occo.api.metrics.Registry` to export the
+        statistics to; not exported if :data:`None`.
+    :param int sample_size: See :class:`KeyStats`.
+    :param int max_keys: The maximum number of keys tracked separately.
+    """
+    def __init__(self, broker=None, enabled=False, registry=None,
+                 sample_size=1000, max_keys=100):
+        self._broker = broker
+        self.enabled = enabled
+        self.sample_size = sample_size
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.keys = dict()
+        self.since = time.time()
+        self.duration = self.errors = None
+        if registry is not None:
+            self.duration = registry.histogram(
+                'occopus_infobroker_query_duration_seconds',
+                'Latency of info broker queries per key.', ('key',))
+            self.errors = registry.counter(
+                'occopus_infobroker_query_errors_total',
+                'Number of failed info broker queries per key.', ('key',))
+
+    @property
+    def broker(self):
+        if self._broker is None:
+            from occo.infobroker import main_info_broker
+            self._broker = main_info_broker
+        return self._broker
+
+    def get(self, key, *args, **kwargs):
+        if not self.enabled:
+            return self.broker.get(key, *args, **kwargs)
+        started = time.time()
+        error = True
+        try:
+            result = self.broker.get(key, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            self.record(key, time.time() - started, error)
+
+    def record(self, key, duration, error):
+        with self.lock:
+            if key not in self.keys and (error or key == OTHER or
+                    len(self.keys) - (OTHER in self.keys) >= self.max_keys):
+                key = OTHER
+            stats = self.keys.get(key)
+            if stats is None:
+                stats = self.keys[key] = KeyStats(self.sample_size)
+            stats.record(duration, error)
+        if self.duration is not None:
+            self.duration.observe(duration, key=key)
+            if error:
+                self.errors.inc(key=key)
+
+    def reset(self):
+        """
+        Drop the statistics recorded so far.
+        """
+        with self.lock:
+            self.keys = dict()
+            self.since = time.time()
+
+    def stats(self):
+        """
+        Get the statistics recorded since the last :meth:`reset`.
+
+        :return: A dictionary with the ``enabled`` flag, the time the
+            recording started (``since``), and the statistics per info key
+            (``keys``).
+        """
+        with self.lock:
+            keys = dict((k, s.to_dict()) for k, s in self.keys.items())
+        return dict(enabled=self.enabled, since=self.since, keys=keys)
+
+    def __getattr__(self, name):
+        return getattr(self.broker, name)
+
+main_info_broker = InstrumentedInfoBroker(registry=metrics.registry)
+"""The instrumented :data:`occo.infobroker.main_info_broker`; disabled by
+default."""
@@ -0,0 +1,188 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Background jobs of long-running REST operations.
+
+A :class:`Job` is executed on the bounded worker pool of a
+:class:`JobManager`. A job consists of named steps (see :meth:`Job.step`);
+the state of the job and of each of its steps can be polled while it runs.
+
+A job, and each of its steps, is in one of the following states:
+``pending``, ``running``, ``succeeded`` or ``failed``.
+"""
+
+__all__ = ['Job', 'JobManager']
+
+import contextlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+log = logging.getLogger('occo.manager-service')
+
+PENDING, RUNNING, SUCCEEDED, FAILED = 'pending', 'running', 'succeeded', 'failed'
+
+class Job(object):
+    """
+    A background operation.
+
+    :param str kind: The type of the operation (e.g. ``create``).
+    :param callable function: Executes the operation; called with the job as
+        its only argument. Its return value is the result of the job.
+    :param info: Additional information stored with the job (e.g.
+        ``infraid``).
+    """
+    def __init__(self, kind, function, **info):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.function = function
+        self.info = info
+        self.lock = threading.Lock()
+        self.state = PENDING
+        self.steps = list()
+        self.created = time.time()
+        self.started = self.finished = None
+        self.result = self.error = None
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """
+        Record the execution of a step of the job. The step fails if the
+        managed block raises an exception, which is propagated.
+
+        :return: The dictionary of the step; details (e.g. ``progress``) can
+            be added to it.
+        """
+        record = dict(name=name, state=RUNNING, started=time.time(),
+                      finished=None)
+        with self.lock:
+            self.steps.append(record)
+        try:
+            yield record
+        except BaseException as ex:
+            record.update(state=FAILED, error=str(ex), finished=time.time())
+            raise
+        else:
+            record.update(state=SUCCEEDED, finished=time.time())
+
+    def run(self):
+        self.started = time.time()
+        self.state = RUNNING
+        log.debug('Starting job %s (%s)', self.id, self.kind)
+        try:
+            self.result = self.function(self)
+        except Exception as ex:
+            log.exception('Job %s (%s) failed:', self.id, self.kind)
+            self.error = str(ex)
+            self.state = FAILED
+        else:
+            self.state = SUCCEEDED
+        finally:
+            self.finished = time.time()
+
+    @property
+    def done(self):
+        return self.state in (SUCCEEDED, FAILED)
+
+    def to_dict(self):
+        with self.lock:
+            steps = [dict(s) for s in self.steps]
+        result = dict(jobid=self.id,
+                      kind=self.kind,
+                      state=self.state,
+                      steps=steps,
+                      created=self.created,
+                      started=self.started,
+                      finished=self.finished,
+                      result=self.result,
+                      error=self.error)
+        result.update(self.info)
+        return result
+
+class JobManager(object):
+    """
+    Executes jobs on a bounded pool of worker threads, and keeps track of
+    them. The last ``history`` finished jobs are remembered.
+
+    :param int workers: The maximum number of jobs executed concurrently;
+        further jobs are queued.
+    :param int history: The maximum number of finished jobs kept.
+    """
+    def __init__(self, workers=4, history=1000):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.history = history
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.active = dict()
+
+    def submit(self, kind, function, **info):
+        """
+        Create and queue a job; see :class:`Job`.
+
+        :rtype: :class:`Job`
+        """
+        job, _ = self.submit_once(None, kind, function, **info)
+        return job
+
+    def submit_once(self, key, kind, function, **info):
+        """
+        Create and queue a job, unless a job submitted with the same ``key``
+        is still pending or running (e.g. destroying the same
+        infrastructure); see :class:`Job`.
+
+        :param key: Identifies the operation; :data:`None` if the job can be
+            executed concurrently with any other.
+        :return: ``(job, created)``; the job created, or the unfinished job
+            submitted with ``key``.
+        """
+        with self.lock:
+            job = self.active.get(key) if key is not None else None
+            if job is not None and not job.done:
+                return job, False
+            job = Job(kind, function, **info)
+            self.jobs[job.id] = job
+            if key is not None:
+                self.active[key] = job
+            self.expire()
+        self.pool.submit(job.run)
+        return job, True
+
+    def expire(self):
+        for key in [k for k, j in self.active.items() if j.done]:
+            del self.active[key]
+        finished = [j for j in self.jobs.values() if j.done]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        """
+        Get a job.
+
+        :raise KeyError: if the job does not exist (or has been forgotten).
+        """
+        return self.jobs[job_id]
+
+    def list(self):
+        """
+        Get all jobs known, in the order of their creation.
+        """
+        with self.lock:
+            return list(self.jobs.values())
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,237 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Batched writes to the key-value store of the UDS.
+
+:func:`write_batch` writes a list of items; :func:`run_batch` executes a
+function (e.g. a series of scaling requests submitted through
+:mod:`occo.enactor.scaling`) so that everything it writes to the key-value
+store of the UDS is written together at the end.
+
+If the store exposes its backend (as
+:class:`occo.infobroker.rediskvstore.RedisKVStore` does through
+``transform_key``), a batch is written in a single transaction per backend
+database. Keys read during :func:`run_batch` are watched, so a batch whose
+reads have been invalidated by a concurrent writer is executed again instead
+of overwriting the concurrent change. Otherwise, the items are written one
+by one.
+"""
+
+__all__ = ['write_batch', 'run_batch', 'BatchingKVStore']
+
+import copy
+import threading
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger('occo.manager-service')
+
+DELETED = object()
+"""Marks a key deleted in a batch."""
+
+def backend_of(kvs):
+    transform_key = getattr(kvs, 'transform_key', None)
+    if transform_key is None or not hasattr(kvs, 'serialize'):
+        return None
+    return transform_key
+
+def queue_item(kvs, pipeline, backend_key, value):
+    if value is DELETED:
+        pipeline.delete(backend_key)
+    else:
+        pipeline.set(backend_key,
+                     kvs.serialize(value) if kvs.serialize else value)
+
+def write_batch(kvs, items):
+    """
+    Write items to a key-value store. If the store exposes its backend
+    (``transform_key`` returning the Redis connection and the key of the
+    backend, and ``serialize``), the items are written with one transaction
+    per backend database.
+
+    :param list items: ``(key, value)`` pairs.
+    """
+    transform_key = backend_of(kvs)
+    if transform_key is None:
+        for key, value in items:
+            kvs[key] = value
+        return
+    pipelines = OrderedDict()
+    for key, value in items:
+        backend, backend_key = transform_key(key)
+        if id(backend) not in pipelines:
+            pipelines[id(backend)] = backend.pipeline(transaction=True)
+        queue_item(kvs, pipelines[id(backend)], backend_key, value)
+    for pipeline in pipelines.values():
+        pipeline.execute()
+
+def conflict_errors():
+    try:
+        from redis.exceptions import WatchError
+    except ImportError:
+        return ()
+    return (WatchError,)
+
+class Batch(object):
+    """
+    The writes of a :func:`run_batch` call not yet committed, and the
+    transactions watching the keys read.
+    """
+    def __init__(self, kvs):
+        self.kvs = kvs
+        self.transform_key = backend_of(kvs)
+        self.pending = OrderedDict()
+        self.pipelines = OrderedDict()
+
+    def pipeline(self, key):
+        backend, backend_key = self.transform_key(key)
+        if id(backend) not in self.pipelines:
+            self.pipelines[id(backend)] = backend.pipeline(transaction=True)
+        return self.pipelines[id(backend)], backend_key
+
+    def watch(self, key):
+        if self.transform_key is not None and key not in self.pending:
+            pipeline, backend_key = self.pipeline(key)
+            pipeline.watch(backend_key)
+
+    def commit(self):
+        if self.transform_key is None:
+            for key, value in self.pending.items():
+                if value is DELETED:
+                    self.kvs.delete_key(key)
+                else:
+                    self.kvs.set_item(key, value)
+            return
+        for key in self.pending:
+            self.pipeline(key)
+        for pipeline in self.pipelines.values():
+            pipeline.multi()
+        for key, value in self.pending.items():
+            pipeline, backend_key = self.pipeline(key)
+            queue_item(self.kvs, pipeline, backend_key, value)
+        for pipeline in self.pipelines.values():
+            pipeline.execute()
+
+    def discard(self):
+        for pipeline in self.pipelines.values():
+            pipeline.reset()
+
+class BatchingKVStore(object):
+    """
+    Wraps the key-value store of the UDS, so the writes of the threads
+    executing :func:`run_batch` are collected instead of written. Reads of
+    items written in the batch return the values written. Other threads, and
+    all other attributes, are passed through to the wrapped store.
+    """
+    def __init__(self, kvstore):
+        self.kvstore = kvstore
+        self.local = threading.local()
+
+    @property
+    def batch(self):
+        return getattr(self.local, 'batch', None)
+
+    def query_item(self, key, default=None):
+        batch = self.batch
+        if batch is not None:
+            if key in batch.pending:
+                value = batch.pending[key]
+                return default if value is DELETED else copy.deepcopy(value)
+            batch.watch(key)
+        return self.kvstore.query_item(key, default)
+
+    def has_key(self, key):
+        batch = self.batch
+        if batch is not None:
+            if key in batch.pending:
+                return batch.pending[key] is not DELETED
+            batch.watch(key)
+        return self.kvstore.has_key(key)
+
+    def set_item(self, key, value):
+        batch = self.batch
+        if batch is None:
+            return self.kvstore.set_item(key, value)
+        batch.pending[key] = copy.deepcopy(value)
+
+    def delete_key(self, key):
+        batch = self.batch
+        if batch is None:
+            return self.kvstore.delete_key(key)
+        batch.pending[key] = DELETED
+
+    def __getitem__(self, key):
+        return self.query_item(key)
+
+    def __setitem__(self, key, value):
+        self.set_item(key, value)
+
+    def __delitem__(self, key):
+        self.delete_key(key)
+
+    def __contains__(self, key):
+        return self.has_key(key)
+
+    def __getattr__(self, name):
+        return getattr(self.kvstore, name)
+
+install_lock = threading.Lock()
+
+def install(uds):
+    """
+    Wrap the key-value store of ``uds`` in a :class:`BatchingKVStore`, once.
+
+    :return: The :class:`BatchingKVStore`, or :data:`None` if ``uds`` has no
+        key-value store.
+    """
+    with install_lock:
+        kvstore = getattr(uds, 'kvstore', None)
+        if kvstore is None:
+            return None
+        if not isinstance(kvstore, BatchingKVStore):
+            kvstore = uds.kvstore = BatchingKVStore(kvstore)
+        return kvstore
+
+def run_batch(uds, function, attempts=5):
+    """
+    Execute ``function``, writing everything it writes to the key-value
+    store of ``uds`` in one batch at the end; see the module documentation.
+    If the batch conflicts with a concurrent writer, ``function`` is executed
+    again, at most ``attempts`` times in total. If ``function`` raises an
+    exception, nothing is written. Calls made by ``function`` are part of the
+    batch.
+
+    :param uds: The UDS (e.g. :data:`occo.infobroker.main_uds`); if it has no
+        key-value store, ``function`` is executed without batching.
+    :param callable function: Called without arguments.
+    :return: The return value of ``function``.
+    """
+    kvs = install(uds)
+    if kvs is None or kvs.batch is not None:
+        return function()
+    conflicts = conflict_errors()
+    for attempt in range(1, attempts + 1):
+        batch = kvs.local.batch = Batch(kvs.kvstore)
+        try:
+            result = function()
+            batch.commit()
+            return result
+        except conflicts:
+            if attempt == attempts:
+                raise
+            log.debug('Batch conflicts with a concurrent write; retrying')
+        finally:
+            batch.discard()
+            kvs.local.batch = None
@@ -24,7 +24,14 @@ __all__ = ['InfrastructureManager',
            'InfrastructureMaintenanceProcess']
 
 import time, os
+import threading
+import multiprocessing
 from occo.util.parproc import GracefulProcess
+from occo.api.scheduler import PassSchedule, CountingInfraProcessor, \
+    pass_slot, PassSlotTimeout
+from occo.api.metrics import pass_metrics, report_pass, QueueReporter, \
+    MetricsCollector
+from occo.api.recovery import StateFile, Reattachment, reattach
 from occo.exceptions import\
     InfrastructureIDTakenException, \
     InfrastructureIDNotFoundException
@@ -42,23 +49,66 @@ class InfrastructureMaintenanceProcess(GracefulProcess):
     """
     A process maintaining a single infrastructure. This process consists of an
     Enactor, and the corresponding Infrastructure Processor. The Enactor is
-    instructed to make a pass at given intervals.
+    instructed to make a pass at intervals determined by a
+    :class:`~occo.api.scheduler.PassSchedule`.
 
     :param str infra_id: The identifier of the already submitted infrastructure.
     :param float enactor_interval: The number of seconds to elapse between
         Enactor passes.
     :param str process_strategy: The identifier of the processing strategy for
         Infrastructure Processor
+    :param schedule: The :class:`~occo.api.scheduler.PassSchedule` of the
+        infrastructure; a fixed ``enactor_interval`` by default.
+    :param float wakeup_debounce: The number of seconds to wait after a
+        wake-up request (see :meth:`wake`) before starting the pass, so a
+        burst of requests triggers a single pass.
+    :param bool stagger: Delay the first pass randomly; see
+        :meth:`~occo.api.scheduler.PassSchedule.initial_delay`.
+    :param pass_slots: A :class:`multiprocessing.BoundedSemaphore` shared by
+        the maintenance processes, limiting the number of concurrent passes;
+        see :func:`~occo.api.scheduler.pass_slot`.
+    :param float pass_slot_timeout: See :func:`~occo.api.scheduler.pass_slot`.
+    :param metrics: A :class:`~occo.api.metrics.QueueReporter` sending the
+        metrics of the passes to the parent process; not recorded by default.
     """
 
     def __init__(   self, 
                     infra_id,
                     enactor_interval = 10,
-                    process_strategy='sequential'):
+                    process_strategy='sequential',
+                    schedule=None,
+                    wakeup_debounce=0.1,
+                    stagger=False,
+                    pass_slots=None,
+                    pass_slot_timeout=None,
+                    metrics=None):
         super(InfrastructureMaintenanceProcess, self).__init__(target=self)
         self.infra_id = infra_id
         self.enactor_interval = enactor_interval
         self.process_strategy = process_strategy
+        self.schedule = schedule or PassSchedule(enactor_interval)
+        self.wakeup_debounce = wakeup_debounce
+        self.wakeup_event = multiprocessing.Event()
+        self.stagger = stagger
+        self.pass_slots = pass_slots
+        self.pass_slot_timeout = pass_slot_timeout
+        self.metrics = metrics
+
+    def wake(self):
+        """
+        Request an Enactor pass as soon as possible (e.g. because a scaling
+        request has been submitted). Can be called from the parent process.
+        """
+        self.wakeup_event.set()
+
+    def wait_for_pass(self, delay):
+        """
+        Wait ``delay`` seconds, or until a wake-up request arrives.
+        """
+        if self.wakeup_event.wait(delay):
+            log.debug('Woken up: %s', self.infra_id)
+            time.sleep(self.wakeup_debounce)
+            self.wakeup_event.clear()
 
     def __call__(self):
         log.info('Starting maintenance process for %s', self.infra_id)
@@ -66,40 +116,129 @@ class InfrastructureMaintenanceProcess(GracefulProcess):
         from occo.enactor import Enactor
         from occo.infraprocessor import InfraProcessor
 
-        infraprocessor = InfraProcessor.instantiate(
+        infraprocessor = CountingInfraProcessor(
+                            InfraProcessor.instantiate(
                                         protocol='basic',
-                                        process_strategy=self.process_strategy)
+                                        process_strategy=self.process_strategy))
         enactor = Enactor(self.infra_id, infraprocessor)
+        delay = self.schedule.initial_delay() if self.stagger else 0
         while True:
             try:
-                enactor.make_a_pass()
-                time.sleep(self.enactor_interval)
+                self.wait_for_pass(delay)
+                started = time.time()
+                try:
+                    with pass_slot(self.pass_slots, self.pass_slot_timeout):
+                        enactor.make_a_pass()
+                except PassSlotTimeout as ex:
+                    log.warning('Skipping the pass of %s: %s',
+                                self.infra_id, ex)
+                    delay = self.schedule.interval
+                except Exception as ex:
+                    log.error('Unexpected error:')
+                    log.debug(traceback.format_exc())
+                    log.error(str(ex))
+                    infraprocessor.reset_count()
+                    report_pass(self.metrics, self.infra_id, started, error=ex)
+                    delay = self.schedule.next_interval(error=ex)
+                else:
+                    count = infraprocessor.reset_count()
+                    report_pass(self.metrics, self.infra_id, started, count)
+                    delay = self.schedule.next_interval(count)
+                log.debug('Next pass of %s in %.1fs', self.infra_id, delay)
             except KeyboardInterrupt:
                 log.info('Ctrl+C - exiting.')
                 infraprocessor.cancel_pending()
                 return 1
-            except Exception as ex:
-                log.error('Unexpected error:')
-                log.debug(traceback.format_exc())
-                log.error(str(ex))
-                time.sleep(self.enactor_interval)
 
 class InfrastructureManager(object):
     """
     Manages a set of infrastructures. Each submitted infrastructure is assigned
     an :class:`InfrastructureMaintenanceProcess` that maintains it.
 
+    Alternatively, in ``scheduler`` mode, all infrastructures are maintained
+    by a single :class:`~occo.api.scheduler.MaintenanceScheduler` within this
+    process, which executes the Enactor passes on a bounded pool of threads.
+    In this mode, the process table contains
+    :class:`~occo.api.scheduler.ScheduledMaintenance` objects instead of
+    processes.
+
     Compiling + storing the infrastructure is decoupled from starting
     provisioning. This enables the manager to attach to existing, but not
     provisioned infrastructures. I.e., if the manager fails, it can be
     restarted and reattached to previously submitted infrastructures.
 
+    The manager can be shared by multiple threads (e.g. the workers of a
+    multi-threaded REST server); changes to the process table are serialized.
+
     :param str process_strategy: The identifier of the processing strategy for
         Infrastructure Processor
+    :param str mode: ``process`` (default) or ``scheduler``.
+    :param int workers: The maximum number of concurrent Enactor passes in
+        ``scheduler`` mode.
+    :param float enactor_interval: The number of seconds to elapse between
+        Enactor passes.
+    :param dict schedule: Parameters of the adaptive pass schedule of each
+        infrastructure (``max_interval``, ``backoff``, ``error_interval``,
+        ``max_error_interval``); see :class:`~occo.api.scheduler.PassSchedule`.
+        The interval is fixed by default.
+    :param float wakeup_debounce: The number of seconds to wait after a
+        wake-up request (see :meth:`wake`) before starting the pass.
+    :param bool stagger: Delay the first pass of attached infrastructures
+        randomly; see :meth:`attach`. Disabled by default. Random ``jitter``
+        of the intervals can be configured in ``schedule``.
+    :param int max_concurrent_passes: The maximum number of Enactor passes
+        executed at the same time by all maintenance processes (or threads);
+        unlimited by default.
+    :param float pass_slot_timeout: The maximum number of seconds a pass
+        waits for its turn; if it times out, the pass is skipped and retried
+        after the Enactor interval. See :func:`~occo.api.scheduler.pass_slot`.
+    :param int compilation_cache: The maximum number of compiled
+        infrastructure descriptions cached, so resubmitted descriptions are
+        not compiled again; see :func:`occo.api.occoapp.compilation_cache`.
+        ``0`` disables the cache.
+    :param str state_file: The path of the file the identifiers of the
+        maintained infrastructures are persisted in, so they can be reattached
+        after a restart; see :meth:`reattach_all`. Not persisted by default.
+
+    The passes of the maintained infrastructures are recorded in
+    :data:`occo.api.metrics.pass_metrics`. Maintenance processes send their
+    records to the manager through a queue, drained by a
+    :class:`~occo.api.metrics.MetricsCollector` started with the first
+    process.
     """
-    def __init__(self, process_strategy = 'sequential'):
+    def __init__(self, process_strategy = 'sequential', mode = 'process',
+                 workers = 8, enactor_interval = 10, schedule = None,
+                 wakeup_debounce = 0.1, stagger = False,
+                 max_concurrent_passes = None, pass_slot_timeout = 300,
+                 compilation_cache = 64, state_file = None):
+        if mode not in ('process', 'scheduler'):
+            raise ValueError('Unknown maintenance mode', mode)
         self.process_strategy = process_strategy
+        self.mode = mode
+        self.enactor_interval = enactor_interval
+        self.schedule = schedule or dict()
+        self.wakeup_debounce = wakeup_debounce
+        self.stagger = stagger
+        self.pass_slot_timeout = pass_slot_timeout
+        self.compilation_cache_size = compilation_cache
+        self.compilation_cache = None
+        self.pass_slots = None
+        if max_concurrent_passes:
+            semaphore = threading.BoundedSemaphore if mode == 'scheduler' \
+                        else multiprocessing.BoundedSemaphore
+            self.pass_slots = semaphore(max_concurrent_passes)
         self.process_table = dict()
+        self.lock = threading.RLock()
+        self.state = StateFile(state_file) if state_file else None
+        self.reattaching = set()
+        self.reattachment = None
+        self.metrics = pass_metrics
+        self.metrics_queue = None
+        self.metrics_collector = None
+        self.scheduler = None
+        if mode == 'scheduler':
+            from occo.api.scheduler import MaintenanceScheduler
+            self.scheduler = MaintenanceScheduler(workers)
 
     def add(self, infra_desc):
         """
@@ -118,10 +257,14 @@ class InfrastructureManager(object):
         """
         Start provisioning an existing infrastructure.
 
+        If the manager is configured to ``stagger`` passes, the first pass is
+        delayed randomly, so infrastructures attached at the same time (e.g.
+        after a restart) are not maintained in synchronized waves.
+
         :param str infra_id: The identifier of the infrastructure. The
             infrastructure must be already compiled and stored in the UDS.
         """
-        self.start_provisioning(infra_id)
+        self.start_provisioning(infra_id, stagger=self.stagger)
         return infra_id
 
     def detach(self, infra_id):
@@ -142,16 +285,29 @@ class InfrastructureManager(object):
             <infradescription>`.
         """
 
-        from occo.compiler import StaticDescription
-
         datalog.debug('Adding infrastructure:\n%s', infra_desc)
-        compiled_infrastructure = StaticDescription(infra_desc)
+        compiled_infrastructure = self.compile(infra_desc)
         main_uds.add_infrastructure(compiled_infrastructure)
         infra_id = compiled_infrastructure.infra_id
         log.info("Submitted infrastructure: %s", infra_id)
         return infra_id
     
-    def start_provisioning(self, infra_id):
+    def compile(self, infra_desc, infra_id=None):
+        """
+        Compile an infrastructure description, or get it from the compilation
+        cache.
+        """
+        if not self.compilation_cache_size:
+            from occo.compiler import StaticDescription
+            return StaticDescription(infra_desc, infra_id)
+        with self.lock:
+            if self.compilation_cache is None:
+                import occo.api.occoapp as occoapp
+                self.compilation_cache = occoapp.compilation_cache(
+                                            self.compilation_cache_size)
+        return self.compilation_cache.get(infra_desc, infra_id)
+
+    def start_provisioning(self, infra_id, stagger=False):
         """
         Start provisioning the given infrastructure.
 
@@ -167,18 +323,68 @@ class InfrastructureManager(object):
 
         :param str infra_id: The identifier of the infrastructure. The
             infrastructure must be already compiled and stored in the UDS.
+        :param bool stagger: Delay the first pass randomly, within the
+            Enactor interval.
         :raise InfrastructureIDTakenException: when the infrastructure specified
             is already being managed.
         """
-        if infra_id in self.process_table:
-            raise InfrastructureIDTakenException(infra_id)
+        with self.lock:
+            if infra_id in self.process_table:
+                raise InfrastructureIDTakenException(infra_id)
+
+            log.debug('Starting provisioning infrastructure %s', infra_id)
+            p = self.create_maintainer(infra_id, stagger)
+            self.process_table[infra_id] = p
+            log.info('Spawning maintenance process for %s', infra_id)
+            p.start()
+            self.save_state()
+
+    def create_maintainer(self, infra_id, stagger=False):
+        """
+        Create the object maintaining the given infrastructure, depending on
+        the mode of the manager.
+        """
+        schedule = PassSchedule(self.enactor_interval, **self.schedule)
+        if self.scheduler:
+            from occo.api.scheduler import ScheduledMaintenance
+            return ScheduledMaintenance(self.scheduler, infra_id,
+                                        enactor_interval=self.enactor_interval,
+                                        process_strategy=self.process_strategy,
+                                        schedule=schedule,
+                                        wakeup_debounce=self.wakeup_debounce,
+                                        stagger=stagger,
+                                        pass_slots=self.pass_slots,
+                                        pass_slot_timeout=self.pass_slot_timeout,
+                                        metrics=self.metrics)
+        if self.metrics_queue is None:
+            self.metrics_queue = multiprocessing.Queue()
+            self.metrics_collector = MetricsCollector(self.metrics_queue,
+                                                      self.metrics)
+            self.metrics_collector.start()
+        return InfrastructureMaintenanceProcess(
+                                    infra_id = infra_id,
+                                    enactor_interval = self.enactor_interval,
+                                    process_strategy = self.process_strategy,
+                                    schedule = schedule,
+                                    wakeup_debounce = self.wakeup_debounce,
+                                    stagger = stagger,
+                                    pass_slots = self.pass_slots,
+                                    pass_slot_timeout = self.pass_slot_timeout,
+                                    metrics = QueueReporter(self.metrics_queue))
+
+    def wake(self, infra_id):
+        """
+        Request an Enactor pass of the given infrastructure as soon as
+        possible, e.g. because a scaling request has been submitted. Bursts of
+        requests are debounced into a single pass.
 
-        log.debug('Starting provisioning infrastructure %s', infra_id)
-        p = InfrastructureMaintenanceProcess(   infra_id = infra_id, 
-                                                process_strategy = self.process_strategy)
-        self.process_table[infra_id] = p
-        log.info('Spawning maintenance process for %s', infra_id)
-        p.start()
+        Nothing happens if the infrastructure is not managed.
+
+        :param str infra_id: The identifier of the infrastructure.
+        """
+        p = self.process_table.get(infra_id)
+        if p is not None:
+            p.wake()
 
     def stop_provisioning(self, infra_id, wait_timeout=60):
         """
@@ -195,11 +401,95 @@ class InfrastructureManager(object):
             managed.
         """
         log.debug('Stopping provisioning infrastructure %s', infra_id)
-        try:
-            p = self.process_table.pop(infra_id)
-            p.graceful_terminate(wait_timeout)
-        except KeyError:
-            raise InfrastructureIDNotFoundException(infra_id)
+        with self.lock:
+            try:
+                p = self.process_table.pop(infra_id)
+            except KeyError:
+                raise InfrastructureIDNotFoundException(infra_id)
+            self.save_state()
+        p.graceful_terminate(wait_timeout)
+        if self.metrics_collector:
+            # After the records sent by the terminated process
+            self.metrics_collector.forget(infra_id)
+        else:
+            self.metrics.forget(infra_id)
+
+    def save_state(self):
+        """
+        Persist the identifiers of the maintained infrastructures (and of
+        those still being reattached) in the state file, if any.
+        """
+        if self.state is None:
+            return
+        with self.lock:
+            infra_ids = set(self.process_table) | self.reattaching
+            try:
+                self.state.save(infra_ids)
+            except Exception as ex:
+                log.error('Cannot save the state of the manager: %s', ex)
+
+    def reattach_all(self, workers=8, rate=None, exists=None,
+                     background=False):
+        """
+        Attach all infrastructures listed in the state file (i.e. maintained
+        before a restart); see :func:`~occo.api.recovery.reattach`. The
+        progress is available in :attr:`reattachment`, and :attr:`ready` is
+        set when finished.
+
+        :param int workers: The maximum number of concurrent attachments.
+        :param float rate: The maximum number of attachments started per
+            second.
+        :param callable exists: Checks whether an infrastructure still
+            exists; the ones that do not are skipped.
+        :param bool background: Reattach in a background thread instead of
+            blocking.
+        :rtype: :class:`~occo.api.recovery.Reattachment`
+        """
+        infra_ids = self.state.load() if self.state else list()
+        with self.lock:
+            infra_ids = [i for i in infra_ids
+                         if i not in self.process_table
+                         and (exists is None or exists(i))]
+            self.reattaching.update(infra_ids)
+            self.reattachment = Reattachment(infra_ids)
+        log.info('Reattaching %d infrastructures', len(infra_ids))
+
+        def attach(infra_id):
+            try:
+                self.attach(infra_id)
+            finally:
+                with self.lock:
+                    self.reattaching.discard(infra_id)
+                    self.save_state()
+
+        def run():
+            reattach(attach, infra_ids, workers=workers, rate=rate,
+                     progress=self.reattachment)
+        if background:
+            threading.Thread(target=run, name='reattach', daemon=True).start()
+        else:
+            run()
+        return self.reattachment
+
+    @property
+    def ready(self):
+        """
+        Whether the infrastructures maintained before a restart have all been
+        reattached; see :meth:`reattach_all`.
+        """
+        return self.reattachment is None or \
+            self.reattachment.ready.is_set()
+
+    def shutdown(self):
+        """
+        Stop the maintenance scheduler and the metrics collector, if any. The
+        infrastructures are left running, but they are not maintained any
+        more.
+        """
+        if self.scheduler:
+            self.scheduler.shutdown()
+        if self.metrics_collector:
+            self.metrics_collector.stop()
 
     def get(self, infra_id):
         """
@@ -214,7 +504,7 @@ class InfrastructureManager(object):
         except KeyError:
             raise InfrastructureIDNotFoundException(infra_id)
 
-    def tear_down(self, infra_id):
+    def tear_down(self, infra_id, **teardown_args):
         """
         Tear down an infrastructure.
 
@@ -228,6 +518,8 @@ class InfrastructureManager(object):
         implicitly.
 
         :param str infra_id: The identifier of the infrastructure.
+        :param teardown_args: Parameters of the teardown (concurrency,
+            retries, progress callback); see :func:`occo.api.occoapp.teardown`.
         :raise ValueError: if the infrastructure is being maintained by this
             manager. Call :meth:`stop_provisioning` first, explicitly.
         """
@@ -244,4 +536,4 @@ class InfrastructureManager(object):
                                         process_strategy=self.process_strategy)
 
         import occo.api.occoapp as occoapp
-        occoapp.teardown(infra_id, ip)
+        occoapp.teardown(infra_id, ip, **teardown_args)
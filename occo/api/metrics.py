@@ -0,0 +1,356 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Metrics of the manager service in the Prometheus text exposition format.
+
+The metrics are collected in a :class:`Registry`; :data:`registry` is the one
+exposed by the REST interface at ``/metrics``.
+
+Enactor passes are recorded through :class:`PassMetrics`. Maintenance
+processes cannot update the registry of the serving process directly: they
+send their records through a :class:`multiprocessing.Queue`
+(:class:`QueueReporter`), which is drained into the registry by a
+:class:`MetricsCollector` thread of the serving process.
+"""
+
+__all__ = ['Registry', 'Counter', 'Gauge', 'Histogram', 'PassMetrics',
+           'QueueReporter', 'MetricsCollector', 'report_pass', 'registry',
+           'pass_metrics']
+
+import threading
+import time
+
+import logging
+log = logging.getLogger('occo.manager_service')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, 600)
+"""Default histogram buckets (in seconds)."""
+
+def escape(value):
+    return str(value).replace('\\', '\\\\')\
+                     .replace('"', '\\"')\
+                     .replace('\n', '\\n')
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, escape(v))
+                          for k, v in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(object):
+    """
+    Base class of metrics. The values of a metric are stored per label
+    values; labels are given as keyword arguments, and must match
+    ``labels``.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = dict()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('Invalid labels', self.name, sorted(labels))
+        return tuple(labels[l] for l in self.labels)
+
+    def remove(self, **labels):
+        """
+        Remove the values of the given label values.
+        """
+        with self.lock:
+            self.values.pop(self.key(labels), None)
+
+    def samples(self):
+        """
+        Generate ``(suffix, label_values, extra_label, value)`` tuples.
+        """
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} {1}'.format(self.name, self.type)]
+        for suffix, key, extra, value in self.samples():
+            lines.append('{0}{1}{2} {3}'.format(
+                self.name, suffix, format_labels(self.labels, key, extra),
+                format_value(value)))
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield '', key, None, value
+
+class Gauge(Metric):
+    """
+    A value that can go up and down. Alternatively, the values can be computed
+    when the metric is rendered, by a function returning a dictionary mapping
+    label value tuples to values (see :meth:`set_function`).
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        super(Gauge, self).__init__(name, help, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function:
+            items = sorted(self.function().items())
+        else:
+            with self.lock:
+                items = sorted(self.values.items())
+        for key, value in items:
+            yield '', key, None, value
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * len(self.buckets), 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((k, (list(c), s)) for k, (c, s)
+                           in self.values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', key, ('le', format_value(bound)), count
+            yield '_sum', key, None, total
+            yield '_count', key, None, counts[-1]
+
+class Registry(object):
+    """
+    A set of metrics, rendered together.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = list()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+class PassMetrics(object):
+    """
+    Metrics of Enactor passes.
+
+    :param registry: The :class:`Registry` to register the metrics in.
+    """
+    def __init__(self, registry):
+        self.duration = registry.histogram(
+            'occopus_pass_duration_seconds',
+            'Duration of Enactor passes.', ('infra_id',))
+        self.errors = registry.counter(
+            'occopus_pass_errors_total',
+            'Number of failed Enactor passes.', ('infra_id',))
+        self.instructions = registry.histogram(
+            'occopus_pass_instructions',
+            'Number of instructions pushed by Enactor passes.', ('infra_id',),
+            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+        self.since_success = registry.gauge(
+            'occopus_seconds_since_last_successful_pass',
+            'Time elapsed since the last successful Enactor pass.',
+            ('infra_id',))
+        self.since_success.set_function(self.seconds_since_success)
+        self.lock = threading.Lock()
+        self.last_success = dict()
+
+    def record(self, infra_id, duration, instructions, error, timestamp):
+        """
+        Record an Enactor pass.
+
+        :param str infra_id: The identifier of the infrastructure.
+        :param float duration: The duration of the pass in seconds.
+        :param int instructions: The number of instructions pushed.
+        :param str error: The error message if the pass failed.
+        :param float timestamp: The time the pass finished.
+        """
+        self.duration.observe(duration, infra_id=infra_id)
+        if error is not None:
+            self.errors.inc(infra_id=infra_id)
+            return
+        self.instructions.observe(instructions, infra_id=infra_id)
+        with self.lock:
+            self.last_success[infra_id] = timestamp
+
+    def forget(self, infra_id):
+        """
+        Remove the metrics of an infrastructure that is not maintained any
+        more.
+        """
+        for metric in (self.duration, self.errors, self.instructions):
+            metric.remove(infra_id=infra_id)
+        with self.lock:
+            self.last_success.pop(infra_id, None)
+
+    def seconds_since_success(self):
+        now = time.time()
+        with self.lock:
+            return dict(((infra_id,), now - t)
+                        for infra_id, t in self.last_success.items())
+
+def report_pass(metrics, infra_id, started, instructions=0, error=None):
+    """
+    Record an Enactor pass that has just finished.
+
+    :param metrics: A :class:`PassMetrics` or :class:`QueueReporter` object;
+        nothing is recorded if :data:`None`.
+    :param str infra_id: The identifier of the infrastructure.
+    :param float started: The time the pass started.
+    :param int instructions: The number of instructions pushed.
+    :param error: The exception raised by the pass, if it failed.
+    """
+    if metrics is None:
+        return
+    now = time.time()
+    metrics.record(infra_id, now - started, instructions,
+                   None if error is None else str(error), now)
+
+class QueueReporter(object):
+    """
+    Records Enactor passes by sending them through a queue; to be used by
+    maintenance processes. See :class:`MetricsCollector`.
+
+    :param queue: A :class:`multiprocessing.Queue`.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def record(self, infra_id, duration, instructions, error, timestamp):
+        try:
+            self.queue.put_nowait(
+                (infra_id, duration, instructions, error, timestamp))
+        except Exception:
+            log.debug('Cannot report metrics of %s', infra_id, exc_info=True)
+
+class Forget(object):
+    """
+    A request to :class:`MetricsCollector` to forget an infrastructure.
+    """
+    def __init__(self, infra_id):
+        self.infra_id = infra_id
+
+class MetricsCollector(object):
+    """
+    Drains the records sent by :class:`QueueReporter` objects into
+    :class:`PassMetrics`, in a background thread.
+
+    The metrics of an infrastructure must be forgotten through the collector
+    (:meth:`forget`), so the records still in the queue are processed first,
+    and do not recreate the series forgotten.
+
+    :param queue: A :class:`multiprocessing.Queue`.
+    :param metrics: The :class:`PassMetrics` to record the passes in.
+    """
+    def __init__(self, queue, metrics):
+        self.queue = queue
+        self.metrics = metrics
+        self.thread = threading.Thread(target=self.run,
+                                       name='MetricsCollector')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def forget(self, infra_id):
+        """
+        Forget the metrics of an infrastructure, after the records queued
+        before. See :meth:`PassMetrics.forget`.
+        """
+        self.queue.put(Forget(infra_id))
+
+    def run(self):
+        while True:
+            try:
+                record = self.queue.get()
+            except (EOFError, OSError):
+                break
+            if record is None:
+                break
+            try:
+                if isinstance(record, Forget):
+                    self.metrics.forget(record.infra_id)
+                else:
+                    self.metrics.record(*record)
+            except Exception:
+                log.exception('Invalid metrics record: %r', record)
+
+registry = Registry()
+"""The registry exposed by the REST interface."""
+
+pass_metrics = PassMetrics(registry)
+"""The metrics of the Enactor passes of the managed infrastructures."""
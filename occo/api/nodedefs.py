@@ -0,0 +1,159 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Bulk import of node definitions (see ``occopus-import``).
+
+Node definition files are loaded and schema-checked in parallel, by a pool
+of processes (both are CPU-bound). The node definitions are then written to
+the key-value store in batches: if the store exposes its backend (as
+:class:`occo.infobroker.rediskvstore.RedisKVStore` does through
+``transform_key``), each batch is written in a single pipelined transaction
+per backend database; otherwise, item by item.
+"""
+
+__all__ = ['find_files', 'load_file', 'write_batch', 'import_files',
+           'ImportSummary']
+
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from occo.api.kvbatch import write_batch
+
+import logging
+log = logging.getLogger('occo.import')
+
+EXTENSIONS = ('.yaml', '.yml')
+
+def find_files(paths):
+    """
+    List the node definition files: the files specified, and the YAML files
+    in the directories specified, recursively, in a stable order.
+    """
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.endswith(EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+def load_yaml(path):
+    import occo.util.config as config
+    return config.yaml_load_file(path)
+
+def check_node_def(data):
+    from occo.compiler.schema_check import SchemaChecker
+    SchemaChecker.check_node_def(data)
+
+def load_file(path, load=load_yaml, check=check_node_def):
+    """
+    Load and check a node definition file. Executed by the worker
+    processes, so errors are returned instead of raised.
+
+    :return: ``(data, error)``; the loaded node definitions, or the error
+        message.
+    """
+    try:
+        data = load(path)
+        if not isinstance(data, dict):
+            return None, 'Not a dictionary of node definitions'
+        check(data)
+    except Exception as ex:
+        message = getattr(ex, 'msg', None)
+        if message is not None:
+            return None, '{0}{1}'.format(getattr(ex, 'context', '') or '',
+                                         message)
+        return None, str(ex) or repr(ex)
+    return data, None
+
+class ImportSummary(object):
+    """
+    The result of :func:`import_files`.
+    """
+    def __init__(self):
+        self.files = 0
+        self.imported = list()
+        self.failed = OrderedDict()
+        self.timings = OrderedDict()
+
+    def report(self):
+        lines = ['Imported {0} node definition(s) from {1} file(s); '
+                 '{2} file(s) failed.'.format(len(self.imported), self.files,
+                                              len(self.failed))]
+        for path, error in self.failed.items():
+            lines.append('  FAILED {0}: {1}'.format(path, error))
+        lines.extend('  {0:<8} {1:8.3f}s'.format(phase, elapsed)
+                     for phase, elapsed in self.timings.items())
+        return '\n'.join(lines)
+
+def import_files(kvs, paths, user, workers=None, batch_size=500,
+                 load=load_yaml, check=check_node_def):
+    """
+    Import node definitions. Files that cannot be loaded, or fail the schema
+    check, are skipped; the rest is imported.
+
+    :param kvs: The key-value store of the UDS.
+    :param list paths: Node definition files and directories containing
+        them.
+    :param str user: The owner of the node definitions; they are stored as
+        ``node_def:<user>@<name>``.
+    :param int workers: The number of processes loading and checking the
+        files; the number of CPUs by default.
+    :param int batch_size: The number of node definitions written in one
+        batch.
+    :param callable load: Loads a file; must be picklable.
+    :param callable check: Checks the loaded node definitions; must be
+        picklable.
+    :rtype: :class:`ImportSummary`
+    """
+    summary = ImportSummary()
+    start = time.time()
+    files = find_files(paths)
+    summary.files = len(files)
+    summary.timings['find'] = time.time() - start
+
+    start = time.time()
+    items = OrderedDict()
+    prefix = 'node_def:{0}@'.format(user)
+    if files:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(load_file, files, [load] * len(files),
+                               [check] * len(files),
+                               chunksize=max(1, len(files) // 64))
+            for path, (data, error) in zip(files, results):
+                if error is not None:
+                    summary.failed[path] = error
+                    continue
+                for key, value in data.items():
+                    name = key.split(':', 1)[-1]
+                    newkey = prefix + name
+                    if newkey in items:
+                        log.warning('Node definition %r in %r overrides a '
+                                    'previous one', name, path)
+                    items[newkey] = value
+    summary.imported = [key[len(prefix):] for key in items]
+    summary.timings['check'] = time.time() - start
+
+    start = time.time()
+    items = list(items.items())
+    for i in range(0, len(items), batch_size):
+        write_batch(kvs, items[i:i + batch_size])
+    summary.timings['write'] = time.time() - start
+    summary.timings['total'] = sum(summary.timings.values())
+    return summary
@@ -36,8 +36,18 @@ The :func:`setup` function expects a config file either through its
 or it will try some default paths (see :func:`occo.util.config.config` for
 specifics). See the documentation of :func:`setup` for details.
 
+Startup can be profiled by specifying ``--profile-startup`` on the command
+line; the time spent loading the configuration, and importing each component,
+is printed to the standard error on exit. See :mod:`occo.api.startup`.
+
 """
 
+import sys
+import occo.api.startup as startup
+
+if startup.PROFILE_FLAG in sys.argv:
+    startup.profiler.start()
+
 args = None
 """Arguments parsed by argparse or an :mod:`occo.util.config` class."""
 
@@ -47,7 +57,8 @@ configuration = None
 infrastructure = None
 """The OCCO infrastructure defined in the configuration."""
 
-def setup(setup_args=None, cfg_path=None, auth_data_path=None):
+def setup(setup_args=None, cfg_path=None, auth_data_path=None,
+          lazy_plugins=False):
     """
     Build an OCCO application from configuration.
 
@@ -57,6 +68,10 @@ def setup(setup_args=None, cfg_path=None, auth_data_path=None):
     :param str cfg_path: Optional. The path of the configuration file. If
         unspecified, other sources will be used (see
         :func:`occo.util.config.config` for details).
+    :param bool lazy_plugins: Defer loading the plugins (``occo.plugins.*``)
+        imported by the configuration until they are used; see
+        :func:`load_plugins`. Recommended for short-lived commands that touch
+        only a few of the plugins.
 
     **OCCO Configuration**
 
@@ -103,6 +118,11 @@ def setup(setup_args=None, cfg_path=None, auth_data_path=None):
     .. todo:: Change conditionals and scattered error handling in this function
         to preliminary schema-checking (when the schema has been finalized).
     """
+    if startup.PROFILE_FLAG in sys.argv:
+        import atexit
+        startup.profiler.start()
+        atexit.register(startup.profiler.report)
+
     import occo.exceptions as exc
     import occo.util as util
     import occo.util.config as config
@@ -110,7 +130,22 @@ def setup(setup_args=None, cfg_path=None, auth_data_path=None):
     import logging
     import os
 
-    cfg = config.config(setup_args=setup_args, cfg_path=cfg_path, auth_data_path=auth_data_path)
+    if lazy_plugins:
+        import occo.util.factory as factory
+        if startup.plugins.hook(factory.MultiBackend):
+            startup.plugins.install()
+
+    def all_args(parser):
+        if setup_args:
+            setup_args(parser)
+        parser.add_argument(startup.PROFILE_FLAG, action='store_true',
+                            dest='profile_startup',
+                            help='print the time spent loading the '
+                                 'configuration and importing components')
+
+    with startup.profiler.phase('configuration'):
+        cfg = config.config(setup_args=all_args, cfg_path=cfg_path,
+                            auth_data_path=auth_data_path)
 
     log = logging.getLogger('occo')
 
@@ -135,36 +170,110 @@ def setup(setup_args=None, cfg_path=None, auth_data_path=None):
     except KeyError as ex:
         raise exc.MissingConfigurationError(ex.args[0])
 
+def load_plugins(match=None):
+    """
+    Load the plugins deferred by :func:`setup` (``lazy_plugins``). Plugins
+    needed by a component of the factory are loaded automatically; this
+    function is needed only if a plugin is used otherwise.
+
+    :param str match: Only load the plugins whose name contains this string;
+        all of them if unspecified.
+    :return: The names of the plugin modules loaded.
+    """
+    return startup.plugins.load(match)
+
 def yaml_file(filepath):
     import occo.util.config
     return occo.util.config.yaml_load_file(filepath)
 
-def killall(infra_id, ip):
+def compilation_cache(max_size=64, directory=None):
+    """
+    Create a cache of compiled infrastructure descriptions, keyed by the
+    descriptions, the node definitions they reference (as stored in the UDS),
+    and the version of the compiler. See
+    :class:`occo.api.cache.CompilationCache`.
+
+    :param int max_size: Maximum number of cached compiled descriptions.
+    :param str directory: Directory to persist the cache in; in-memory only if
+        unspecified.
+    """
+    from occo.compiler import StaticDescription
+    from occo.infobroker import main_info_broker
+    from occo.api.cache import CompilationCache
+    try:
+        import pkg_resources
+        version = pkg_resources.get_distribution('OCCO-Compiler').version
+    except Exception:
+        version = ''
+    return CompilationCache(
+        StaticDescription,
+        lambda node_type: main_info_broker.get('node.definition.all',
+                                               node_type),
+        max_size=max_size, directory=directory, version=version)
+
+def killall(infra_id, ip, **teardown_args):
+    """
+    Tear down an infrastructure, and remove it from the UDS.
+
+    :param teardown_args: See :func:`teardown`.
+    """
     import logging
     import occo.infobroker as ib
     log = logging.getLogger('occo.occoapp')
     log.info('Start dropping infrastructure %s', infra_id)
-    teardown(infra_id, ip)
+    teardown(infra_id, ip, **teardown_args)
     ib.main_uds.remove_infrastructure(infra_id)
     log.info('Finished dropping infrastructure %s', infra_id)
 
 
-def teardown(infra_id, ip):
+def teardown(infra_id, ip, max_workers=None, retries=0, timeout=None,
+             progress=None):
+    """
+    Drop all node instances of an infrastructure, then the infrastructure.
+
+    By default, all drop instructions are pushed to ``ip`` at once, and are
+    executed according to its processing strategy. If ``max_workers`` is
+    specified, the nodes are dropped concurrently, one instruction per node;
+    see :func:`occo.api.teardown.drop_nodes`. In this mode, the
+    infrastructure is only dropped if all of its nodes could be dropped.
+
+    :param int max_workers: The maximum number of concurrent node drops.
+    :param int retries: The number of times a failed node drop is retried
+        (concurrent mode only).
+    :param float timeout: The number of seconds after which a slow node drop
+        releases its worker (concurrent mode only).
+    :param callable progress: Called as ``progress(done, total, node_id,
+        error)`` after each node drop.
+    :raise occo.api.teardown.TeardownError: if some of the nodes could not be
+        dropped (concurrent mode only).
+    """
     import logging
     from ruamel import yaml
     log = logging.getLogger('occo.occoapp')
     datalog = logging.getLogger('occo.data.occoapp')
 
-    from occo.infobroker import main_info_broker
+    from occo.api.instrumentation import main_info_broker
 
     state = main_info_broker.get('infrastructure.node_instances',infra_id)
     from occo.util import flatten
     nodes = list(flatten(iter(i.values()) for i in state.values()))
-    drop_node_commands = [ip.cri_drop_node(n) for n in nodes]
     log.debug('Dropping nodes: %s', [n['node_id'] for n in nodes])
-    datalog.debug('DropNode:\n%s',
-                  yaml.dump(drop_node_commands, default_flow_style=False))
 
-    ip.push_instructions(infra_id, drop_node_commands)
+    if max_workers:
+        from occo.api.teardown import drop_nodes, TeardownError
+        failed = drop_nodes(infra_id, ip, nodes, max_workers=max_workers,
+                            retries=retries, timeout=timeout,
+                            progress=progress)
+        if failed:
+            raise TeardownError(infra_id, failed)
+    else:
+        drop_node_commands = [ip.cri_drop_node(n) for n in nodes]
+        datalog.debug('DropNode:\n%s',
+                      yaml.dump(drop_node_commands, default_flow_style=False))
+
+        ip.push_instructions(infra_id, drop_node_commands)
+        if progress:
+            for done, n in enumerate(nodes, 1):
+                progress(done, len(nodes), n['node_id'], None)
 
     ip.push_instructions(infra_id, ip.cri_drop_infrastructure(infra_id))
@@ -0,0 +1,153 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Warm restart of the Infrastructure Manager.
+
+The manager persists the set of the infrastructures it maintains in a
+:class:`StateFile`. After a restart, :func:`reattach` attaches all of them
+again: the attachments are executed concurrently, and rate-limited, so the
+backends are not flooded by the first passes of all the infrastructures.
+"""
+
+__all__ = ['StateFile', 'Reattachment', 'reattach']
+
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+log = logging.getLogger('occo.manager_service')
+
+class StateFile(object):
+    """
+    A file storing the identifiers of the managed infrastructures.
+
+    The file is replaced atomically, so it is never left incomplete if the
+    service is killed while writing it.
+
+    :param str path: The path of the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the identifiers of the managed infrastructures; an empty list if
+        the file does not exist.
+        """
+        try:
+            with open(self.path) as f:
+                return list(json.load(f).get('infrastructures', []))
+        except IOError:
+            return list()
+        except ValueError:
+            log.warning('Ignoring corrupt state file %r', self.path)
+            return list()
+
+    def save(self, infra_ids):
+        """
+        Replace the identifiers of the managed infrastructures.
+        """
+        data = json.dumps(dict(infrastructures=sorted(infra_ids)))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self.lock:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.occopus-')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(data)
+                os.replace(tmppath, self.path)
+            except BaseException:
+                os.unlink(tmppath)
+                raise
+
+class Reattachment(object):
+    """
+    The progress of reattaching infrastructures; see :func:`reattach`.
+    """
+    def __init__(self, infra_ids):
+        self.total = len(infra_ids)
+        self.attached = list()
+        self.failed = dict()
+        self.started = time.time()
+        self.finished = None
+        self.ready = threading.Event()
+
+    @property
+    def done(self):
+        return len(self.attached) + len(self.failed)
+
+    def to_dict(self):
+        return dict(ready=self.ready.is_set(),
+                    total=self.total,
+                    attached=len(self.attached),
+                    failed=dict(self.failed),
+                    elapsed=(self.finished or time.time()) - self.started)
+
+def reattach(attach, infra_ids, workers=8, rate=None, progress=None):
+    """
+    Attach infrastructures concurrently. Blocks until all of them have been
+    attached (or failed).
+
+    :param callable attach: Attaches an infrastructure; called with its
+        identifier.
+    :param list infra_ids: The identifiers of the infrastructures.
+    :param int workers: The maximum number of concurrent attachments.
+    :param float rate: The maximum number of attachments started per second;
+        unlimited by default.
+    :param progress: A :class:`Reattachment` to record the progress in; its
+        ``ready`` event is set when finished.
+    :rtype: :class:`Reattachment`
+    """
+    progress = progress or Reattachment(infra_ids)
+    lock = threading.Lock()
+    schedule = [time.time()]
+
+    def wait_for_turn():
+        if not rate:
+            return
+        with lock:
+            start = max(time.time(), schedule[0])
+            schedule[0] = start + 1.0 / rate
+        time.sleep(max(0, start - time.time()))
+
+    def attach_one(infra_id):
+        wait_for_turn()
+        try:
+            attach(infra_id)
+        except Exception as ex:
+            log.error('Cannot reattach infrastructure %s: %s', infra_id, ex)
+            with lock:
+                progress.failed[infra_id] = str(ex) or repr(ex)
+        else:
+            log.info('Reattached infrastructure %s', infra_id)
+            with lock:
+                progress.attached.append(infra_id)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(attach_one, infra_ids))
+    finally:
+        progress.finished = time.time()
+        progress.ready.set()
+    log.info('Reattached %d of %d infrastructures in %.1fs',
+             len(progress.attached), progress.total,
+             progress.finished - progress.started)
+    return progress
@@ -0,0 +1,190 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Node instance reports of infrastructures (see ``occopus-maintain -r``).
+
+The state of an infrastructure (``infrastructure.state``) is flattened into
+one record per node instance (see :func:`iter_instances`), which are written
+by a report writer as soon as they are produced: as log messages, plain
+text, JSON Lines or CSV (see :data:`FORMATS`). Multiple infrastructures can
+be reported concurrently into the same stream (see :func:`report_all`); the
+records of an infrastructure are written together.
+"""
+
+__all__ = ['iter_instances', 'report_all', 'FORMATS', 'DEFAULT_FIELDS',
+           'LogWriter', 'TextWriter', 'JsonLinesWriter', 'CsvWriter']
+
+import csv
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import logging
+log = logging.getLogger('occo')
+
+DEFAULT_FIELDS = ['infraid', 'nodename', 'node_id', 'state',
+                  'resource_address']
+"""Fields of the machine-readable reports by default."""
+
+def iter_instances(infra_id, state, node_filter=None):
+    """
+    Flatten the state of an infrastructure into records of node instances.
+
+    :param str infra_id: The identifier of the infrastructure.
+    :param dict state: The ``infrastructure.state`` of the infrastructure.
+    :param str node_filter: Only report nodes whose name contains this
+        string.
+    :return: Dictionaries containing ``infraid``, ``nodename``,
+        ``node_id``, and the items of the instance state.
+    """
+    for nodename, instances in state.items():
+        if node_filter and node_filter not in nodename:
+            continue
+        for node_id, instance in instances.items():
+            record = dict(instance)
+            record.update(infraid=infra_id, nodename=nodename,
+                          node_id=node_id)
+            yield record
+
+def addresses(record):
+    address = record.get('resource_address')
+    if address is None:
+        return []
+    return list(address) if isinstance(address, (list, tuple)) else [address]
+
+def text_value(record, field, missing=''):
+    if field == 'resource_address':
+        values = addresses(record)
+        return ' '.join(str(a) for a in values) if values else missing
+    value = record.get(field)
+    return missing if value is None else str(value)
+
+class ReportWriter(object):
+    """
+    Base class of report writers.
+
+    :param stream: The file to write to.
+    :param list fields: The fields of the records to write.
+    """
+    default_fields = DEFAULT_FIELDS
+
+    def __init__(self, stream=None, fields=None):
+        self.stream = stream
+        self.fields = fields or self.default_fields
+        self.lock = threading.Lock()
+
+    def write_all(self, records):
+        """
+        Write the records of an infrastructure, without interleaving them
+        with the records of other infrastructures.
+        """
+        with self.lock:
+            for record in records:
+                self.write(record)
+            if self.stream:
+                self.stream.flush()
+
+    def write(self, record):
+        raise NotImplementedError()
+
+class LogWriter(ReportWriter):
+    """
+    Logs the addresses of the node instances, grouped by node, and by
+    infrastructure if the ``infraid`` field is selected. A missing address is
+    logged as ``None``. Nothing is written to the stream.
+    """
+    default_fields = ['nodename', 'node_id', 'resource_address']
+
+    def __init__(self, stream=None, fields=None):
+        super(LogWriter, self).__init__(stream, fields)
+        self.current = None
+
+    def write(self, record):
+        node = record['infraid'], record['nodename']
+        if node != self.current:
+            if 'infraid' in self.fields and \
+                    (self.current is None or node[0] != self.current[0]):
+                log.info('Infrastructure %s:', record['infraid'])
+            self.current = node
+            log.info('%s:', record['nodename'])
+        log.info('  %s:', record['node_id'])
+        for address in addresses(record) or [None]:
+            log.info('    %s', address)
+
+class TextWriter(ReportWriter):
+    """
+    Writes the fields of each node instance in a line, separated by spaces;
+    by default, only the addresses. Missing values are written as ``None``.
+    """
+    default_fields = ['resource_address']
+
+    def write(self, record):
+        self.stream.write(' '.join(text_value(record, f, 'None')
+                                   for f in self.fields) + '\n')
+
+class JsonLinesWriter(ReportWriter):
+    """
+    Writes each node instance as a JSON object in a line.
+    """
+    def write(self, record):
+        self.stream.write(json.dumps(
+            dict((f, record.get(f)) for f in self.fields),
+            default=str) + '\n')
+
+class CsvWriter(ReportWriter):
+    """
+    Writes each node instance as a CSV row, after a header row. Multiple
+    addresses are separated by spaces.
+    """
+    def __init__(self, stream=None, fields=None):
+        super(CsvWriter, self).__init__(stream, fields)
+        self.writer = csv.writer(stream)
+        self.writer.writerow(self.fields)
+
+    def write(self, record):
+        self.writer.writerow([text_value(record, f) for f in self.fields])
+
+FORMATS = dict(log=LogWriter, text=TextWriter, jsonl=JsonLinesWriter,
+               csv=CsvWriter)
+"""Report writers by the name of the format."""
+
+def report_all(infra_ids, get_state, writer, workers=8, node_filter=None):
+    """
+    Report infrastructures concurrently.
+
+    :param list infra_ids: The identifiers of the infrastructures.
+    :param callable get_state: Gets the state of an infrastructure.
+    :param writer: The :class:`ReportWriter` to write to.
+    :param int workers: The maximum number of states queried concurrently.
+    :param str node_filter: See :func:`iter_instances`.
+    :return: The error messages by the identifiers of the infrastructures
+        that could not be reported.
+    :rtype: dict
+    """
+    def report(infra_id):
+        state = get_state(infra_id)
+        writer.write_all(iter_instances(infra_id, state, node_filter))
+
+    failed = dict()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(report, i), i) for i in infra_ids)
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as ex:
+                infra_id = futures[future]
+                log.error('Cannot report infrastructure %s: %s', infra_id, ex)
+                failed[infra_id] = str(ex) or repr(ex)
+    return failed
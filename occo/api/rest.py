@@ -21,17 +21,29 @@ Author: jozsef.kovacs@sztaki.mta.hu
 import occo.util as util
 import occo.api.occoapp as occoapp
 import occo.api.manager as inframanager
+import occo.api.cache as cache
+import occo.api.events as events
+import occo.api.metrics as metrics
+import occo.api.scalingops as scalingops
+import occo.api.jobs as jobs
 import occo.enactor.scaling as scaling
 
-from occo.infobroker import main_info_broker
+from occo.api.instrumentation import main_info_broker
 from occo.infobroker import main_uds
-from occo.exceptions import KeyNotFoundError, ArgumentError
+from occo.exceptions import KeyNotFoundError, ArgumentError, \
+    InfrastructureIDNotFoundException
 
 import occo.infobroker as ib
 
 import logging
-
-from flask import Flask, request, jsonify
+import contextlib
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS, cross_origin
 
 app = Flask(__name__)
@@ -41,15 +53,117 @@ manager = None
 
 log = None
 
-def init(strategy):
-    global log, manager
+rest_config = dict()
+"""The ``rest`` section of the components configuration."""
+
+infra_index = None
+"""Index of existing infrastructures; see
+:class:`~occo.api.cache.InfrastructureIndex`."""
+
+node_names = None
+"""Node names of infrastructures; see :class:`~occo.api.cache.NodeNameCache`."""
+
+report_pool = None
+"""Bounded thread pool creating the reports of bulk requests."""
+
+report_cache = None
+"""Recently created infrastructure reports and their ETags; see
+:func:`get_infra_report`."""
+
+event_feeds = None
+"""Shared change feeds of infrastructures; see :mod:`occo.api.events`."""
+
+cost_pool = None
+"""Bounded thread pool querying the costs of node instances."""
+
+cost_cache = None
+"""Recently queried costs of node instances; see :func:`get_cost`."""
+
+cost_lookups = dict()
+"""Cost queries in progress, by node instance; see
+:func:`submit_cost_lookup`."""
+
+cost_lookups_lock = threading.RLock()
+
+job_manager = None
+"""Background jobs of asynchronous requests; see :mod:`occo.api.jobs`."""
+
+request_duration = metrics.registry.histogram(
+        'occopus_http_request_duration_seconds',
+        'Latency of REST requests per route.', ('method', 'route', 'status'))
+
+managed_infrastructures = metrics.registry.gauge(
+        'occopus_managed_infrastructures',
+        'Number of infrastructures in the process table of the manager.')
+managed_infrastructures.set_function(
+        lambda: {(): len(manager.process_table) if manager else 0})
+
+def load_node_names(infraid):
+    sd = main_info_broker.get('infrastructure.static_description',
+                               infra_id=infraid)
+    return [ node['name'] for node in sd.nodes ]
+
+def init(strategy, reattach=True):
+    """Initialize the REST service.
+
+    :param bool reattach: Reattach the infrastructures maintained before the
+        last shutdown, in the background, if the manager persists them
+        (``state_file`` in the ``manager`` section). Skipped in the reloader
+        process of the ``development`` engine, which does not serve requests
+        (see :func:`occo.api.serving.serving_process`); see
+        :meth:`~occo.api.manager.InfrastructureManager.reattach_all`. Until
+        finished, ``/ready`` reports the service as not ready.
+    """
+    global log, manager, rest_config, infra_index, node_names, report_pool, \
+        report_cache, event_feeds, cost_pool, cost_cache, job_manager
     log = logging.getLogger('occo.manager-service')
+    rest_config = occoapp.configuration['components'].get('rest') or dict()
+    infra_index = cache.InfrastructureIndex(
+            lambda: util.Infralist().get(),
+            refresh_interval=rest_config.get('infra_index_refresh', 30))
+    node_names = cache.NodeNameCache(
+            load_node_names,
+            max_age=rest_config.get('node_names_max_age', 60))
+    report_pool = ThreadPoolExecutor(
+            max_workers=rest_config.get('report_workers', 8))
+    report_cache = cache.TTLCache(
+            max_age=rest_config.get('report_max_age', 1),
+            max_size=rest_config.get('report_cache_size', 1000))
+    event_feeds = events.ChangeFeeds(
+            lambda infraid: get_infra_report(infraid)[0],
+            interval=rest_config.get('events_interval', 2),
+            queue_size=rest_config.get('events_queue_size', 100))
+    cost_pool = ThreadPoolExecutor(
+            max_workers=rest_config.get('cost_workers', 8))
+    cost_cache = cache.TTLCache(
+            max_age=rest_config.get('cost_max_age', 300),
+            max_size=rest_config.get('cost_cache_size', 10000))
+    job_manager = jobs.JobManager(
+            workers=rest_config.get('job_workers', 4),
+            history=rest_config.get('job_history', 1000))
+    main_info_broker.enabled = bool(rest_config.get('infobroker_stats', False))
     manager = inframanager.InfrastructureManager(
-            process_strategy = occoapp.args.strategy)
+            process_strategy = occoapp.args.strategy,
+            **(rest_config.get('manager') or dict()))
+    import occo.api.serving as serving
+    if reattach and serving.serving_process(rest_config):
+        manager.reattach_all(
+                workers=rest_config.get('reattach_workers', 8),
+                rate=rest_config.get('reattach_rate'),
+                exists=lambda infraid: infraid in infra_index,
+                background=True)
+
+def serve(host=None, port=None):
+    """Serve the REST interface with the engine selected in the ``rest``
+    section of the configuration. See :mod:`occo.api.serving`."""
+    import occo.api.serving as serving
+    serving.serve(app, rest_config, host=host, port=port)
 
 def keyboardInterrupt():
     log.info('Ctrl+C - Exiting.')
-    for i in manager.process_table.iterkeys():
+    manager.shutdown()
+    job_manager.shutdown()
+    for i in list(manager.process_table.keys()):
         log.info('Infrastructure left running: %s', str(i))
 
 class RequestException(Exception):
@@ -61,8 +175,11 @@ class RequestException(Exception):
                     reason=self.reason,
                     message=str(self))
 
+def get_infra_state(infraid):
+    return main_info_broker.get('infrastructure.state', infra_id=infraid)
+
 def create_infra_report(infraid):
-    infrastate = main_info_broker.get('infrastructure.state', infra_id=infraid)
+    infrastate = get_infra_state(infraid)
     result = dict()
     for nodename,instances in infrastate.items():
         nnd = dict()
@@ -76,6 +193,130 @@ def create_infra_report(infraid):
         result[nodename]=nnd
     return result
 
+def report_etag(report):
+    """Create a stable content hash of a report, to be used as its ETag."""
+    data = json.dumps(report, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def get_infra_report(infraid):
+    """Get the report of an infrastructure and its ETag.
+
+    Reports are shared by requests for ``report_max_age`` seconds (see the
+    ``rest`` section of the configuration), so concurrent pollers of the same
+    infrastructure do not recreate the report.
+
+    :return: ``(report, etag)``
+    """
+    def create(infraid):
+        report = create_infra_report(infraid)
+        return report, report_etag(report)
+    return report_cache.get(infraid, create)
+
+def create_bulk_report(infraids):
+    """Create the reports of multiple infrastructures concurrently.
+
+    Infrastructures that do not exist or cannot be reported are listed in
+    ``errors`` instead of failing the whole report.
+    """
+    reports, errors = dict(), dict()
+    futures = dict()
+    for infraid in set(infraids):
+        if infraid in infra_index:
+            futures[infraid] = report_pool.submit(get_infra_report, infraid)
+        else:
+            errors[infraid] = 'Infrastructure does not exist'
+    for infraid, future in futures.items():
+        try:
+            reports[infraid] = future.result()[0]
+        except Exception as ex:
+            log.exception('create_infra_report(%s):', infraid)
+            errors[infraid] = str(ex)
+    return dict(infrastructures=reports, errors=errors)
+
+def is_true(value):
+    """Interpret a query string parameter as a boolean flag."""
+    return value is not None and value.lower() in ('1', 'true', 'yes', 'on')
+
+def job_step(job, name):
+    """Record a step of ``job``; nothing is recorded if ``job`` is
+    :data:`None` (the operation is executed synchronously)."""
+    return job.step(name) if job else contextlib.nullcontext(dict())
+
+def start_job(kind, function, key=None, **info):
+    """Execute ``function(job)`` as a background job, and create the
+    ``202 Accepted`` response pointing to its status. If a job with the same
+    ``key`` is still pending or running, the response points to that job
+    instead (see :meth:`occo.api.jobs.JobManager.submit_once`)."""
+    job, created = job_manager.submit_once(key, kind, function, **info)
+    if created:
+        log.info('Started %s job %s', kind, job.id)
+    else:
+        log.info('Reusing %s job %s in progress', kind, job.id)
+    response = jsonify(dict(jobid=job.id, status='/jobs/{0}'.format(job.id)))
+    response.status_code = 202
+    response.headers['Location'] = '/jobs/{0}'.format(job.id)
+    return response
+
+def create_infrastructure(infra_desc, job=None):
+    """Compile, store and start maintaining an infrastructure.
+
+    :return: ``{"infraid": <infraid>}``
+    """
+    with job_step(job, 'compile'):
+        infraid = manager.submit_infrastructure(infra_desc)
+    if job:
+        job.info['infraid'] = infraid
+    with job_step(job, 'register'):
+        util.Infralist().add(infraid)
+        infra_index.add(infraid)
+    with job_step(job, 'start'):
+        manager.start_provisioning(infraid)
+    return dict(infraid=infraid)
+
+def destroy_infrastructure(infraid, job=None):
+    """Stop maintaining an infrastructure, tear it down, and forget it.
+
+    :return: ``{"infraid": <infraid>}``
+    :raise occo.api.teardown.TeardownError: if some of the nodes could not be
+        dropped.
+    """
+    from occo.api.teardown import log_progress
+    with job_step(job, 'detach'):
+        if infraid in manager.process_table:
+            try:
+                manager.stop_provisioning(infraid)
+            except InfrastructureIDNotFoundException:
+                # Detached concurrently
+                pass
+    with job_step(job, 'teardown') as step:
+        def progress(done, total, node_id, error):
+            log_progress(done, total, node_id, error)
+            step['progress'] = dict(done=done, total=total)
+        manager.tear_down(infraid,
+                          max_workers=rest_config.get('teardown_workers'),
+                          retries=rest_config.get('teardown_retries', 2),
+                          timeout=rest_config.get('teardown_timeout'),
+                          progress=progress)
+    with job_step(job, 'unregister'):
+        util.Infralist().remove(infraid)
+        infra_index.remove(infraid)
+        node_names.invalidate(infraid)
+        report_cache.discard(infraid)
+    return dict(infraid=infraid)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.time()
+
+@app.after_request
+def record_request_duration(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_duration.observe(time.time() - started, method=request.method,
+                                 route=rule, status=response.status_code)
+    return response
+
 @app.errorhandler(RequestException)
 def handled_exception(error):
     log.error('An exception occured: %r', error)
@@ -92,15 +333,13 @@ def unhandled_exception(error):
     return response
 
 def error_if_nodename_does_not_exist(infraid,nodename):
-    sd = main_info_broker.get('infrastructure.static_description',
-                               infra_id=infraid)
-    if not nodename in [ node['name'] for node in sd.nodes ]:
+    if not node_names.contains(infraid, nodename):
         raise RequestException(300,
               'ERROR: node \'{0} does not exist in infrastructure \'{1}\'!'.format(
               nodename,infraid))
 
 def error_if_infraid_does_not_exist(infraid):
-    if infraid not in util.Infralist().get():
+    if infraid not in infra_index:
         raise RequestException(300,
               'ERROR: infrastructure \'{0}\' does not exist!'.format(
               infraid))
@@ -113,6 +352,11 @@ def submit_infrastructure():
 
     Requires an :ref:`infrastructure description <infradescription>` as POST data.
 
+    :param async: If ``true``, the infrastructure is created by a background
+        job, and ``202 Accepted`` is returned with the identifier of the job
+        (see :func:`get_job`); the identifier of the infrastructure becomes
+        available in the status of the job.
+
     :return type:
         .. code::
 
@@ -130,14 +374,16 @@ def submit_infrastructure():
     log.info('Submitting infrastructure:\n%s', util.yamldump(infra_desc))
     if not infra_desc:
         raise RequestException(400, 'Empty POST data')
+    if is_true(request.args.get('async')):
+        return start_job('create',
+                         lambda job: create_infrastructure(infra_desc, job))
     try:
-        infraid = manager.add(infra_desc)
-        util.Infralist().add(infraid)
+        result = create_infrastructure(infra_desc)
     except Exception as ex:
-        log.exception('manager.add:')
+        log.exception('create_infrastructure:')
         raise RequestException(400, str(ex))
     else:
-        return jsonify(dict(infraid=infraid))
+        return jsonify(result)
 
 @app.route('/infrastructures/<infraid>', methods=['GET'])
 def report_infrastructure(infraid):
@@ -166,12 +412,41 @@ def report_infrastructure(infraid):
                 ...
             }
 
+    The response carries an ``ETag`` header, a hash of the report. If the
+    ETag sent in ``If-None-Match`` is still current, ``304 Not Modified`` is
+    returned without a body.
+
+    With ``?wait=<seconds>`` and ``If-None-Match``, the request is a long
+    poll: it blocks until the report differs from the given ETag, or the
+    given number of seconds elapses (``304 Not Modified``). The report is
+    checked every ``long_poll_interval`` seconds, and the wait is capped at
+    ``long_poll_max_wait`` seconds (see the ``rest`` section of the
+    configuration).
+
+    Example::
+
+        curl -H 'If-None-Match: "<etag>"' 'http://127.0.0.1:5000/infrastructures/<infraid>?wait=30'
     """
     error_if_infraid_does_not_exist(infraid)
     log.debug('Serving request %s infrastructures/%s',
                 request.method, infraid)
-    result = create_infra_report(infraid)
-    return jsonify(result)
+    result, etag = get_infra_report(infraid)
+
+    wait = request.args.get('wait', type=float)
+    if wait and request.if_none_match.contains(etag):
+        wait = min(wait, rest_config.get('long_poll_max_wait', 60))
+        interval = rest_config.get('long_poll_interval', 2)
+        deadline = time.time() + wait
+        while request.if_none_match.contains(etag):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            result, etag = get_infra_report(infraid)
+
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 @app.route('/infrastructures/', methods=['GET'])
 def list_infrastructures():
@@ -187,15 +462,58 @@ def list_infrastructures():
                 ]
             }
 
+    With ``?detail=true``, the reports of the infrastructures are returned in
+    a single document instead (see :func:`report_infrastructure`). The
+    infrastructures can be selected with ``ids``, a comma-separated list of
+    identifiers; all infrastructures are reported by default. The reports are
+    created concurrently by at most ``report_workers`` threads (see the
+    ``rest`` section of the configuration).
+
+    :return type:
+        .. code::
+
+            {
+                "infrastructures": {
+                    "<infraid>": { <report> },
+                    ...
+                },
+                "errors": {
+                    "<infraid>": "<error_message>",
+                    ...
+                }
+            }
+
+    Example::
+
+        curl 'http://127.0.0.1:5000/infrastructures/?detail=true&ids=<infraid1>,<infraid2>'
     """
     log.debug('Serving request: %s infrastructures',request.method)
-    return jsonify(dict(infrastuctures=util.Infralist().get()))
+    if not is_true(request.args.get('detail')):
+        return jsonify(dict(infrastuctures=util.Infralist().get()))
+
+    ids = request.args.get('ids')
+    if ids:
+        infraids = [i for i in ids.split(',') if i]
+    else:
+        infraids = util.Infralist().get()
+    return jsonify(create_bulk_report(infraids))
 
 @app.route('/infrastructures/<infraid>', methods=['DELETE'])
 def delete_infrastructure(infraid):
     """Shuts down an infrastructure.
 
+    If ``teardown_workers`` is set in the ``rest`` section of the
+    configuration, the node instances are dropped concurrently by at most that
+    many threads, retrying failed drops ``teardown_retries`` times; a drop
+    slower than ``teardown_timeout`` seconds releases its thread, but is
+    still waited for. The progress is logged. See
+    :func:`occo.api.occoapp.teardown`.
+
     :param infraid: The identifier of the infrastructure.
+    :param async: If ``true``, the infrastructure is destroyed by a background
+        job, and ``202 Accepted`` is returned with the identifier of the job
+        (see :func:`get_job`). While the job is pending or running, further
+        requests return the same job instead of starting another teardown.
 
     :return type:
         .. code::
@@ -208,12 +526,71 @@ def delete_infrastructure(infraid):
     error_if_infraid_does_not_exist(infraid)
     log.debug('Serving request %s infrastructures/%s',
                 request.method, infraid)
-    if infraid in manager.process_table:
-        manager.stop_provisioning(infraid)
-    manager.tear_down(infraid)
-    util.Infralist().remove(infraid)
+    if is_true(request.args.get('async')):
+        return start_job('destroy',
+                         lambda job: destroy_infrastructure(infraid, job),
+                         key=('destroy', infraid), infraid=infraid)
+    from occo.api.teardown import TeardownError
+    try:
+        return jsonify(destroy_infrastructure(infraid))
+    except TeardownError as ex:
+        raise RequestException(500, 'Infrastructure could not be torn down',
+                               str(ex))
 
-    return jsonify(dict(infraid=infraid))
+@app.route('/jobs/', methods=['GET'])
+def list_jobs():
+    """List the background jobs of asynchronous requests, in the order of
+    their creation. Finished jobs are forgotten after a while (see
+    ``job_history`` in the ``rest`` section of the configuration).
+
+    :return type:
+        .. code::
+
+            {
+                "jobs": [ <job status, see get_job>, ... ]
+            }
+    """
+    return jsonify(dict(jobs=[job.to_dict() for job in job_manager.list()]))
+
+@app.route('/jobs/<jobid>', methods=['GET'])
+def get_job(jobid):
+    """Report the status of a background job.
+
+    :param jobid: The identifier of the job.
+
+    :return type:
+        .. code::
+
+            {
+                "jobid": "<jobid>",
+                "kind": "create" | "destroy",
+                "infraid": "<infraid>",
+                "state": "pending" | "running" | "succeeded" | "failed",
+                "steps": [
+                    {
+                        "name": "<step>",
+                        "state": "running" | "succeeded" | "failed",
+                        "started": <timestamp>,
+                        "finished": <timestamp>,
+                        "error": "<message>",
+                        "progress": { "done": <n>, "total": <n> }
+                    },
+                    ...
+                ],
+                "created": <timestamp>,
+                "started": <timestamp>,
+                "finished": <timestamp>,
+                "result": { "infraid": "<infraid>" },
+                "error": "<message>"
+            }
+
+    ``infraid`` is available when it is known; ``progress`` is reported by
+    the ``teardown`` step if the nodes are dropped concurrently.
+    """
+    try:
+        return jsonify(job_manager.get(jobid).to_dict())
+    except KeyError:
+        raise RequestException(404, 'Job not found: "{0}"'.format(jobid))
 
 @app.route('/infrastructures/<infraid>/attach', methods=['POST'])
 def attach_infrastructure(infraid):
@@ -322,6 +699,7 @@ def create_node(infraid, nodename, count = 1):
     error_if_infraid_does_not_exist(infraid)
     error_if_nodename_does_not_exist(infraid,nodename)
     scaling.add_createnode_request(infraid, nodename, count)
+    manager.wake(infraid)
     return jsonify(dict(method='scaleup',
                         infraid=infraid,
                         nodename=nodename,
@@ -348,6 +726,38 @@ def drop_node_noselect(infraid, nodename):
     """
     return drop_node(infraid, nodename, None)
 
+@app.route('/infrastructures/<infraid>/scaledown/<nodename>/count/<int:count>', methods=['POST'])
+def drop_node_count(infraid, nodename, count):
+    """Scales down a node by destroying the specified number of its instances
+    in the infrastructure. The instances to be destroyed are automatically
+    selected by OCCO based on its configured DownScale strategy. The drop
+    requests are written in a single transaction.
+
+    :param infraid: The identifier of the infrastructure.
+    :param nodename: The name of the node to be scaled down.
+    :param count: The number of instances to be destroyed.
+
+    :return type:
+        .. code::
+
+            {
+                "count": <count>,
+                "infraid": "<infraid>",
+                "method": "scaledown",
+                "nodename": "<nodename>"
+            }
+    """
+    error_if_infraid_does_not_exist(infraid)
+    error_if_nodename_does_not_exist(infraid,nodename)
+    if count < 1:
+        raise RequestException(400, 'Count must be a positive integer')
+    scalingops.drop_count(infraid, nodename, count, scaling, main_uds)
+    manager.wake(infraid)
+    return jsonify(dict(method='scaledown',
+                        infraid=infraid,
+                        nodename=nodename,
+                        count=count))
+
 @app.route('/infrastructures/<infraid>/scaledown/<nodename>/<nodeid>', methods=['POST'])
 def drop_node(infraid, nodename, nodeid):
     """Scales down a node in an infrastructure by destroying one of its instances specified.
@@ -369,6 +779,7 @@ def drop_node(infraid, nodename, nodeid):
     error_if_infraid_does_not_exist(infraid)
     error_if_nodename_does_not_exist(infraid,nodename)
     scaling.add_dropnode_request(infraid, nodename, nodeid)
+    manager.wake(infraid)
     return jsonify(dict(method='scaledown',
                         infraid=infraid,
                         nodename=nodename,
@@ -396,11 +807,88 @@ def scale_node(infraid, nodename, count):
     error_if_infraid_does_not_exist(infraid)
     error_if_nodename_does_not_exist(infraid,nodename)
     scaling.set_scalenode_request(infraid, nodename, count)
+    manager.wake(infraid)
     return jsonify(dict(method='scaleto',
                         infraid=infraid,
                         nodename=nodename,
                         count=count))
 
+@app.route('/scaling', methods=['POST'])
+def scale_batch():
+    """Executes a batch of scaling operations, possibly spanning multiple
+    nodes and infrastructures.
+
+    Requires the list of operations in JSON format as the POST data (see
+    :mod:`occo.api.scalingops`):
+
+    .. code::
+
+        {
+            "operations": [
+                { "method": "scaleup", "infraid": "<infraid>",
+                  "nodename": "<nodename>", "count": <count> },
+                { "method": "scaledown", "infraid": "<infraid>",
+                  "nodename": "<nodename>", "nodeid": "<nodeid>" },
+                { "method": "scaleto", "infraid": "<infraid>",
+                  "nodename": "<nodename>", "count": <count> },
+                ...
+            ]
+        }
+
+    Each infrastructure and node is validated once. Operations on the same
+    node are merged, and each affected infrastructure is woken up once. The
+    merged requests are written to the UDS in one batch.
+    Invalid operations are reported, and do not prevent the execution of the
+    others.
+
+    :return type:
+        .. code::
+
+            {
+                "results": [
+                    { "method": ..., "infraid": ..., "nodename": ...,
+                      "count"/"nodeid": ..., "status": "ok" },
+                    { ..., "status": "error", "reason": "<reason>" },
+                    ...
+                ],
+                "errors": <number of failed operations>
+            }
+    """
+    try:
+        operations = scalingops.parse(request.get_json(force=True))
+    except Exception as ex:
+        raise RequestException(400, 'Invalid batch of scaling operations',
+                               str(ex))
+    scalingops.validate(operations,
+                        lambda infraid: infraid in infra_index,
+                        node_names.contains)
+    for infraid in scalingops.execute(operations, scaling, main_uds):
+        manager.wake(infraid)
+    results = [op.to_dict() for op in operations]
+    return jsonify(dict(results=results,
+                        errors=sum(1 for r in results if r['status'] != 'ok')))
+
+@app.route('/infrastructures/<infraid>/wake', methods=['POST'])
+def wake_infrastructure(infraid):
+    """Requests an Enactor pass of an infrastructure as soon as possible,
+    e.g. after scaling requests submitted by another process
+    (``occopus-scale --wake-url``). Nothing happens if the infrastructure is
+    not maintained by this service.
+
+    :param infraid: The identifier of the infrastructure.
+
+    :return type:
+        .. code::
+
+            {
+                "infraid": "<infraid>",
+                "maintained": true/false
+            }
+    """
+    error_if_infraid_does_not_exist(infraid)
+    manager.wake(infraid)
+    return jsonify(dict(infraid=infraid,
+                        maintained=infraid in manager.process_table))
 
 @app.route('/infrastructures/<infraid>/notify', methods=['POST'])
 def set_notification(infraid):
@@ -427,38 +915,218 @@ def set_notification(infraid):
 def get_cost(infraid):
     """Query cost of the infrastructure.
 
+    The costs of the node instances are queried concurrently by at most
+    ``cost_workers`` threads, and are cached for ``cost_max_age`` seconds (see
+    the ``rest`` section of the configuration). The query waits at most
+    ``cost_timeout`` seconds for the costs.
+
+    If the cost of an instance cannot be queried, its last known (expired)
+    cost is used, or 0 if there is none. An instance is only queried once at
+    a time; concurrent requests wait for the same query.
+
     :param infraid: The identifier of the infrastructure.
+    :param status: If ``true``, the instances whose cost is stale or unknown
+        are listed in ``status``.
 
     :return type:
         .. code::
 
             {
                 "totalcost": <totalcost>,
-                "nodecosts" {
-                    "<nodename>": {
-                        "<nodeid>": <nodeidcost>,
-                        ...
-                    },
+                "<nodename>": {
+                    "<nodeid>": <nodeidcost>,
                     ...
-                }
+                },
+                ...
+            }
+
+        With ``status=true``, the following item is added:
+
+        .. code::
+
+            "status": {
+                "stale": [ "<nodeid>", ... ],
+                "failed": [ "<nodeid>", ... ]
             }
     """
     error_if_infraid_does_not_exist(infraid)
-    infrastate = main_info_broker.get('infrastructure.state', infra_id=infraid)
-    result = dict()
-    result['totalcost'] = 0
+    infrastate = get_infra_state(infraid)
+    futures = dict()
     for nodename,instances in infrastate.items():
-        result[nodename] = dict()
         for nodeid,nivalue in instances.items():
-            cost = 0
-            try:
-                cost = ib.main_resourcehandler.get_cost(nivalue)
-            except Exception as e:
-                pass
-            result['totalcost'] += cost
-            result[nodename][nodeid] = cost
+            futures[submit_cost_lookup(nodeid, nivalue)] = (nodename, nodeid)
+    done, _ = wait(futures, timeout=rest_config.get('cost_timeout', 30))
+
+    result = dict(totalcost=0)
+    statuses = dict(stale=list(), failed=list())
+    for nodename in infrastate:
+        result[nodename] = dict()
+    for future, (nodename, nodeid) in futures.items():
+        if future in done:
+            cost, status = future.result()
+        else:
+            log.warning('Timeout querying the cost of %s', nodeid)
+            cost, status = cached_instance_cost(nodeid)
+        if status:
+            statuses[status].append(nodeid)
+        result['totalcost'] += cost
+        result[nodename][nodeid] = cost
+    if is_true(request.args.get('status')):
+        result['status'] = statuses
     return jsonify(result)
 
+def submit_cost_lookup(nodeid, nivalue):
+    """Query the cost of a node instance in the background, unless it is
+    already being queried.
+
+    :return: The future of the query; see :func:`query_instance_cost`.
+    """
+    with cost_lookups_lock:
+        future = cost_lookups.get(nodeid)
+        if future is None:
+            future = cost_pool.submit(query_instance_cost, nodeid, nivalue)
+            cost_lookups[nodeid] = future
+            future.add_done_callback(
+                lambda f: forget_cost_lookup(nodeid, f))
+        return future
+
+def forget_cost_lookup(nodeid, future):
+    with cost_lookups_lock:
+        if cost_lookups.get(nodeid) is future:
+            del cost_lookups[nodeid]
+
+def cached_instance_cost(nodeid):
+    """Get the last known cost of a node instance.
+
+    :return: ``(cost, status)``; ``status`` is :data:`None`, ``'stale'``, or
+        ``'failed'`` if the cost is fresh, expired, or unknown, respectively.
+    """
+    cached = cost_cache.lookup(nodeid)
+    if cached is None:
+        return 0, 'failed'
+    return cached[0], None if cached[1] else 'stale'
+
+def query_instance_cost(nodeid, nivalue):
+    """Get the cost of a node instance from the cache, or from the resource
+    handler if it is not cached or has expired.
+
+    :return: ``(cost, status)``; see :func:`cached_instance_cost`.
+    """
+    cost, status = cached_instance_cost(nodeid)
+    if status is None:
+        return cost, status
+    try:
+        cost = ib.main_resourcehandler.get_cost(nivalue)
+    except Exception as ex:
+        log.warning('Cannot query the cost of %s: %s', nodeid, ex)
+        return cost, status
+    cost_cache.store(nodeid, cost)
+    return cost, None
+
+
+@app.route('/infrastructures/<infraid>/events', methods=['GET'])
+def stream_events(infraid):
+    """Stream the changes of an infrastructure as Server-Sent Events.
+
+    The first event (``snapshot``) contains the full report of the
+    infrastructure (see :func:`report_infrastructure`); it is followed by
+    ``state``, ``resource_address`` and ``scaling`` events as node instances
+    change state, get addresses assigned, or the scaling targets of nodes
+    change. See :mod:`occo.api.events` for the format of the events.
+
+    The state of an infrastructure is checked every ``events_interval``
+    seconds by a single feed shared by all clients streaming its events (see
+    the ``rest`` section of the configuration). Each open stream occupies a
+    worker thread of the serving engine.
+
+    :param infraid: The identifier of the infrastructure.
+
+    :return type:
+        .. code::
+
+            event: state
+            data: {"node": "<nodename>", "node_id": "<nodeid>", "old": "<state>", "new": "<state>"}
+
+    Example::
+
+        curl -N http://127.0.0.1:5000/infrastructures/<infraid>/events
+    """
+    error_if_infraid_does_not_exist(infraid)
+    log.debug('Serving request %s infrastructures/%s/events',
+                request.method, infraid)
+    subscription = event_feeds.subscribe(infraid)
+    heartbeat = rest_config.get('events_heartbeat', 15)
+
+    def generate():
+        try:
+            for event, data in subscription.events(heartbeat):
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield 'event: {0}\ndata: {1}\n\n'.format(
+                        event, json.dumps(data, default=str))
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Returns the metrics of the manager service in the Prometheus text
+    exposition format. See :mod:`occo.api.metrics`.
+    """
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready', methods=['GET'])
+def get_readiness():
+    """Returns whether the service is ready: the infrastructures maintained
+    before the last shutdown have all been reattached. Responds with status
+    ``503`` until then.
+
+    :return type:
+        .. code::
+
+            {
+                "ready": false,
+                "total": 120,
+                "attached": 64,
+                "failed": { "<infraid>": "<error>" },
+                "elapsed": 3.2
+            }
+    """
+    status = manager.reattachment.to_dict() if manager.reattachment \
+             else dict(ready=True)
+    response = jsonify(status)
+    response.status_code = 200 if manager.ready else 503
+    return response
+
+@app.route('/stats/infobroker', methods=['GET'])
+def get_infobroker_stats():
+    """Returns the call counts, error rates and latencies of the info broker
+    queries per info key, recorded while the instrumentation is enabled. See
+    :mod:`occo.api.instrumentation`.
+    """
+    return jsonify(main_info_broker.stats())
+
+@app.route('/stats/infobroker', methods=['POST'])
+def set_infobroker_stats():
+    """Switches the instrumentation of the info broker queries on or off,
+    and/or drops the statistics recorded so far.
+
+    :param enabled: ``true`` or ``false``; unchanged if not specified.
+    :param reset: ``true`` to drop the statistics recorded so far.
+    """
+    enabled = request.args.get('enabled')
+    if enabled is not None:
+        main_info_broker.enabled = is_true(enabled)
+        log.info('Info broker instrumentation %s',
+                 'enabled' if main_info_broker.enabled else 'disabled')
+    if is_true(request.args.get('reset')):
+        main_info_broker.reset()
+    return jsonify(main_info_broker.stats())
 
 @app.route('/info/<key>', methods=['GET'])
 def info(key):
@@ -0,0 +1,285 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Batches of scaling operations, possibly spanning multiple nodes and
+infrastructures.
+
+A batch is processed in three steps:
+
+1. :func:`parse`: the operations are parsed from their JSON form::
+
+       {"method": "scaleup",   "infraid": ..., "nodename": ..., "count": <n>}
+       {"method": "scaledown", "infraid": ..., "nodename": ..., "nodeid": <id>}
+       {"method": "scaledown", "infraid": ..., "nodename": ..., "count": <n>}
+       {"method": "scaleto",   "infraid": ..., "nodename": ..., "count": <n>}
+
+   (``count`` defaults to 1 for ``scaleup`` and ``scaledown``.)
+
+2. :func:`validate`: each infrastructure and node referenced is checked once.
+
+3. :func:`execute`: operations on the same node are coalesced, and the
+   resulting scaling requests are submitted, and written to the UDS in one
+   batch (see :mod:`occo.api.kvbatch`).
+
+Each operation carries its own result; an invalid operation does not prevent
+the others from being executed.
+
+Scaling down by a number of instances, without selecting them, is submitted
+by :func:`drop_count`, in a single write.
+"""
+
+__all__ = ['ScalingOperation', 'parse', 'validate', 'coalesce', 'execute',
+           'drop_count']
+
+import occo.api.kvbatch as kvbatch
+
+import logging
+log = logging.getLogger('occo.manager-service')
+
+METHODS = ('scaleup', 'scaledown', 'scaleto')
+
+class ScalingOperation(object):
+    """
+    A single scaling operation of a batch, and its result.
+    """
+    def __init__(self, method=None, infraid=None, nodename=None, count=None,
+                 nodeid=None):
+        self.method = method
+        self.infraid = infraid
+        self.nodename = nodename
+        self.count = count
+        self.nodeid = nodeid
+        self.error = None
+
+    @property
+    def node(self):
+        return (self.infraid, self.nodename)
+
+    def fail(self, reason):
+        if self.error is None:
+            self.error = reason
+
+    def to_dict(self):
+        result = dict(method=self.method,
+                      infraid=self.infraid,
+                      nodename=self.nodename)
+        if self.nodeid is not None:
+            result['nodeid'] = self.nodeid
+        else:
+            result['count'] = self.count
+        if self.error is None:
+            result['status'] = 'ok'
+        else:
+            result.update(status='error', reason=self.error)
+        return result
+
+def parse_operation(data):
+    if not isinstance(data, dict):
+        op = ScalingOperation()
+        op.fail('Operation must be an object')
+        return op
+    op = ScalingOperation(data.get('method'), data.get('infraid'),
+                          data.get('nodename'), data.get('count'),
+                          data.get('nodeid'))
+    if op.method not in METHODS:
+        op.fail('Unknown method; must be one of: {0}'.format(
+                ', '.join(METHODS)))
+    elif not op.infraid or not op.nodename:
+        op.fail('"infraid" and "nodename" must be specified')
+    elif op.method == 'scaledown' and op.nodeid is not None:
+        op.count = None
+    elif op.method in ('scaleup', 'scaledown'):
+        if op.count is None:
+            op.count = 1
+        if not isinstance(op.count, int) or op.count < 1:
+            op.fail('"count" must be a positive integer')
+    elif op.method == 'scaleto':
+        if not isinstance(op.count, int) or op.count < 0:
+            op.fail('"count" must be a non-negative integer')
+    return op
+
+def parse(data):
+    """
+    Parse a batch of operations.
+
+    :param data: The list of operations, or a dictionary containing them as
+        ``operations``.
+    :return: The list of :class:`ScalingOperation` objects; operations that
+        cannot be parsed are marked as failed.
+    :raise ValueError: if ``data`` is not a batch of operations.
+    """
+    if isinstance(data, dict):
+        data = data.get('operations')
+    if not isinstance(data, list):
+        raise ValueError('A list of operations is expected')
+    return [parse_operation(item) for item in data]
+
+def validate(operations, infra_exists, node_exists):
+    """
+    Check that the infrastructures and nodes referenced exist, and that the
+    operations on each node are compatible: a ``scaleto`` operation cannot be
+    combined with other methods on the same node.
+
+    Each infrastructure and node is checked once, however many operations
+    reference it.
+
+    :param callable infra_exists: ``infra_exists(infraid)``
+    :param callable node_exists: ``node_exists(infraid, nodename)``
+    """
+    infras, nodes = dict(), dict()
+    methods = dict()
+    for op in operations:
+        if op.error is not None:
+            continue
+        if op.infraid not in infras:
+            infras[op.infraid] = infra_exists(op.infraid)
+        if not infras[op.infraid]:
+            op.fail('Infrastructure does not exist')
+            continue
+        if op.node not in nodes:
+            nodes[op.node] = node_exists(op.infraid, op.nodename)
+        if not nodes[op.node]:
+            op.fail('Node does not exist in the infrastructure')
+            continue
+        methods.setdefault(op.node, set()).add(op.method)
+    for op in operations:
+        used = methods.get(op.node, ())
+        if op.error is None and 'scaleto' in used and len(used) > 1:
+            op.fail('"scaleto" cannot be combined with other methods on the '
+                    'same node')
+
+def coalesce(operations):
+    """
+    Merge the valid operations on the same node into as few scaling requests
+    as possible: ``scaleup`` counts and the counts of drops without a selected
+    instance (``dropcount``) are summed, the last ``scaleto`` wins, and
+    duplicate drops of the same node instance are merged.
+
+    :return: The list of ``(method, infraid, nodename, argument, operations)``
+        tuples, where ``method`` is ``scaleup``, ``scaledown`` (of a selected
+        instance), ``dropcount`` or ``scaleto``; ``argument`` is the count or
+        the node id; and ``operations`` are the operations merged into the
+        request.
+    """
+    requests = list()
+    index = dict()
+    for op in operations:
+        if op.error is not None:
+            continue
+        if op.method == 'scaledown' and op.nodeid is not None:
+            method, argument = 'scaledown', op.nodeid
+        elif op.method == 'scaledown':
+            method, argument = 'dropcount', op.count
+        else:
+            method, argument = op.method, op.count
+        key = (method,) + op.node
+        if method == 'scaledown':
+            key += (op.nodeid,)
+        request = index.get(key)
+        if request is None:
+            request = index[key] = [method, op.infraid, op.nodename, 0, list()]
+            requests.append(request)
+        if method in ('scaleup', 'dropcount'):
+            request[3] += argument
+        else:
+            request[3] = argument
+        request[4].append(op)
+    return [tuple(r) for r in requests]
+
+def execute(operations, scaling, uds=None):
+    """
+    Submit the scaling requests of the valid operations.
+
+    If ``uds`` is specified, everything the requests write to its key-value
+    store is written in one batch, i.e. in one transaction per backend
+    database (see :func:`occo.api.kvbatch.run_batch`); if the batch cannot
+    be written, all requests fail.
+
+    :param scaling: The module implementing the scaling requests
+        (:mod:`occo.enactor.scaling`).
+    :param uds: The UDS the requests are stored in by ``scaling`` (e.g.
+        :data:`occo.infobroker.main_uds`); the requests are written one by
+        one if unspecified.
+    :return: The set of the identifiers of the infrastructures affected.
+    """
+    requests = coalesce(operations)
+
+    def submit():
+        errors = dict()
+        for index, (method, infraid, nodename, argument, ops) \
+                in enumerate(requests):
+            try:
+                if method == 'scaleup':
+                    scaling.add_createnode_request(infraid, nodename, argument)
+                elif method == 'scaledown':
+                    scaling.add_dropnode_request(infraid, nodename, argument)
+                elif method == 'dropcount':
+                    drop_count(infraid, nodename, argument, scaling)
+                else:
+                    scaling.set_scalenode_request(infraid, nodename, argument)
+            except Exception as ex:
+                log.exception('Scaling request %s of %s/%s failed:',
+                              method, infraid, nodename)
+                errors[index] = str(ex)
+        return errors
+
+    if uds is None:
+        errors = submit()
+    else:
+        try:
+            errors = kvbatch.run_batch(uds, submit)
+        except Exception as ex:
+            log.exception('Cannot write the batch of scaling requests:')
+            errors = dict((index, str(ex)) for index in range(len(requests)))
+
+    affected = set()
+    for index, (method, infraid, nodename, argument, ops) \
+            in enumerate(requests):
+        if index in errors:
+            for op in ops:
+                op.fail(errors[index])
+        else:
+            affected.add(infraid)
+    return affected
+
+def drop_count(infraid, nodename, count, scaling, uds=None):
+    """
+    Scale down a node by ``count`` instances, selected by the Enactor.
+
+    ``count`` unselected drop requests are queued, as if the instances were
+    dropped one by one, but written to ``uds`` in a single transaction (see
+    :func:`occo.api.kvbatch.run_batch`). The requests add to the pending ones
+    (including scale-ups and other drops, possibly submitted by other
+    processes), and the Enactor keeps the node above its minimum number of
+    instances; an absolute target computed here could overwrite them.
+
+    :param str infraid: The identifier of the infrastructure.
+    :param str nodename: The name of the node.
+    :param int count: The number of instances to drop.
+    :param scaling: The module implementing the scaling requests
+        (:mod:`occo.enactor.scaling`).
+    :param uds: The UDS the requests are stored in by ``scaling`` (e.g.
+        :data:`occo.infobroker.main_uds`); the requests are written one by
+        one if unspecified, unless called within a batch.
+    """
+    def drop():
+        for _ in range(count):
+            scaling.add_dropnode_request(infraid, nodename, None)
+
+    log.debug('Dropping %d instance(s) of %s/%s', count, infraid, nodename)
+    if uds is None:
+        drop()
+    else:
+        kvbatch.run_batch(uds, drop)
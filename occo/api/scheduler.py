@@ -0,0 +1,477 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Multiplexed maintenance of infrastructures.
+
+Instead of a separate :class:`~occo.api.manager.InfrastructureMaintenanceProcess`
+per infrastructure, a single :class:`MaintenanceScheduler` drives the Enactors
+of many infrastructures from one process: Enactor passes that are due are
+executed on a bounded pool of worker threads. A failing pass only affects the
+infrastructure it belongs to.
+
+Each infrastructure is represented by a :class:`ScheduledMaintenance` object,
+which has the same ``start``/``graceful_terminate`` interface as the
+maintenance processes, so the :class:`~occo.api.manager.InfrastructureManager`
+can use either of them.
+
+Both the maintenance processes and the scheduler use a :class:`PassSchedule`
+to determine the time between the passes of an infrastructure.
+"""
+
+__all__ = ['MaintenanceScheduler', 'ScheduledMaintenance', 'PassSchedule',
+           'CountingInfraProcessor', 'LimitedInfraProcessor', 'pass_slot',
+           'PassSlotTimeout', 'parse_targets']
+
+import threading
+import time
+import random
+import contextlib
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from occo.api.metrics import report_pass
+
+import logging
+log = logging.getLogger('occo.manager_service')
+
+class PassSchedule(object):
+    """
+    Adaptive interval between the Enactor passes of an infrastructure.
+
+    While passes produce instructions (the infrastructure is being built or
+    changed), passes follow each other after ``interval`` seconds. After each
+    pass producing no instructions (the infrastructure has converged), the
+    interval is multiplied by ``backoff``, up to ``max_interval`` seconds. As
+    soon as a pass produces instructions again, the interval snaps back to
+    ``interval``.
+
+    Failed passes are backed off separately: the first failure is followed by
+    ``error_interval`` seconds, subsequent ones by exponentially longer
+    intervals, up to ``max_error_interval``. A successful pass resets the
+    error backoff, and does not affect the backoff of converged passes.
+
+    By default, ``max_interval`` and ``max_error_interval`` are equal to
+    ``interval`` and ``error_interval``, respectively, i.e. the intervals are
+    fixed.
+
+    To keep the passes of many infrastructures from hitting the backends in
+    synchronized waves, each interval is randomly lengthened or shortened by
+    at most ``jitter`` times its length, and the first pass can be delayed by
+    a random fraction of ``interval`` (see :meth:`initial_delay`).
+
+    :param float interval: The interval after passes producing instructions.
+    :param float max_interval: The ceiling of the interval while the
+        infrastructure is converged.
+    :param float backoff: The multiplier of the intervals.
+    :param float error_interval: The interval after the first failed pass;
+        ``interval`` by default.
+    :param float max_error_interval: The ceiling of the interval while passes
+        fail.
+    :param float jitter: The maximum relative random change of the intervals
+        (e.g. ``0.1`` for ±10%).
+    """
+    def __init__(self, interval=10, max_interval=None, backoff=2,
+                 error_interval=None, max_error_interval=None, jitter=0):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_interval = max(interval, max_interval or interval)
+        self.backoff = backoff
+        self.error_interval = interval if error_interval is None \
+                              else error_interval
+        self.max_error_interval = max(self.error_interval,
+                                      max_error_interval or 0)
+        self.current = interval
+        self.current_error = None
+
+    def next_interval(self, instructions=0, error=None):
+        """
+        Compute the interval before the next pass.
+
+        :param int instructions: The number of instructions produced by the
+            last pass.
+        :param error: The exception raised by the last pass, if it failed.
+        """
+        if error is not None:
+            if self.current_error is None:
+                self.current_error = self.error_interval
+            else:
+                self.current_error = min(self.current_error * self.backoff,
+                                         self.max_error_interval)
+            return self.jittered(self.current_error)
+
+        self.current_error = None
+        if instructions:
+            self.current = self.interval
+        else:
+            self.current = min(self.current * self.backoff, self.max_interval)
+        return self.jittered(self.current)
+
+    def jittered(self, interval):
+        if not self.jitter:
+            return interval
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def initial_delay(self):
+        """
+        A random delay of the first pass, uniformly distributed within
+        ``interval``. Used to spread the passes of infrastructures attached at
+        the same time.
+        """
+        return random.uniform(0, self.interval)
+
+class PassSlotTimeout(Exception):
+    """
+    Raised by :func:`pass_slot` if no slot could be acquired in time.
+    """
+
+@contextlib.contextmanager
+def pass_slot(slots, timeout=None):
+    """
+    Limit the number of concurrent passes: hold a slot of the ``slots``
+    semaphore while the body is executed.
+
+    :param slots: A :class:`threading.BoundedSemaphore` or a
+        :class:`multiprocessing.BoundedSemaphore`; no limit if :data:`None`.
+    :param float timeout: The maximum number of seconds to wait for a slot;
+        no limit if :data:`None`.
+    :raise PassSlotTimeout: if no slot can be acquired in ``timeout``
+        seconds; the body is not executed. The pass should be rescheduled.
+    """
+    acquired = slots is not None and slots.acquire(timeout=timeout)
+    if slots is not None and not acquired:
+        raise PassSlotTimeout(
+            'No pass slot available in {0}s'.format(timeout))
+    try:
+        yield
+    finally:
+        if acquired:
+            slots.release()
+
+class CountingInfraProcessor(object):
+    """
+    Wraps an Infrastructure Processor, counting the instructions pushed to it.
+    All other attributes are delegated to the wrapped object.
+    """
+    def __init__(self, infraprocessor):
+        self.infraprocessor = infraprocessor
+        self.count = 0
+
+    def push_instructions(self, infra_id, instructions, *args, **kwargs):
+        if isinstance(instructions, (list, tuple)):
+            self.count += len(instructions)
+        else:
+            self.count += 1
+        return self.infraprocessor.push_instructions(
+                                    infra_id, instructions, *args, **kwargs)
+
+    def reset_count(self):
+        """
+        Reset the counter.
+
+        :return: The number of instructions counted since the last reset.
+        """
+        count, self.count = self.count, 0
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self.infraprocessor, name)
+
+class LimitedInfraProcessor(object):
+    """
+    Wraps an Infrastructure Processor, limiting the number of instructions
+    (cloud operations) executed at the same time: each instruction created
+    through a ``cri_*`` method holds a slot of ``slots`` while it is
+    performed, however the batches are executed (e.g. in parallel). The
+    slots can be shared by multiple Infrastructure Processors (e.g. building
+    many infrastructures at once). All other attributes are delegated to the
+    wrapped object.
+
+    :param slots: A :class:`threading.BoundedSemaphore`; no limit if
+        :data:`None`.
+    """
+    def __init__(self, infraprocessor, slots):
+        self.infraprocessor = infraprocessor
+        self.slots = slots
+
+    def limit(self, instruction):
+        perform = getattr(instruction, 'perform', None)
+        if perform is None:
+            return instruction
+        slots = self.slots
+        def limited_perform(*args, **kwargs):
+            with pass_slot(slots):
+                return perform(*args, **kwargs)
+        instruction.perform = limited_perform
+        return instruction
+
+    def __getattr__(self, name):
+        attr = getattr(self.infraprocessor, name)
+        if self.slots is None or not name.startswith('cri_'):
+            return attr
+        def create_instruction(*args, **kwargs):
+            return self.limit(attr(*args, **kwargs))
+        return create_instruction
+
+class ScheduledMaintenance(object):
+    """
+    The maintenance of a single infrastructure by a
+    :class:`MaintenanceScheduler`. The Enactor and the corresponding
+    Infrastructure Processor are created on the first pass.
+
+    :param scheduler: The :class:`MaintenanceScheduler` to run the passes.
+    :param str infra_id: The identifier of the already submitted
+        infrastructure.
+    :param float enactor_interval: The number of seconds to elapse between
+        Enactor passes.
+    :param str process_strategy: The identifier of the processing strategy for
+        Infrastructure Processor
+    :param schedule: The :class:`PassSchedule` of the infrastructure; a fixed
+        ``enactor_interval`` by default.
+    :param float wakeup_debounce: The number of seconds to wait after a
+        wake-up request (see :meth:`wake`) before starting the pass.
+    :param bool stagger: Delay the first pass randomly; see
+        :meth:`PassSchedule.initial_delay`.
+    :param pass_slots: A semaphore limiting the number of concurrent passes;
+        see :func:`pass_slot`.
+    :param float pass_slot_timeout: See :func:`pass_slot`.
+    :param metrics: The :class:`~occo.api.metrics.PassMetrics` to record the
+        passes in; not recorded by default.
+    """
+    def __init__(self, scheduler, infra_id, enactor_interval=10,
+                 process_strategy='sequential', schedule=None,
+                 wakeup_debounce=0.1, stagger=False, pass_slots=None,
+                 pass_slot_timeout=None, metrics=None):
+        self.scheduler = scheduler
+        self.infra_id = infra_id
+        self.enactor_interval = enactor_interval
+        self.process_strategy = process_strategy
+        self.schedule = schedule or PassSchedule(enactor_interval)
+        self.wakeup_debounce = wakeup_debounce
+        self.wakeup_pending = False
+        self.stagger = stagger
+        self.pass_slots = pass_slots
+        self.pass_slot_timeout = pass_slot_timeout
+        self.metrics = metrics
+        self.infraprocessor = None
+        self.enactor = None
+        self.next_pass = None
+        self.running = False
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopped = False
+
+    def start(self):
+        """
+        Start maintaining the infrastructure.
+        """
+        log.info('Starting scheduled maintenance of %s', self.infra_id)
+        self.scheduler.add(self)
+
+    def graceful_terminate(self, timeout=60):
+        """
+        Stop maintaining the infrastructure. A pass in progress is waited for
+        at most ``timeout`` seconds; then the pending instructions of the
+        Infrastructure Processor are cancelled.
+        """
+        self.scheduler.remove(self)
+        if not self.idle.wait(timeout):
+            log.warning('Timeout waiting for the pass of %s to finish',
+                        self.infra_id)
+        if self.infraprocessor is not None:
+            self.infraprocessor.cancel_pending()
+
+    def wake(self):
+        """
+        Request an Enactor pass as soon as possible. If a pass is in progress,
+        another one is started after it.
+        """
+        self.scheduler.wake(self)
+
+    def is_alive(self):
+        return not self.stopped
+
+    def make_a_pass(self):
+        """
+        Make an Enactor pass.
+
+        :return: The number of instructions produced by the pass.
+        """
+        with pass_slot(self.pass_slots, self.pass_slot_timeout):
+            if self.enactor is None:
+                from occo.enactor import Enactor
+                from occo.infraprocessor import InfraProcessor
+                self.infraprocessor = CountingInfraProcessor(
+                                    InfraProcessor.instantiate(
+                                        protocol='basic',
+                                        process_strategy=self.process_strategy))
+                self.enactor = Enactor(self.infra_id, self.infraprocessor)
+            self.infraprocessor.reset_count()
+            self.enactor.make_a_pass()
+            return self.infraprocessor.reset_count()
+
+class MaintenanceScheduler(object):
+    """
+    Drives the Enactor passes of many infrastructures on a bounded pool of
+    worker threads.
+
+    A single scheduler thread dispatches the passes that are due to the
+    worker pool. At most one pass of an infrastructure is executed at a time;
+    the next pass of an infrastructure is scheduled when its previous pass has
+    finished.
+
+    :param int workers: The maximum number of concurrent Enactor passes.
+    """
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.cond = threading.Condition()
+        self.entries = dict()
+        self.thread = None
+        self.stopping = False
+
+    def add(self, entry):
+        """
+        Schedule the maintenance of an infrastructure; its first pass is due
+        immediately, or after a random delay if ``entry.stagger`` is set.
+
+        :param entry: The :class:`ScheduledMaintenance` object.
+        """
+        with self.cond:
+            entry.next_pass = time.time()
+            if entry.stagger:
+                entry.next_pass += entry.schedule.initial_delay()
+            entry.stopped = False
+            self.entries[entry.infra_id] = entry
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name='MaintenanceScheduler')
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+    def remove(self, entry):
+        """
+        Stop scheduling passes for an infrastructure. A pass already in
+        progress is not interrupted.
+        """
+        with self.cond:
+            if self.entries.get(entry.infra_id) is entry:
+                del self.entries[entry.infra_id]
+            entry.stopped = True
+            self.cond.notify()
+
+    def wake(self, entry):
+        """
+        Make the next pass of an infrastructure due in ``wakeup_debounce``
+        seconds, so a burst of wake-up requests triggers a single pass.
+        """
+        with self.cond:
+            if entry.running:
+                entry.wakeup_pending = True
+            elif entry.next_pass is not None:
+                entry.next_pass = min(entry.next_pass,
+                                      time.time() + entry.wakeup_debounce)
+                self.cond.notify()
+
+    def shutdown(self):
+        """
+        Stop the scheduler. Passes in progress are not interrupted, but no new
+        passes are started.
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        log.debug('Starting maintenance scheduler')
+        with self.cond:
+            while not self.stopping:
+                now = time.time()
+                next_due = None
+                for entry in list(self.entries.values()):
+                    if entry.running:
+                        continue
+                    if entry.next_pass <= now:
+                        entry.running = True
+                        entry.idle.clear()
+                        self.pool.submit(self.run_pass, entry)
+                    elif next_due is None or entry.next_pass < next_due:
+                        next_due = entry.next_pass
+                self.cond.wait(None if next_due is None else next_due - now)
+        log.debug('Maintenance scheduler stopped')
+
+    def run_pass(self, entry):
+        interval = None
+        started = time.time()
+        try:
+            if not entry.stopped:
+                instructions = entry.make_a_pass()
+                report_pass(entry.metrics, entry.infra_id, started,
+                            instructions)
+                interval = entry.schedule.next_interval(instructions)
+        except PassSlotTimeout as ex:
+            log.warning('Skipping the pass of %s: %s', entry.infra_id, ex)
+            interval = entry.schedule.interval
+        except Exception as ex:
+            log.error('Unexpected error maintaining %s:', entry.infra_id)
+            log.debug(traceback.format_exc())
+            log.error(str(ex))
+            report_pass(entry.metrics, entry.infra_id, started, error=ex)
+            interval = entry.schedule.next_interval(error=ex)
+        finally:
+            with self.cond:
+                if entry.wakeup_pending:
+                    interval = entry.wakeup_debounce
+                    entry.wakeup_pending = False
+                entry.running = False
+                entry.next_pass = time.time() + (interval or 0)
+                entry.idle.set()
+                self.cond.notify()
+
+def parse_targets(values, default_interval, list_infrastructures):
+    """
+    Parse the infrastructures to be maintained (``occopus-maintain -i``),
+    given as ``INFRAID[:SECONDS]``. ``all`` is expanded to the active
+    infrastructures not specified explicitly.
+
+    :param list values: The specified infrastructures.
+    :param float default_interval: The interval of the infrastructures
+        specified without one.
+    :param callable list_infrastructures: Returns the identifiers of the
+        active infrastructures.
+    :return: ``(targets, multiple)``; the list of ``(infra_id, interval)``
+        pairs, and whether multiple infrastructures were requested (more
+        than one value, or ``all``, however many infrastructures it expands
+        to).
+    """
+    targets, everything = list(), None
+    for value in values:
+        infra_id, interval = value, default_interval
+        head, sep, seconds = value.rpartition(':')
+        if sep:
+            try:
+                infra_id, interval = head, float(seconds)
+            except ValueError:
+                pass
+        if infra_id == 'all':
+            everything = interval
+        else:
+            targets.append((infra_id, interval))
+    if everything is not None:
+        explicit = set(infra_id for infra_id, _ in targets)
+        targets.extend((infra_id, everything)
+                       for infra_id in list_infrastructures()
+                       if infra_id not in explicit)
+    return targets, len(values) > 1 or everything is not None
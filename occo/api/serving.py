@@ -0,0 +1,142 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Serving engines for the REST interface.
+
+The engine is selected with the ``server`` item of the ``rest`` section of the
+components configuration:
+
+.. code:: yaml
+
+    rest:
+        host: 0.0.0.0
+        port: 5000
+        server: cheroot
+        threads: 16
+        max_threads: 64
+        request_queue_size: 32
+        timeout: 60
+        keep_alive_conn_limit: 10
+        shutdown_timeout: 30
+
+``development``
+    Flask's built-in debug server with the reloader. This is the default, and
+    it is only suitable for development: it serves requests with a single debug
+    server, and the reloader spawns a second copy of the service. Only that
+    copy serves requests; see :func:`serving_process`.
+
+``cheroot``
+    A multi-threaded, production-grade WSGI server (requires the ``cheroot``
+    package). Requests are served by a bounded thread pool within a single
+    process, so the :class:`~occo.api.manager.InfrastructureManager` and its
+    process table are shared by all requests. Connections are kept alive
+    between requests; ``timeout`` limits the time a connection may stay idle
+    or spend sending a request. On ``SIGTERM`` or Ctrl+C the server stops
+    accepting connections and waits at most ``shutdown_timeout`` seconds for
+    the requests in progress to finish.
+"""
+
+__all__ = ['serve', 'serving_process', 'ENGINES']
+
+import os
+import signal
+import logging
+
+log = logging.getLogger('occo.manager-service')
+
+DEFAULTS = dict(threads=16,
+                max_threads=-1,
+                request_queue_size=32,
+                timeout=60,
+                keep_alive_conn_limit=10,
+                shutdown_timeout=30)
+"""Default parameters of the ``cheroot`` engine."""
+
+def serve_development(app, host, port, cfg):
+    """
+    Serve ``app`` with Flask's built-in debug server.
+    """
+    app.run(debug=True, host=host, port=port)
+
+def serve_cheroot(app, host, port, cfg):
+    """
+    Serve ``app`` with a thread-pooled :mod:`cheroot` WSGI server.
+
+    ``SIGTERM`` is treated as Ctrl+C, so both drain the server gracefully
+    before :exc:`KeyboardInterrupt` is propagated to the caller.
+    """
+    from cheroot import wsgi
+
+    params = dict(DEFAULTS)
+    params.update((k, v) for k, v in cfg.items() if k in DEFAULTS)
+
+    server = wsgi.Server((host, port), app,
+                         numthreads=params['threads'],
+                         max=params['max_threads'],
+                         request_queue_size=params['request_queue_size'],
+                         timeout=params['timeout'],
+                         shutdown_timeout=params['shutdown_timeout'])
+    server.keep_alive_conn_limit = params['keep_alive_conn_limit']
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, terminate)
+
+    log.info('Serving on %s:%s with %d threads', host, port, params['threads'])
+    try:
+        server.start()
+    finally:
+        log.info('Draining requests in progress (timeout: %ss)',
+                 params['shutdown_timeout'])
+        server.stop()
+
+ENGINES = dict(development=serve_development,
+               cheroot=serve_cheroot)
+"""The available serving engines."""
+
+def serving_process(cfg):
+    """
+    Check whether the current process is the one serving the requests. With
+    the ``development`` engine, the process started first only runs the
+    reloader, which starts the serving process (with ``WERKZEUG_RUN_MAIN``
+    set) and restarts it on code changes; background work of the service
+    (e.g. reattaching infrastructures) must not be started in the reloader
+    process too.
+
+    :param dict cfg: The ``rest`` section of the components configuration.
+    """
+    if cfg.get('server', 'development') != 'development':
+        return True
+    return os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+def serve(app, cfg, host=None, port=None):
+    """
+    Serve a WSGI application with the engine selected in the configuration.
+
+    :param app: The WSGI (Flask) application.
+    :param dict cfg: The ``rest`` section of the components configuration.
+    :param str host: Overrides ``host`` in ``cfg`` if specified.
+    :param int port: Overrides ``port`` in ``cfg`` if specified.
+    :raise ValueError: if the configured engine is unknown.
+    """
+    host = cfg.get('host') if host is None else host
+    port = cfg.get('port') if port is None else port
+    engine = cfg.get('server', 'development')
+    try:
+        serve_fn = ENGINES[engine]
+    except KeyError:
+        raise ValueError('Unknown serving engine', engine, list(ENGINES))
+    log.debug('Using serving engine %r', engine)
+    serve_fn(app, host, port, cfg)
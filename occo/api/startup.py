@@ -0,0 +1,267 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Startup of short-lived OCCO applications.
+
+The ``autoimport`` section of the configuration imports every plugin
+(resource handlers, config managers, infra processors, ...) an OCCO
+application may need, although most commands touch only a few of them.
+
+:class:`LazyPlugins` defers the execution of plugin modules: they are
+imported as lazy modules (see :class:`importlib.util.LazyLoader`), and
+executed when first used. As plugins register themselves in their factory
+(:class:`occo.util.factory.MultiBackend`) when executed, :meth:`LazyPlugins.hook`
+makes the factory load the deferred plugins on demand, when a backend is
+requested that has not been registered yet.
+
+:class:`ImportProfiler` measures the time spent importing modules, per
+component, and the time of other startup phases (e.g. loading the
+configuration). See :func:`occo.api.occoapp.setup`.
+"""
+
+__all__ = ['LazyPlugins', 'ImportProfiler', 'component',
+           'plugins', 'profiler', 'PROFILE_FLAG']
+
+import contextlib
+import importlib.machinery
+import importlib.util
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger('occo.occoapp')
+
+PROFILE_FLAG = '--profile-startup'
+"""Command line flag enabling the startup profiler."""
+
+def component(module_name):
+    """
+    The component a module belongs to: the OCCO package (or plugin) for OCCO
+    modules (e.g. ``occo.infobroker``, ``occo.plugins.resourcehandler.ec2``),
+    the top-level package otherwise.
+    """
+    parts = module_name.split('.')
+    if parts[0] != 'occo':
+        return parts[0]
+    return '.'.join(parts[:4] if parts[1:2] == ['plugins'] else parts[:2])
+
+class LazyPlugins(object):
+    """
+    Meta path finder deferring the execution of plugin modules.
+
+    Only modules are deferred, packages are imported normally.
+
+    :param str prefix: The prefix of the names of the plugin modules.
+    """
+    def __init__(self, prefix='occo.plugins.'):
+        self.prefix = prefix
+        self.deferred = list()
+        self.lock = threading.RLock()
+        self.installed = False
+
+    def install(self):
+        with self.lock:
+            if not self.installed:
+                sys.meta_path.insert(0, self)
+                self.installed = True
+
+    def uninstall(self):
+        with self.lock:
+            if self.installed:
+                sys.meta_path.remove(self)
+                self.installed = False
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not fullname.startswith(self.prefix):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or spec.submodule_search_locations is not None \
+                or not hasattr(spec.loader, 'exec_module'):
+            return None
+        log.debug('Deferring plugin %s', fullname)
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        with self.lock:
+            self.deferred.append(fullname)
+        return spec
+
+    def load(self, match=None):
+        """
+        Execute deferred plugin modules.
+
+        :param str match: Only load the plugins whose name (the last part of
+            the module name) contains this string. All deferred plugins are
+            loaded if unspecified.
+        :return: The names of the modules loaded.
+        """
+        with self.lock:
+            names = [n for n in self.deferred
+                     if match is None or match in n.rsplit('.', 1)[-1]]
+            for name in names:
+                self.deferred.remove(name)
+                module = sys.modules.get(name)
+                if module is not None:
+                    log.debug('Loading plugin %s', name)
+                    timer = profiler.importing(name) if profiler.active \
+                            else contextlib.nullcontext()
+                    with timer:
+                        # Any attribute access executes a lazy module
+                        module.__dict__
+            return names
+
+    def hook(self, factory_class):
+        """
+        Make ``factory_class.instantiate`` load the deferred plugins when the
+        requested backend has not been registered. The plugins whose name
+        contains the name of the backend are tried first.
+
+        :param factory_class: The common base class of the factories; the
+            registered backends are expected in its ``backends`` dictionary.
+        :return: :data:`False` if ``factory_class`` does not provide
+            ``instantiate`` to be hooked.
+        """
+        original = factory_class.__dict__.get('instantiate')
+        if not isinstance(original, classmethod):
+            return False
+        instantiate = original.__func__
+        plugins = self
+
+        def lazy_instantiate(cls, *args, **kwargs):
+            protocol = kwargs.get('protocol', args[0] if args else None)
+            if protocol not in getattr(cls, 'backends', {}) and plugins.deferred:
+                if isinstance(protocol, str):
+                    plugins.load(protocol)
+                if protocol not in getattr(cls, 'backends', {}):
+                    plugins.load()
+            return instantiate(cls, *args, **kwargs)
+
+        lazy_instantiate.__doc__ = instantiate.__doc__
+        factory_class.instantiate = classmethod(lazy_instantiate)
+        return True
+
+class _TimedLoader(object):
+    def __init__(self, loader, profiler, name):
+        self.loader = loader
+        self.profiler = profiler
+        self.name = name
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Restore the original loader, as some libraries rely on its type
+        module.__loader__ = module.__spec__.loader = self.loader
+        with self.profiler.importing(self.name):
+            self.loader.exec_module(module)
+
+class ImportProfiler(object):
+    """
+    Meta path finder measuring the time of imports.
+
+    The time of an import is accounted to the component of the module (see
+    :func:`component`), excluding the time of the imports it triggers.
+    """
+    def __init__(self):
+        self.imports = OrderedDict()
+        self.phases = OrderedDict()
+        self.stack = list()
+        self.started = None
+        self.local = threading.local()
+
+    @property
+    def active(self):
+        return self in sys.meta_path
+
+    def start(self):
+        if not self.active:
+            if self.started is None:
+                self.started = time.time()
+            sys.meta_path.insert(0, self)
+
+    def stop(self):
+        if self.active:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self.local, 'finding', False):
+            return None
+        self.local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self.local.finding = False
+        if hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+
+    @contextlib.contextmanager
+    def importing(self, name):
+        frame = [name, 0.0]
+        self.stack.append(frame)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1][1] += elapsed
+            key = component(name)
+            self.imports[key] = self.imports.get(key, 0) + elapsed - frame[1]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Measure the time of a startup phase.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.time() - start
+
+    def report(self, stream=None, limit=None):
+        """
+        Print the time of the startup phases and of imports by component,
+        in descending order.
+
+        :param int limit: Only print the slowest components.
+        """
+        stream = stream or sys.stderr
+        imports = sorted(self.imports.items(), key=lambda i: i[1], reverse=True)
+        stream.write('Startup profile:\n')
+        if self.started is not None:
+            stream.write('  {0:<48} {1:8.3f}s\n'.format(
+                'total', time.time() - self.started))
+        for name, elapsed in self.phases.items():
+            stream.write('  {0:<48} {1:8.3f}s\n'.format(name, elapsed))
+        stream.write('  {0:<48} {1:8.3f}s\n'.format(
+            'imports', sum(self.imports.values())))
+        for name, elapsed in imports[:limit]:
+            stream.write('    {0:<46} {1:8.3f}s\n'.format(name, elapsed))
+
+plugins = LazyPlugins()
+"""Deferred plugins of this application."""
+
+profiler = ImportProfiler()
+"""Startup profiler of this application."""
@@ -0,0 +1,156 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+"""
+Concurrent teardown of infrastructures.
+
+:func:`drop_nodes` drops node instances on a bounded pool of threads, each
+node with its own drop instruction, so a slow or failing node does not hold
+up the others. Failed drops are retried; drops can be given a timeout, after
+which they release their worker, but are still waited for. The progress is
+reported through a callback after each node.
+
+Used by :func:`occo.api.occoapp.teardown` when ``max_workers`` is specified.
+"""
+
+__all__ = ['drop_nodes', 'TeardownError', 'log_progress']
+
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, \
+    TimeoutError as FutureTimeout
+
+import logging
+log = logging.getLogger('occo.occoapp')
+
+class TeardownError(Exception):
+    """
+    Raised when some of the node instances could not be dropped.
+
+    :param dict failed: The error messages by the identifiers of the node
+        instances that could not be dropped.
+    """
+    def __init__(self, infra_id, failed):
+        super(TeardownError, self).__init__(
+            'Cannot drop {0} node(s) of infrastructure {1}: {2}'.format(
+                len(failed), infra_id,
+                ', '.join(sorted(failed))))
+        self.infra_id = infra_id
+        self.failed = failed
+
+def log_progress(done, total, node_id, error):
+    """
+    A progress callback logging the progress of the teardown.
+    """
+    if error:
+        log.warning('Cannot drop node %s (%d/%d): %s',
+                    node_id, done, total, error)
+    else:
+        log.info('Dropped node %s (%d/%d)', node_id, done, total)
+
+def drop_nodes(infra_id, ip, nodes, max_workers=8, retries=2, timeout=None,
+               retry_delay=1, progress=None):
+    """
+    Drop node instances concurrently.
+
+    :param str infra_id: The identifier of the infrastructure.
+    :param ip: The Infrastructure Processor to push the instructions to.
+    :param list nodes: The node instances to drop.
+    :param int max_workers: The maximum number of concurrent drops.
+    :param int retries: The number of times a failed drop is retried. The
+        delay between the attempts is doubled after each retry, starting from
+        ``retry_delay`` seconds.
+    :param float timeout: The number of seconds a drop attempt may occupy a
+        worker, counted from the start of the attempt. A timed out attempt
+        is not retried, and keeps running outside the pool (beyond
+        ``max_workers``); its outcome is reported when it finishes, as the
+        function returns only after all attempts have finished. No timeout by
+        default.
+    :param callable progress: Called as ``progress(done, total, node_id,
+        error)`` after each node has been dropped or has failed; ``error`` is
+        :data:`None` on success.
+    :return: The error messages by the identifiers of the node instances that
+        could not be dropped.
+    :rtype: dict
+    """
+    def push(node):
+        ip.push_instructions(infra_id, [ip.cri_drop_node(node)])
+
+    def start(node):
+        # The attempt gets its own thread, so its timeout starts with it.
+        future = Future()
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                push(node)
+            except BaseException as ex:
+                future.set_exception(ex)
+            else:
+                future.set_result(None)
+        thread = threading.Thread(target=run,
+                                  name='drop-{0}'.format(node['node_id']))
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def drop(node):
+        delay = retry_delay
+        for attempt in range(retries + 1):
+            try:
+                if timeout is None:
+                    push(node)
+                else:
+                    future = start(node)
+                    try:
+                        future.result(timeout)
+                    except FutureTimeout:
+                        log.warning('Dropping node %s takes longer than %ss',
+                                    node['node_id'], timeout)
+                        return future
+                return None
+            except Exception as ex:
+                error = str(ex) or repr(ex)
+                if attempt < retries:
+                    log.debug('Dropping node %s failed (%s); retrying in %ss',
+                              node['node_id'], error, delay)
+                    time.sleep(delay)
+                    delay *= 2
+        return error
+
+    failed = dict()
+    total = len(nodes)
+    done = [0]
+
+    def report(node_id, error):
+        done[0] += 1
+        if error is not None:
+            failed[node_id] = error
+        if progress:
+            progress(done[0], total, node_id, error)
+
+    timed_out = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = dict((pool.submit(drop, node), node['node_id'])
+                       for node in nodes)
+        for future in as_completed(futures):
+            result = future.result()
+            if isinstance(result, Future):
+                timed_out[result] = futures[future]
+            else:
+                report(futures[future], result)
+    for future in as_completed(timed_out):
+        error = future.exception()
+        report(timed_out[future],
+               None if error is None else str(error) or repr(error))
+    return failed
@@ -0,0 +1,205 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import tempfile
+import os
+import shutil
+from occo.api.cache import InfrastructureIndex, NodeNameCache, TTLCache, \
+    CompilationCache, normalize
+
+class CountingStore(object):
+    def __init__(self, *ids):
+        self.ids = list(ids)
+        self.loads = 0
+    def get(self):
+        self.loads += 1
+        return list(self.ids)
+
+class TestInfrastructureIndex(unittest.TestCase):
+    def test_lookup_from_memory(self):
+        store = CountingStore('a', 'b')
+        index = InfrastructureIndex(store.get, miss_refresh_interval=60)
+        self.assertTrue('a' in index)
+        self.assertTrue('b' in index)
+        self.assertFalse('c' in index)
+        self.assertEqual(store.loads, 1)
+
+    def test_add_remove(self):
+        store = CountingStore('a')
+        index = InfrastructureIndex(store.get, miss_refresh_interval=60)
+        self.assertTrue('a' in index)
+        index.add('b')
+        index.remove('a')
+        self.assertTrue('b' in index)
+        self.assertFalse('a' in index)
+        self.assertEqual(store.loads, 1)
+
+    def test_revalidation(self):
+        store = CountingStore('a')
+        index = InfrastructureIndex(store.get, refresh_interval=0)
+        self.assertTrue('a' in index)
+        store.ids = ['b']
+        self.assertFalse('a' in index)
+        self.assertTrue('b' in index)
+
+    def test_miss_triggers_refresh(self):
+        store = CountingStore('a')
+        index = InfrastructureIndex(store.get, miss_refresh_interval=0)
+        self.assertTrue('a' in index)
+        store.ids.append('b')
+        self.assertTrue('b' in index)
+        self.assertEqual(store.loads, 2)
+
+class TestNodeNameCache(unittest.TestCase):
+    def setUp(self):
+        self.loads = []
+        self.nodes = dict(i1=['a', 'b'], i2=['c'])
+        def load(infra_id):
+            self.loads.append(infra_id)
+            return self.nodes[infra_id]
+        self.cache = NodeNameCache(load, miss_refresh_interval=60)
+
+    def test_lookup_from_memory(self):
+        self.assertTrue(self.cache.contains('i1', 'a'))
+        self.assertTrue(self.cache.contains('i1', 'b'))
+        self.assertFalse(self.cache.contains('i1', 'c'))
+        self.assertTrue(self.cache.contains('i2', 'c'))
+        self.assertEqual(self.loads, ['i1', 'i2'])
+
+    def test_invalidate(self):
+        self.assertFalse(self.cache.contains('i1', 'd'))
+        self.nodes['i1'] = ['d']
+        self.cache.invalidate('i1')
+        self.assertTrue(self.cache.contains('i1', 'd'))
+        self.assertEqual(self.cache.get('i1'), frozenset(['d']))
+        self.assertEqual(self.loads, ['i1', 'i1'])
+
+class TestTTLCache(unittest.TestCase):
+    def test_get_computes_once(self):
+        computed = []
+        def compute(key):
+            computed.append(key)
+            return key.upper()
+        c = TTLCache(max_age=60)
+        self.assertEqual(c.get('a', compute), 'A')
+        self.assertEqual(c.get('a', compute), 'A')
+        self.assertEqual(computed, ['a'])
+
+    def test_expired_items_are_kept(self):
+        c = TTLCache(max_age=-1)
+        self.assertIsNone(c.lookup('a'))
+        c.store('a', 1)
+        self.assertEqual(c.lookup('a'), (1, False))
+        self.assertEqual(c.get('a', lambda key: 2), 2)
+
+    def test_eviction(self):
+        c = TTLCache(max_age=60, max_size=2)
+        for key in 'abc':
+            c.store(key, key)
+        self.assertIsNone(c.lookup('a'))
+        self.assertEqual(c.lookup('c'), ('c', True))
+
+class Compiled(object):
+    def __init__(self, desc, infra_id):
+        self.infra_id = infra_id or 'generated'
+        self.name = desc['name']
+        self.nodes = [dict(node, infra_id=self.infra_id)
+                      for node in desc['nodes']]
+        self.node_lookup = dict((n['name'], n) for n in self.nodes)
+
+class TestCompilationCache(unittest.TestCase):
+    def setUp(self):
+        self.compiled = []
+        self.node_defs = {'t1': ['def1']}
+        def compile(desc, infra_id):
+            self.compiled.append(infra_id)
+            return Compiled(normalize(desc), infra_id)
+        self.compile = compile
+        self.cache = CompilationCache(compile, self.node_defs.__getitem__,
+                                      max_size=2)
+
+    DESC = 'name: x\nnodes:\n  - {name: a, type: t1}\n'
+
+    def test_hit_is_rebound(self):
+        first = self.cache.get(self.DESC, 'i1')
+        second = self.cache.get('nodes: [{type: t1, name: a}]\nname: x', 'i2')
+        self.assertEqual(self.compiled, ['i1'])
+        self.assertEqual(first.nodes[0]['infra_id'], 'i1')
+        self.assertEqual(second.infra_id, 'i2')
+        self.assertEqual(second.nodes[0]['infra_id'], 'i2')
+        self.assertIsNot(second.nodes, first.nodes)
+        self.assertIs(second.node_lookup['a'], second.nodes[0])
+        third = self.cache.get(self.DESC)
+        self.assertNotIn(third.infra_id, ('i1', 'i2'))
+
+    def test_miss_is_a_copy(self):
+        first = self.cache.get(self.DESC, 'i1')
+        first.nodes[0]['type'] = 'changed'
+        second = self.cache.get(self.DESC, 'i2')
+        self.assertEqual(second.nodes[0]['type'], 't1')
+
+    def test_only_infra_ids_are_rebound(self):
+        desc = 'name: i1\nnodes:\n  - {name: i1, type: t1}\n'
+        compiled = self.cache.get(desc, 'i1')
+        self.cache.get(desc, 'i2')
+        second = self.cache.get(desc, 'i3')
+        self.assertEqual((second.infra_id, second.name), ('i3', 'i1'))
+        self.assertEqual(second.nodes[0]['name'], 'i1')
+        self.assertEqual(compiled.infra_id, 'i1')
+
+    def test_node_definitions_are_part_of_the_key(self):
+        self.cache.get(self.DESC, 'i1')
+        self.node_defs['t1'] = ['def2']
+        self.cache.get(self.DESC, 'i2')
+        self.assertEqual(self.compiled, ['i1', 'i2'])
+
+    def test_uncachable(self):
+        desc = 'name: x\nnodes:\n  - {name: a, type: unknown}\n'
+        self.cache.get(desc, 'i1')
+        self.cache.get(desc, 'i2')
+        self.assertEqual(self.compiled, ['i1', 'i2'])
+
+    def test_lru_eviction(self):
+        descs = ['name: {0}\nnodes: []\n'.format(n) for n in 'abc']
+        for desc in descs:
+            self.cache.get(desc)
+        self.cache.get(descs[2])
+        self.cache.get(descs[0])
+        self.assertEqual(len(self.compiled), 4)
+
+    def test_persistent(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = CompilationCache(self.compile, self.node_defs.__getitem__,
+                                     directory=directory)
+            cache.get(self.DESC, 'i1')
+            cache = CompilationCache(self.compile, self.node_defs.__getitem__,
+                                     directory=directory)
+            self.assertEqual(cache.get(self.DESC, 'i2').infra_id, 'i2')
+            self.assertEqual(self.compiled, ['i1'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shared_directory_is_not_used(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.chmod(directory, 0o777)
+            cache = CompilationCache(self.compile, self.node_defs.__getitem__,
+                                     directory=directory)
+            cache.get(self.DESC, 'i1')
+            self.assertIsNone(cache.directory)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
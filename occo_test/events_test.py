@@ -0,0 +1,60 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.api.events import ChangeFeeds, diff_reports
+
+def report(state, address, target):
+    return dict(node=dict(
+        instances=dict(n1=dict(state=state, resource_address=address)),
+        scaling=dict(actual=1, min=1, max=2, target=target)))
+
+class TestDiffReports(unittest.TestCase):
+    def test_no_change(self):
+        r = report('ready', '10.0.0.1', 1)
+        self.assertEqual(diff_reports(r, r), [])
+
+    def test_changes(self):
+        events = diff_reports(report('pending', None, 1),
+                              report('ready', '10.0.0.1', 2))
+        self.assertEqual([e for e, data in events],
+                         ['state', 'resource_address', 'scaling'])
+        self.assertEqual(events[0][1], dict(node='node', node_id='n1',
+                                            old='pending', new='ready'))
+
+    def test_new_instance(self):
+        events = diff_reports(dict(), report('pending', None, 1))
+        self.assertEqual(events[0], ('state', dict(node='node', node_id='n1',
+                                                   old=None, new='pending')))
+
+class TestChangeFeeds(unittest.TestCase):
+    def test_shared_feed(self):
+        snapshots = []
+        reports = [report('pending', None, 1), report('ready', '10.0.0.1', 1)]
+        def snapshot(infra_id):
+            snapshots.append(infra_id)
+            return reports[min(len(snapshots), len(reports)) - 1]
+
+        feeds = ChangeFeeds(snapshot, interval=0.01)
+        sub1 = feeds.subscribe('infra')
+        sub2 = feeds.subscribe('infra')
+        self.assertEqual(len(feeds.feeds), 1)
+        for sub in (sub1, sub2):
+            events = sub.events(heartbeat=5)
+            self.assertEqual(next(events), ('snapshot', reports[0]))
+            self.assertEqual(next(events)[0], 'state')
+            self.assertEqual(next(events)[0], 'resource_address')
+        sub1.close()
+        sub2.close()
+        self.assertEqual(feeds.feeds, dict())
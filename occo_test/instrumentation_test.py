@@ -0,0 +1,65 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.api.metrics import Registry
+from occo.api.instrumentation import InstrumentedInfoBroker
+
+class DummyInfoBroker(object):
+    name = 'dummy'
+
+    def get(self, key, *args, **kwargs):
+        if key == 'bad':
+            raise KeyError(key)
+        return (key, args, kwargs)
+
+class TestInstrumentedInfoBroker(unittest.TestCase):
+    def test_disabled(self):
+        ib = InstrumentedInfoBroker(DummyInfoBroker())
+        self.assertEqual(ib.get('a', 1, x=2), ('a', (1,), dict(x=2)))
+        self.assertEqual(ib.stats()['keys'], {})
+        self.assertEqual(ib.name, 'dummy')
+
+    def test_enabled(self):
+        r = Registry()
+        ib = InstrumentedInfoBroker(DummyInfoBroker(), enabled=True,
+                                    registry=r)
+        ib.get('a')
+        ib.get('a')
+        self.assertRaises(KeyError, ib.get, 'bad')
+        keys = ib.stats()['keys']
+        self.assertEqual(keys['a']['calls'], 2)
+        self.assertEqual(keys['a']['errors'], 0)
+        self.assertEqual(keys['other']['error_rate'], 1.0)
+        self.assertIsNotNone(keys['a']['p99_seconds'])
+        text = r.render()
+        self.assertIn('occopus_infobroker_query_errors_total{key="other"} 1',
+                      text)
+        self.assertIn(
+            'occopus_infobroker_query_duration_seconds_count{key="a"} 2', text)
+        ib.reset()
+        self.assertEqual(ib.stats()['keys'], {})
+
+    def test_bounded_keys(self):
+        r = Registry()
+        ib = InstrumentedInfoBroker(DummyInfoBroker(), enabled=True,
+                                    registry=r, max_keys=2)
+        for key in ['a', 'b', 'c', 'd', 'a']:
+            ib.get(key)
+        self.assertRaises(KeyError, ib.get, 'bad')
+        keys = ib.stats()['keys']
+        self.assertEqual(sorted(keys), ['a', 'b', 'other'])
+        self.assertEqual(keys['a']['calls'], 2)
+        self.assertEqual(keys['other']['calls'], 3)
+        self.assertNotIn('key="c"', r.render())
@@ -0,0 +1,88 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import threading
+import time
+from occo.api.jobs import JobManager
+
+def wait_done(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.done and time.time() < deadline:
+        time.sleep(0.01)
+    return job.to_dict()
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.jobs = JobManager(workers=2, history=2)
+
+    def tearDown(self):
+        self.jobs.shutdown()
+
+    def test_steps(self):
+        def function(job):
+            with job.step('first') as step:
+                step['progress'] = dict(done=1, total=1)
+            with job.step('second'):
+                pass
+            return dict(infraid='i1')
+        status = wait_done(self.jobs.submit('create', function))
+        self.assertEqual(status['state'], 'succeeded')
+        self.assertEqual(status['result'], dict(infraid='i1'))
+        self.assertEqual([(s['name'], s['state']) for s in status['steps']],
+                         [('first', 'succeeded'), ('second', 'succeeded')])
+        self.assertEqual(status['steps'][0]['progress'], dict(done=1, total=1))
+
+    def test_failure(self):
+        def function(job):
+            with job.step('first'):
+                raise RuntimeError('Broken')
+        status = wait_done(self.jobs.submit('destroy', function, infraid='i1'))
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['error'], 'Broken')
+        self.assertEqual(status['infraid'], 'i1')
+        self.assertEqual(status['steps'][0]['state'], 'failed')
+
+    def test_pending_and_history(self):
+        release = threading.Event()
+        blocking = [self.jobs.submit('create', lambda job: release.wait(5))
+                    for i in range(2)]
+        queued = self.jobs.submit('create', lambda job: None)
+        self.assertEqual(queued.to_dict()['state'], 'pending')
+        release.set()
+        for job in blocking + [queued]:
+            wait_done(job)
+        self.jobs.submit('create', lambda job: None)
+        self.assertNotIn(blocking[0], self.jobs.list())
+        self.assertEqual(self.jobs.get(queued.id), queued)
+        self.assertRaises(KeyError, self.jobs.get, blocking[0].id)
+
+    def test_submit_once(self):
+        release = threading.Event()
+        first, created = self.jobs.submit_once(
+            ('destroy', 'i1'), 'destroy', lambda job: release.wait(5))
+        self.assertTrue(created)
+        again, created = self.jobs.submit_once(
+            ('destroy', 'i1'), 'destroy', lambda job: None)
+        self.assertFalse(created)
+        self.assertIs(again, first)
+        other, created = self.jobs.submit_once(
+            ('destroy', 'i2'), 'destroy', lambda job: None)
+        self.assertTrue(created)
+        release.set()
+        wait_done(first)
+        later, created = self.jobs.submit_once(
+            ('destroy', 'i1'), 'destroy', lambda job: None)
+        self.assertTrue(created)
+        self.assertIsNot(later, first)
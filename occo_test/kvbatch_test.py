@@ -0,0 +1,118 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import json
+import threading
+from occo.api.kvbatch import run_batch, BatchingKVStore
+
+class FakePipeline(object):
+    def __init__(self, backend):
+        self.backend = backend
+        self.watched, self.commands = list(), list()
+    def watch(self, key):
+        self.watched.append(key)
+    def multi(self):
+        pass
+    def set(self, key, value):
+        self.commands.append((key, value))
+    def delete(self, key):
+        self.commands.append((key, None))
+    def execute(self):
+        for key, value in self.commands:
+            if value is None:
+                self.backend.data.pop(key, None)
+            else:
+                self.backend.data[key] = value
+        self.backend.transactions += 1
+    def reset(self):
+        self.commands = list()
+
+class FakeBackend(object):
+    def __init__(self):
+        self.data, self.transactions = dict(), 0
+    def pipeline(self, transaction=False):
+        pipeline = FakePipeline(self)
+        self.last_pipeline = pipeline
+        return pipeline
+
+class RedisLikeKVStore(object):
+    """Writes are counted as transactions, like pipelines."""
+    def __init__(self):
+        self.backend = FakeBackend()
+        self.serialize = json.dumps
+    def transform_key(self, key):
+        return self.backend, key
+    def query_item(self, key, default=None):
+        value = self.backend.data.get(key)
+        return default if value is None else json.loads(value)
+    def has_key(self, key):
+        return key in self.backend.data
+    def set_item(self, key, value):
+        self.backend.data[key] = self.serialize(value)
+        self.backend.transactions += 1
+    def delete_key(self, key):
+        self.backend.data.pop(key, None)
+        self.backend.transactions += 1
+
+class UDS(object):
+    def __init__(self, kvstore):
+        self.kvstore = kvstore
+    def add_request(self, key, request):
+        requests = self.kvstore.query_item(key, [])
+        requests.append(request)
+        self.kvstore.set_item(key, requests)
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self.kvs = RedisLikeKVStore()
+        self.uds = UDS(self.kvs)
+
+    def test_single_transaction(self):
+        self.uds.add_request('drop', 'x')
+        def drops():
+            for i in range(3):
+                self.uds.add_request('drop', None)
+            self.uds.kvstore.delete_key('old')
+            return 'done'
+        self.assertEqual(run_batch(self.uds, drops), 'done')
+        self.assertIsInstance(self.uds.kvstore, BatchingKVStore)
+        self.assertEqual(self.kvs.backend.transactions, 2)
+        self.assertEqual(self.kvs.query_item('drop'), ['x', None, None, None])
+        self.assertEqual(self.kvs.backend.last_pipeline.watched, ['drop'])
+
+    def test_failed_batch_is_not_written(self):
+        def fail():
+            self.uds.add_request('drop', None)
+            raise RuntimeError('Failed')
+        self.assertRaises(RuntimeError, run_batch, self.uds, fail)
+        self.assertEqual(self.kvs.backend.data, {})
+
+    def test_nested_and_other_threads(self):
+        def other_thread():
+            thread = threading.Thread(
+                target=self.uds.add_request, args=('other', 1))
+            thread.start()
+            thread.join()
+            self.assertEqual(self.kvs.query_item('other'), [1])
+        def outer():
+            run_batch(self.uds, lambda: self.uds.add_request('drop', 1))
+            other_thread()
+            self.uds.add_request('drop', 2)
+            self.assertIsNone(self.kvs.query_item('drop'))
+        run_batch(self.uds, outer)
+        self.assertEqual(self.kvs.query_item('drop'), [1, 2])
+
+    def test_without_kvstore(self):
+        self.assertEqual(run_batch(object(), lambda: 1), 1)
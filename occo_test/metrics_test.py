@@ -0,0 +1,83 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import multiprocessing
+import time
+from occo.api.metrics import Registry, PassMetrics, QueueReporter, \
+    MetricsCollector, report_pass
+
+class TestRegistry(unittest.TestCase):
+    def test_counter_and_gauge(self):
+        r = Registry()
+        c = r.counter('requests_total', 'Requests.', ('route',))
+        c.inc(route='/a')
+        c.inc(2, route='/a')
+        r.gauge('size', 'Size.').set_function(lambda: {(): 3})
+        text = r.render()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{route="/a"} 3', text)
+        self.assertIn('size 3', text)
+        self.assertRaises(ValueError, c.inc, other='x')
+
+    def test_histogram(self):
+        r = Registry()
+        h = r.histogram('latency', 'Latency.', ('route',), buckets=(1, 5))
+        for v in (0.5, 2, 10):
+            h.observe(v, route='a"b')
+        text = r.render()
+        self.assertIn('latency_bucket{route="a\\"b",le="1"} 1', text)
+        self.assertIn('latency_bucket{route="a\\"b",le="5"} 2', text)
+        self.assertIn('latency_bucket{route="a\\"b",le="+Inf"} 3', text)
+        self.assertIn('latency_sum{route="a\\"b"} 12.5', text)
+        self.assertIn('latency_count{route="a\\"b"} 3', text)
+
+class TestPassMetrics(unittest.TestCase):
+    def test_record_and_forget(self):
+        r = Registry()
+        m = PassMetrics(r)
+        report_pass(m, 'i1', time.time(), 3)
+        report_pass(m, 'i1', time.time(), error=RuntimeError('x'))
+        text = r.render()
+        self.assertIn('occopus_pass_duration_seconds_count{infra_id="i1"} 2',
+                      text)
+        self.assertIn('occopus_pass_errors_total{infra_id="i1"} 1', text)
+        self.assertIn('occopus_pass_instructions_sum{infra_id="i1"} 3', text)
+        self.assertIn(
+            'occopus_seconds_since_last_successful_pass{infra_id="i1"}', text)
+        m.forget('i1')
+        self.assertNotIn('infra_id="i1"', r.render())
+
+    def test_collected_from_queue(self):
+        m = PassMetrics(Registry())
+        q = multiprocessing.Queue()
+        collector = MetricsCollector(q, m)
+        collector.start()
+        report_pass(QueueReporter(q), 'i1', time.time(), 1)
+        collector.stop()
+        collector.thread.join(5)
+        self.assertFalse(collector.thread.is_alive())
+        self.assertIn('i1', m.last_success)
+
+    def test_forget_after_queued_records(self):
+        m = PassMetrics(Registry())
+        q = multiprocessing.Queue()
+        collector = MetricsCollector(q, m)
+        report_pass(QueueReporter(q), 'i1', time.time(), 1)
+        report_pass(QueueReporter(q), 'i2', time.time(), 1)
+        collector.forget('i1')
+        collector.start()
+        collector.stop()
+        collector.thread.join(5)
+        self.assertEqual(sorted(m.last_success), ['i2'])
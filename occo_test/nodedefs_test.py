@@ -0,0 +1,109 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from occo.api.nodedefs import find_files, write_batch, import_files
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def check(data):
+    for value in data.values():
+        if 'image' not in value:
+            raise ValueError('Missing image')
+
+class DictKVStore(dict):
+    pass
+
+class FakePipeline(object):
+    def __init__(self, backend):
+        self.backend, self.pending = backend, dict()
+    def set(self, key, value):
+        self.pending[key] = value
+    def execute(self):
+        self.backend.data.update(self.pending)
+        self.backend.transactions += 1
+
+class FakeBackend(object):
+    def __init__(self):
+        self.data, self.transactions = dict(), 0
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+class PipelinedKVStore(object):
+    def __init__(self):
+        self.backends = dict(node_def=FakeBackend(), other=FakeBackend())
+        self.serialize = json.dumps
+    def transform_key(self, key):
+        prefix, rest = key.split(':', 1)
+        return self.backends.get(prefix, self.backends['other']), rest
+    def __setitem__(self, key, value):
+        raise AssertionError('Items must be written in batches')
+
+class TestNodeDefs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, 'lib', 'sub'))
+        self.write('lib/a.yaml', {'node_def:a': {'image': 1}})
+        self.write('lib/sub/b.yml', {'node_def:b': {'image': 2},
+                                     'node_def:c': {'image': 3}})
+        self.write('lib/README', {})
+        self.write('bad.yaml', {'node_def:d': {}})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            json.dump(data, f)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_find_files(self):
+        self.assertEqual(find_files([self.path('lib'), self.path('bad.yaml')]),
+                         [self.path('lib/a.yaml'), self.path('lib/sub/b.yml'),
+                          self.path('bad.yaml')])
+
+    def test_write_batch(self):
+        kvs = PipelinedKVStore()
+        write_batch(kvs, [('node_def:u@a', 1), ('node_def:u@b', 2),
+                          ('infra:x', 3)])
+        self.assertEqual(kvs.backends['node_def'].data,
+                         {'u@a': '1', 'u@b': '2'})
+        self.assertEqual(kvs.backends['node_def'].transactions, 1)
+        self.assertEqual(kvs.backends['other'].transactions, 1)
+        kvs = DictKVStore()
+        write_batch(kvs, [('node_def:u@a', 1)])
+        self.assertEqual(kvs, {'node_def:u@a': 1})
+
+    def test_import(self):
+        kvs = DictKVStore()
+        summary = import_files(kvs, [self.path('lib'), self.path('bad.yaml'),
+                                     self.path('missing.yaml')],
+                               'u', workers=2, batch_size=2,
+                               load=load_json, check=check)
+        self.assertEqual(sorted(kvs), ['node_def:u@a', 'node_def:u@b',
+                                       'node_def:u@c'])
+        self.assertEqual(summary.imported, ['a', 'b', 'c'])
+        self.assertEqual(summary.files, 4)
+        self.assertEqual(summary.failed[self.path('bad.yaml')],
+                         'Missing image')
+        self.assertIn(self.path('missing.yaml'), summary.failed)
+        self.assertIn('total', summary.report())
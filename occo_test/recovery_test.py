@@ -0,0 +1,71 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from occo.api.recovery import StateFile, reattach
+
+class TestStateFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'state', 'managed.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_load(self):
+        state = StateFile(self.path)
+        self.assertEqual(state.load(), [])
+        state.save(set(['i2', 'i1']))
+        self.assertEqual(StateFile(self.path).load(), ['i1', 'i2'])
+        self.assertEqual(os.listdir(os.path.dirname(self.path)),
+                         ['managed.json'])
+
+    def test_corrupt(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"infra')
+        self.assertEqual(StateFile(self.path).load(), [])
+
+class TestReattach(unittest.TestCase):
+    def test_concurrent(self):
+        lock = threading.Lock()
+        running = [0, 0]
+        def attach(infra_id):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            if infra_id == 'i3':
+                raise RuntimeError('Missing')
+        progress = reattach(attach, ['i{0}'.format(i) for i in range(8)],
+                            workers=4)
+        self.assertTrue(progress.ready.is_set())
+        self.assertEqual(running[1], 4)
+        self.assertEqual(len(progress.attached), 7)
+        self.assertEqual(progress.failed, dict(i3='Missing'))
+        self.assertEqual(progress.to_dict()['total'], 8)
+
+    def test_rate(self):
+        started = list()
+        start = time.time()
+        reattach(lambda i: started.append(time.time() - start),
+                 range(5), workers=5, rate=20)
+        self.assertTrue(max(started) >= 0.19)
@@ -0,0 +1,70 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import io
+import json
+from occo.api.reports import iter_instances, report_all, FORMATS
+
+STATES = dict(
+    i1=dict(web=dict(n1=dict(state='ready',
+                             resource_address=['10.0.0.1', '10.0.0.2']),
+                     n2=dict(state='pending', resource_address='10.0.0.3')),
+            db=dict(n3=dict(state='ready', resource_address=None))),
+    i2=dict(web=dict(n4=dict(state='ready', resource_address='10.0.1.1'))),
+)
+
+def get_state(infra_id):
+    return STATES[infra_id]
+
+class TestReports(unittest.TestCase):
+    def report(self, report_format, infra_ids, fields=None, node_filter=None):
+        stream = io.StringIO()
+        failed = report_all(infra_ids, get_state,
+                            FORMATS[report_format](stream, fields),
+                            node_filter=node_filter)
+        return stream.getvalue(), failed
+
+    def test_iter_instances(self):
+        records = list(iter_instances('i1', STATES['i1'], node_filter='we'))
+        self.assertEqual(sorted(r['node_id'] for r in records), ['n1', 'n2'])
+        self.assertEqual(records[0]['infraid'], 'i1')
+        self.assertEqual(records[0]['nodename'], 'web')
+
+    def test_text(self):
+        output, failed = self.report('text', ['i1'], node_filter='web')
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(output.splitlines()),
+                         ['10.0.0.1 10.0.0.2', '10.0.0.3'])
+        output, failed = self.report('text', ['i1'], node_filter='db')
+        self.assertEqual(output, 'None\n')
+
+    def test_jsonl(self):
+        output, failed = self.report('jsonl', ['i1', 'i2', 'i3'],
+                                     fields=['infraid', 'node_id'])
+        self.assertEqual(list(failed), ['i3'])
+        records = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(sorted((r['infraid'], r['node_id']) for r in records),
+                         [('i1', 'n1'), ('i1', 'n2'), ('i1', 'n3'),
+                          ('i2', 'n4')])
+        infra_ids = [r['infraid'] for r in records]
+        self.assertEqual(infra_ids, sorted(infra_ids, key=infra_ids.index))
+
+    def test_csv(self):
+        output, failed = self.report('csv', ['i1'],
+                                     fields=['node_id', 'resource_address'])
+        lines = output.splitlines()
+        self.assertEqual(lines[0], 'node_id,resource_address')
+        self.assertIn('n1,10.0.0.1 10.0.0.2', lines)
+        self.assertIn('n3,', lines)
@@ -0,0 +1,154 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.api import scalingops
+
+class DummyScaling(object):
+    def __init__(self):
+        self.requests = list()
+
+    def add_createnode_request(self, infraid, nodename, count):
+        self.requests.append(('create', infraid, nodename, count))
+
+    def add_dropnode_request(self, infraid, nodename, nodeid):
+        self.requests.append(('drop', infraid, nodename, nodeid))
+
+    def set_scalenode_request(self, infraid, nodename, count):
+        if nodename == 'broken':
+            raise RuntimeError('Storage error')
+        self.requests.append(('scale', infraid, nodename, count))
+
+class CountingKVStore(dict):
+    def __init__(self):
+        self.writes = 0
+    def query_item(self, key, default=None):
+        return self.get(key, default)
+    def set_item(self, key, value):
+        self.writes += 1
+        self[key] = value
+
+class UDS(object):
+    def __init__(self):
+        self.kvstore = CountingKVStore()
+
+class StoredScaling(DummyScaling):
+    """Stores the requests in the key-value store of a UDS."""
+    def __init__(self, uds):
+        super(StoredScaling, self).__init__()
+        self.uds = uds
+
+    def store(self, request):
+        requests = self.uds.kvstore.query_item('requests', [])
+        self.uds.kvstore.set_item('requests', requests + [request])
+
+    def add_createnode_request(self, infraid, nodename, count):
+        self.store(('create', infraid, nodename, count))
+
+    def add_dropnode_request(self, infraid, nodename, nodeid):
+        self.store(('drop', infraid, nodename, nodeid))
+
+    def set_scalenode_request(self, infraid, nodename, count):
+        if nodename == 'broken':
+            raise RuntimeError('Storage error')
+        self.store(('scale', infraid, nodename, count))
+
+NODES = {'i1': ['a', 'b', 'broken'], 'i2': ['a']}
+
+def run(operations):
+    checked = list()
+    def node_exists(infraid, nodename):
+        checked.append((infraid, nodename))
+        return nodename in NODES[infraid]
+    ops = scalingops.parse(dict(operations=operations))
+    scalingops.validate(ops, lambda i: i in NODES, node_exists)
+    scaling = DummyScaling()
+    affected = scalingops.execute(ops, scaling)
+    return [op.to_dict() for op in ops], scaling.requests, affected, checked
+
+class TestScalingBatch(unittest.TestCase):
+    def test_coalesced(self):
+        results, requests, affected, checked = run([
+            dict(method='scaleup', infraid='i1', nodename='a'),
+            dict(method='scaleup', infraid='i1', nodename='a', count=2),
+            dict(method='scaledown', infraid='i1', nodename='b', nodeid='x'),
+            dict(method='scaledown', infraid='i1', nodename='b', nodeid='x'),
+            dict(method='scaledown', infraid='i1', nodename='b'),
+            dict(method='scaledown', infraid='i1', nodename='b', count=2),
+            dict(method='scaleto', infraid='i2', nodename='a', count=5),
+            dict(method='scaleto', infraid='i2', nodename='a', count=3),
+        ])
+        self.assertEqual([r['status'] for r in results], ['ok'] * 8)
+        self.assertEqual(requests, [('create', 'i1', 'a', 3),
+                                    ('drop', 'i1', 'b', 'x'),
+                                    ('drop', 'i1', 'b', None),
+                                    ('drop', 'i1', 'b', None),
+                                    ('drop', 'i1', 'b', None),
+                                    ('scale', 'i2', 'a', 3)])
+        self.assertEqual(affected, set(['i1', 'i2']))
+        self.assertEqual(sorted(checked), [('i1', 'a'), ('i1', 'b'),
+                                           ('i2', 'a')])
+
+    def test_errors_are_per_operation(self):
+        results, requests, affected, checked = run([
+            dict(method='scaleup', infraid='i1', nodename='a'),
+            dict(method='explode', infraid='i1', nodename='a'),
+            dict(method='scaleup', infraid='i3', nodename='a'),
+            dict(method='scaleup', infraid='i1', nodename='c'),
+            dict(method='scaleto', infraid='i1', nodename='b', count=-1),
+            dict(method='scaleto', infraid='i1', nodename='broken', count=1),
+            dict(method='scaleto', infraid='i2', nodename='a', count=1),
+            dict(method='scaleup', infraid='i2', nodename='a'),
+            'garbage',
+        ])
+        self.assertEqual([r['status'] for r in results],
+                         ['ok'] + ['error'] * 8)
+        self.assertEqual(results[5]['reason'], 'Storage error')
+        self.assertEqual(requests, [('create', 'i1', 'a', 1)])
+        self.assertEqual(affected, set(['i1']))
+
+    def test_single_write(self):
+        uds = UDS()
+        ops = scalingops.parse([
+            dict(method='scaleup', infraid='i1', nodename='a', count=2),
+            dict(method='scaledown', infraid='i1', nodename='b', count=2),
+            dict(method='scaleto', infraid='i1', nodename='broken', count=1),
+            dict(method='scaleto', infraid='i2', nodename='a', count=3),
+        ])
+        affected = scalingops.execute(ops, StoredScaling(uds), uds)
+        self.assertEqual(affected, set(['i1', 'i2']))
+        self.assertEqual([op.error for op in ops],
+                         [None, None, 'Storage error', None])
+        self.assertEqual(uds.kvstore.kvstore.writes, 1)
+        self.assertEqual(uds.kvstore['requests'],
+                         [('create', 'i1', 'a', 2), ('drop', 'i1', 'b', None),
+                          ('drop', 'i1', 'b', None), ('scale', 'i2', 'a', 3)])
+
+    def test_invalid_batch(self):
+        self.assertRaises(ValueError, scalingops.parse, dict(operations=1))
+        self.assertRaises(ValueError, scalingops.parse, None)
+
+class TestDropCount(unittest.TestCase):
+    def test_additive(self):
+        scaling = DummyScaling()
+        scalingops.drop_count('i1', 'b', 2, scaling)
+        scalingops.drop_count('i1', 'b', 1, scaling)
+        self.assertEqual(scaling.requests, [('drop', 'i1', 'b', None)] * 3)
+
+    def test_single_write(self):
+        uds = UDS()
+        scalingops.drop_count('i1', 'b', 3, StoredScaling(uds), uds)
+        self.assertEqual(uds.kvstore.kvstore.writes, 1)
+        self.assertEqual(uds.kvstore['requests'],
+                         [('drop', 'i1', 'b', None)] * 3)
@@ -0,0 +1,216 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import threading
+import time
+from occo.api.scheduler import MaintenanceScheduler, ScheduledMaintenance, \
+    PassSchedule, CountingInfraProcessor, LimitedInfraProcessor, pass_slot, \
+    PassSlotTimeout, parse_targets
+
+class DummyMaintenance(ScheduledMaintenance):
+    def __init__(self, scheduler, infra_id, fail=False, **kwargs):
+        super(DummyMaintenance, self).__init__(scheduler, infra_id, **kwargs)
+        self.fail = fail
+        self.passes = 0
+        self.passed = threading.Event()
+
+    def make_a_pass(self):
+        self.passes += 1
+        self.passed.set()
+        if self.fail:
+            raise RuntimeError('Pass failed')
+
+class TestPassSchedule(unittest.TestCase):
+    def test_fixed_by_default(self):
+        s = PassSchedule(10)
+        self.assertEqual([s.next_interval(0) for i in range(3)], [10, 10, 10])
+        self.assertEqual(s.next_interval(error=Exception()), 10)
+
+    def test_converged_backoff(self):
+        s = PassSchedule(10, max_interval=50)
+        self.assertEqual([s.next_interval(0) for i in range(4)],
+                         [20, 40, 50, 50])
+        self.assertEqual(s.next_interval(3), 10)
+        self.assertEqual(s.next_interval(0), 20)
+
+    def test_error_backoff_is_separate(self):
+        s = PassSchedule(10, max_interval=80, error_interval=1,
+                         max_error_interval=3)
+        self.assertEqual(s.next_interval(0), 20)
+        self.assertEqual([s.next_interval(error=Exception()) for i in range(3)],
+                         [1, 2, 3])
+        self.assertEqual(s.next_interval(0), 40)
+        self.assertEqual(s.next_interval(error=Exception()), 1)
+
+    def test_jitter(self):
+        s = PassSchedule(10, jitter=0.1)
+        for i in range(100):
+            self.assertTrue(9 <= s.next_interval(1) <= 11)
+            self.assertTrue(0 <= s.initial_delay() <= 10)
+
+class TestPassSlot(unittest.TestCase):
+    def test_limit(self):
+        slots = threading.BoundedSemaphore(2)
+        with pass_slot(slots):
+            with pass_slot(slots):
+                self.assertFalse(slots.acquire(blocking=False))
+        self.assertTrue(slots.acquire(blocking=False))
+        slots.release()
+
+    def test_timeout(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        entered = False
+        with self.assertRaises(PassSlotTimeout):
+            with pass_slot(slots, timeout=0.01):
+                entered = True
+        self.assertFalse(entered)
+        slots.release()
+
+    def test_no_limit(self):
+        with pass_slot(None):
+            pass
+
+class DummyInstruction(object):
+    def __init__(self, node):
+        self.node = node
+    def perform(self, infraprocessor):
+        return infraprocessor.performed.append(self.node)
+
+class DummyInfraProcessor(object):
+    def __init__(self):
+        self.performed = list()
+    def push_instructions(self, infra_id, instructions):
+        return infra_id
+    def cri_create_node(self, node):
+        return DummyInstruction(node)
+    def cancel_pending(self):
+        return 'cancelled'
+
+class TestCountingInfraProcessor(unittest.TestCase):
+    def test_counting(self):
+        ip = CountingInfraProcessor(DummyInfraProcessor())
+        self.assertEqual(ip.push_instructions('infra', [1, 2]), 'infra')
+        ip.push_instructions('infra', 3)
+        self.assertEqual(ip.reset_count(), 3)
+        self.assertEqual(ip.reset_count(), 0)
+        self.assertEqual(ip.cancel_pending(), 'cancelled')
+
+class TestLimitedInfraProcessor(unittest.TestCase):
+    def test_limit(self):
+        slots = threading.BoundedSemaphore(1)
+        ip = LimitedInfraProcessor(DummyInfraProcessor(), slots)
+        self.assertEqual(ip.push_instructions('infra', [1]), 'infra')
+        self.assertEqual(ip.cancel_pending(), 'cancelled')
+        instructions = [ip.cri_create_node(n) for n in ('a', 'b')]
+        slots.acquire()
+        performed = threading.Event()
+        def perform():
+            for instruction in instructions:
+                instruction.perform(ip.infraprocessor)
+            performed.set()
+        thread = threading.Thread(target=perform)
+        thread.start()
+        self.assertFalse(performed.wait(0.05))
+        self.assertEqual(ip.infraprocessor.performed, [])
+        slots.release()
+        self.assertTrue(performed.wait(1))
+        thread.join()
+        self.assertEqual(ip.infraprocessor.performed, ['a', 'b'])
+
+    def test_unlimited(self):
+        ip = LimitedInfraProcessor(DummyInfraProcessor(), None)
+        instruction = ip.cri_create_node('a')
+        self.assertNotIn('perform', vars(instruction))
+
+class TestMaintenanceScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = MaintenanceScheduler(workers=2)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def test_passes_are_repeated(self):
+        entries = [DummyMaintenance(self.scheduler, 'infra{0}'.format(i),
+                                    enactor_interval=0.01)
+                   for i in range(5)]
+        for e in entries:
+            e.start()
+        time.sleep(0.2)
+        for e in entries:
+            self.assertTrue(e.passes > 1)
+
+    def test_errors_are_isolated(self):
+        bad = DummyMaintenance(self.scheduler, 'bad', fail=True,
+                               enactor_interval=0.01)
+        good = DummyMaintenance(self.scheduler, 'good', enactor_interval=0.01)
+        bad.start()
+        good.start()
+        time.sleep(0.2)
+        self.assertTrue(bad.passes > 1)
+        self.assertTrue(good.passes > 1)
+
+    def test_slot_timeout_skips_pass(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        e = DummyMaintenance(self.scheduler, 'infra', enactor_interval=0.01,
+                             schedule=PassSchedule(0.01, error_interval=60),
+                             pass_slots=slots, pass_slot_timeout=0.01)
+        e.make_a_pass = lambda: ScheduledMaintenance.make_a_pass(e)
+        e.start()
+        time.sleep(0.2)
+        self.assertIsNone(e.enactor)
+        self.assertIsNone(e.schedule.current_error)
+        e.graceful_terminate(1)
+        slots.release()
+
+    def test_terminate(self):
+        e = DummyMaintenance(self.scheduler, 'infra', enactor_interval=0.01)
+        e.start()
+        self.assertTrue(e.passed.wait(1))
+        e.graceful_terminate(1)
+        passes = e.passes
+        time.sleep(0.1)
+        self.assertEqual(e.passes, passes)
+        self.assertFalse(e.is_alive())
+
+    def test_wake(self):
+        e = DummyMaintenance(self.scheduler, 'infra', enactor_interval=60,
+                             wakeup_debounce=0.05)
+        e.start()
+        self.assertTrue(e.passed.wait(1))
+        time.sleep(0.05)
+        e.passed.clear()
+        for i in range(10):
+            e.wake()
+        self.assertTrue(e.passed.wait(1))
+        time.sleep(0.2)
+        self.assertEqual(e.passes, 2)
+
+class TestParseTargets(unittest.TestCase):
+    def test_explicit(self):
+        self.assertEqual(parse_targets(['i1'], 10, list),
+                         ([('i1', 10)], False))
+        self.assertEqual(parse_targets(['i1:5', 'i2'], 10, list),
+                         ([('i1', 5.0), ('i2', 10)], True))
+
+    def test_all_with_interval(self):
+        for active, expected in [([], []), (['i1'], [('i1', 30.0)]),
+                                 (['i1', 'i2'], [('i1', 30.0), ('i2', 30.0)])]:
+            self.assertEqual(parse_targets(['all:30'], 10, lambda: active),
+                             (expected, True))
+        self.assertEqual(parse_targets(['i2:5', 'all'], 10,
+                                       lambda: ['i1', 'i2']),
+                         ([('i2', 5.0), ('i1', 10)], True))
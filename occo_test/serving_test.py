@@ -0,0 +1,34 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import os
+from occo.api.serving import serving_process
+
+class TestServingProcess(unittest.TestCase):
+    def setUp(self):
+        self.environ = os.environ.pop('WERKZEUG_RUN_MAIN', None)
+
+    def tearDown(self):
+        os.environ.pop('WERKZEUG_RUN_MAIN', None)
+        if self.environ is not None:
+            os.environ['WERKZEUG_RUN_MAIN'] = self.environ
+
+    def test_development_reloader(self):
+        self.assertFalse(serving_process(dict()))
+        os.environ['WERKZEUG_RUN_MAIN'] = 'true'
+        self.assertTrue(serving_process(dict(server='development')))
+
+    def test_single_process_engine(self):
+        self.assertTrue(serving_process(dict(server='cheroot')))
@@ -0,0 +1,96 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import importlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+from occo.api.startup import LazyPlugins, ImportProfiler, component
+
+PLUGIN = '''
+from {0} import Factory
+Factory.backends[{1!r}] = {1!r}
+EXECUTED = True
+'''
+
+class Factory(object):
+    backends = dict()
+
+    @classmethod
+    def instantiate(cls, protocol, *args, **kwargs):
+        return cls.backends[protocol]
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.package = os.path.join(self.dir, 'lazytest_plugins')
+        os.mkdir(self.package)
+        open(os.path.join(self.package, '__init__.py'), 'w').close()
+        for name in ['alpha', 'beta']:
+            with open(os.path.join(self.package, name + '.py'), 'w') as f:
+                f.write(PLUGIN.format(__name__, name))
+        sys.path.insert(0, self.dir)
+        self.saved = Factory.__dict__['instantiate']
+        Factory.backends.clear()
+
+    def tearDown(self):
+        Factory.instantiate = self.saved
+        sys.path.remove(self.dir)
+        for name in list(sys.modules):
+            if name.startswith('lazytest_plugins'):
+                del sys.modules[name]
+        shutil.rmtree(self.dir)
+
+    def test_component(self):
+        self.assertEqual(component('occo.infobroker.uds'), 'occo.infobroker')
+        self.assertEqual(component('occo.plugins.resourcehandler.ec2.x'),
+                         'occo.plugins.resourcehandler.ec2')
+        self.assertEqual(component('ruamel.yaml'), 'ruamel')
+
+    def test_lazy_plugins(self):
+        plugins = LazyPlugins(prefix='lazytest_plugins.')
+        self.assertTrue(plugins.hook(Factory))
+        plugins.install()
+        try:
+            importlib.import_module('lazytest_plugins.alpha')
+            importlib.import_module('lazytest_plugins.beta')
+        finally:
+            plugins.uninstall()
+        self.assertEqual(Factory.backends, {})
+        self.assertEqual(plugins.deferred,
+                         ['lazytest_plugins.alpha', 'lazytest_plugins.beta'])
+        self.assertEqual(Factory.instantiate('beta'), 'beta')
+        self.assertEqual(plugins.deferred, ['lazytest_plugins.alpha'])
+        self.assertEqual(plugins.load(), ['lazytest_plugins.alpha'])
+        self.assertEqual(sorted(Factory.backends), ['alpha', 'beta'])
+
+    def test_profiler(self):
+        profiler = ImportProfiler()
+        profiler.start()
+        try:
+            with profiler.phase('configuration'):
+                import lazytest_plugins.alpha
+        finally:
+            profiler.stop()
+        self.assertTrue(lazytest_plugins.alpha.EXECUTED)
+        self.assertIs(type(lazytest_plugins.alpha.__loader__),
+                      type(lazytest_plugins.__loader__))
+        self.assertIn('lazytest_plugins', profiler.imports)
+        self.assertIn('configuration', profiler.phases)
+        stream = io.StringIO()
+        profiler.report(stream)
+        self.assertIn('lazytest_plugins', stream.getvalue())
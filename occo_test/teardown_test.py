@@ -0,0 +1,89 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import threading
+import time
+from occo.api.teardown import drop_nodes, TeardownError
+
+class DummyInfraProcessor(object):
+    def __init__(self, failures=None, slow=(), slow_time=0.5):
+        self.lock = threading.Lock()
+        self.failures = dict(failures or {})
+        self.slow = slow
+        self.slow_time = slow_time
+        self.dropped = list()
+        self.running = self.max_running = 0
+
+    def cri_drop_node(self, node):
+        return node['node_id']
+
+    def push_instructions(self, infra_id, instructions):
+        node_id, = instructions
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.slow_time if node_id in self.slow else 0.01)
+            with self.lock:
+                if self.failures.get(node_id):
+                    self.failures[node_id] -= 1
+                    raise RuntimeError('Drop failed')
+                self.dropped.append(node_id)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+NODES = [dict(node_id='n{0}'.format(i)) for i in range(10)]
+
+class TestDropNodes(unittest.TestCase):
+    def test_concurrent(self):
+        ip = DummyInfraProcessor()
+        reports = list()
+        failed = drop_nodes('i1', ip, NODES, max_workers=3,
+                            progress=lambda *args: reports.append(args))
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(ip.dropped), sorted(n['node_id'] for n in NODES))
+        self.assertTrue(ip.max_running <= 3)
+        self.assertEqual([r[:2] for r in reports],
+                         [(i, 10) for i in range(1, 11)])
+
+    def test_retries(self):
+        ip = DummyInfraProcessor(failures=dict(n1=1, n2=5))
+        failed = drop_nodes('i1', ip, NODES, retries=2, retry_delay=0)
+        self.assertEqual(failed, dict(n2='Drop failed'))
+        self.assertIn('n1', ip.dropped)
+
+    def test_timeout(self):
+        ip = DummyInfraProcessor(failures=dict(n3=5), slow=['n3', 'n4'])
+        reports = list()
+        failed = drop_nodes('i1', ip, NODES, timeout=0.1,
+                            progress=lambda *args: reports.append(args))
+        self.assertEqual(failed, dict(n3='Drop failed'))
+        self.assertEqual(len(ip.dropped), 9)
+        self.assertEqual([r[2] for r in reports][-2:], ['n3', 'n4'])
+
+    def test_timeout_more_nodes_than_workers(self):
+        ip = DummyInfraProcessor(slow=['n0', 'n1'], slow_time=1)
+        start = time.time()
+        failed = drop_nodes('i1', ip, NODES[:6], max_workers=2, timeout=0.2)
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(ip.dropped[:4]), ['n2', 'n3', 'n4', 'n5'])
+        self.assertEqual(sorted(ip.dropped[4:]), ['n0', 'n1'])
+        self.assertTrue(time.time() - start >= 1)
+
+    def test_error(self):
+        ex = TeardownError('i1', dict(n2='Drop failed'))
+        self.assertEqual(ex.failed, dict(n2='Drop failed'))
+        self.assertIn('n2', str(ex))
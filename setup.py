@@ -51,5 +51,8 @@ setuptools.setup(
         'OCCO-Enactor',
         'OCCO-Compiler',
         'OCCO-InfraProcessor'
-    ]
+    ],
+    extras_require={
+        'server': ['cheroot'],
+    }
 )